@@ -0,0 +1,104 @@
+# batching.py
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from app.config import BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS
+
+
+class MicroBatcher:
+    def __init__(self, service, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS):
+        """
+        Collects concurrent predict() calls and runs them as one batched forward pass.
+        A batch is dispatched as soon as it holds max_batch_size images, or when the
+        oldest queued image has waited max_wait_ms milliseconds, whichever comes first.
+        """
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.service = service
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name="MicroBatcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, image):
+        """
+        Queues a PIL image for prediction and returns a Future resolving to its result dict.
+        """
+        if self._closed:
+            raise RuntimeError("MicroBatcher is closed")
+        future = Future()
+        self._queue.put((image, future))
+        return future
+
+    def predict(self, image, timeout=None):
+        """
+        Blocking helper with the same signature and result format as PlantHealthService.predict().
+        """
+        return self.submit(image).result(timeout=timeout)
+
+    def close(self):
+        """
+        Stops accepting new images, flushes everything already queued and stops the worker.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._worker.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _collect(self, first):
+        """
+        Gathers up to max_batch_size items, waiting at most max_wait after the first one arrived.
+        Returns the batch and whether the shutdown sentinel was seen.
+        """
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is None:
+                break
+            batch, stopping = self._collect(first)
+            # Skip callers that cancelled while waiting in the queue
+            batch = [(image, future) for image, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                results = self.service.predict_batch([image for image, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+        # Drain anything that raced with close()
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                item[1].set_exception(RuntimeError("MicroBatcher is closed"))
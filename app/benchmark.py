@@ -0,0 +1,258 @@
+# benchmark.py
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import time
+
+import torch
+
+from app.instrumentation import configure_logging
+from app.model_store import peak_rss_mb
+from app.precision import IMAGE_EXTENSIONS
+from app.preprocessing import decode_image
+
+DEFAULT_BATCH_SIZES = (1, 2, 4, 8, 16, 32, 64)
+
+
+def percentile(values, q):
+    """
+    Nearest-rank percentile (q in 0..100) of a non-empty sequence.
+    """
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, math.ceil(q / 100 * len(ordered)) - 1))]
+
+
+def load_labelled_images(data_dir="data/PlantVillage", per_class=None, seed=0):
+    """
+    Returns (path, class_name) pairs from a class-per-folder tree, optionally sampling
+    per_class images from each folder (deterministic for a given seed).
+    """
+    rng = random.Random(seed)
+    samples = []
+    for class_name in sorted(os.listdir(data_dir)):
+        class_dir = os.path.join(data_dir, class_name)
+        if not os.path.isdir(class_dir):
+            continue
+        files = sorted(f for f in os.listdir(class_dir) if f.lower().endswith(IMAGE_EXTENSIONS))
+        if per_class is not None:
+            files = sorted(rng.sample(files, min(per_class, len(files))))
+        samples.extend((os.path.join(class_dir, f), class_name) for f in files)
+    return samples
+
+
+def evaluate_accuracy(service, samples, batch_size=32):
+    """
+    Top-1 accuracy per class and overall, plus a confusion matrix (rows: true class, columns: predicted).
+    Folder names are the ground-truth labels and must match the model's id2label names.
+    """
+    size = (service.preprocessor.height, service.preprocessor.width)
+
+    def batches():
+        for start in range(0, len(samples), batch_size):
+            chunk = samples[start:start + batch_size]
+            yield ([service.preprocessor.to_uint8(decode_image(path, target_size=size)) for path, _ in chunk],
+                   [label for _, label in chunk])
+
+    return _accuracy_report(service, batches(), sorted({label for _, label in samples}))
+
+
+def evaluate_packed_accuracy(service, dataset, batch_size=32, rows=None):
+    """
+    evaluate_accuracy() over an app.packed_dataset.PackedDataset (or only the given rows of it):
+    batches are memory-mapped model-resolution arrays, so no image is opened or decoded.
+    """
+    rows = sorted(rows) if rows is not None else range(len(dataset))
+
+    def batches():
+        for start in range(0, len(rows), batch_size):
+            chunk = rows[start:start + batch_size]
+            yield list(dataset.images[chunk]), [dataset.classes[label] for label in dataset.labels[chunk]]
+
+    return _accuracy_report(service, batches(), sorted({dataset.classes[dataset.labels[row]] for row in rows}))
+
+
+def _accuracy_report(service, batches, classes):
+    counts = {true: {} for true in classes}
+    for arrays, true_labels in batches:
+        for true, result in zip(true_labels, service.predict_batch(arrays)):
+            row = counts[true]
+            row[result["predicted_label"]] = row.get(result["predicted_label"], 0) + 1
+    labels = sorted(set(classes) | set(service.model.config.id2label.values())
+                    | {label for row in counts.values() for label in row})
+    per_class = {}
+    for true in classes:
+        total = sum(counts[true].values())
+        per_class[true] = {"images": total, "top1": counts[true].get(true, 0) / total if total else 0.0}
+    correct = sum(counts[c].get(c, 0) for c in classes)
+    images = sum(sum(row.values()) for row in counts.values())
+    return {
+        "images": images,
+        "top1": correct / images if images else 0.0,
+        "per_class": per_class,
+        "confusion_matrix": {
+            "labels": labels,
+            "rows": {true: [counts[true].get(label, 0) for label in labels] for true in classes},
+        },
+    }
+
+
+def measure_throughput(service, arrays, batch_sizes=DEFAULT_BATCH_SIZES, thread_counts=(1,), iterations=20, warmup=3):
+    """
+    Times predict_batch (preprocess + forward + postprocess) on already decoded images for every
+    (threads, batch size) pair. Returns images/sec and p50/p95/p99 per-batch latency in ms.
+    """
+    results = []
+    original_threads = torch.get_num_threads()
+    try:
+        for threads in thread_counts:
+            torch.set_num_threads(threads)
+            for batch_size in batch_sizes:
+                batch = [arrays[i % len(arrays)] for i in range(batch_size)]
+                for _ in range(warmup):
+                    service.predict_batch(batch)
+                latencies = []
+                for _ in range(iterations):
+                    start = time.perf_counter()
+                    service.predict_batch(batch)
+                    latencies.append((time.perf_counter() - start) * 1000)
+                results.append({
+                    "threads": threads,
+                    "batch_size": batch_size,
+                    "images_per_sec": batch_size * iterations / (sum(latencies) / 1000),
+                    "p50_ms": percentile(latencies, 50),
+                    "p95_ms": percentile(latencies, 95),
+                    "p99_ms": percentile(latencies, 99),
+                })
+                print(f"[RESULT] threads={threads:<3d} batch={batch_size:<3d} "
+                      f"{results[-1]['images_per_sec']:8.1f} images/sec  p50 {results[-1]['p50_ms']:.1f} ms  "
+                      f"p99 {results[-1]['p99_ms']:.1f} ms")
+    finally:
+        torch.set_num_threads(original_threads)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_reports(report, baseline, accuracy_tolerance=0.005, throughput_tolerance=0.10):
+    """
+    Lists regressions of report against baseline: a top-1 drop larger than accuracy_tolerance
+    (absolute) or an images/sec drop larger than throughput_tolerance (relative) at any
+    (threads, batch size) point measured in both.
+    """
+    regressions = []
+    if "accuracy" in report and "accuracy" in baseline:
+        drop = baseline["accuracy"]["top1"] - report["accuracy"]["top1"]
+        if drop > accuracy_tolerance:
+            regressions.append(f"top-1 accuracy {report['accuracy']['top1']:.4f} vs baseline "
+                               f"{baseline['accuracy']['top1']:.4f}")
+    base_points = {(p["threads"], p["batch_size"]): p for p in baseline.get("throughput", [])}
+    for point in report.get("throughput", []):
+        base = base_points.get((point["threads"], point["batch_size"]))
+        if base and point["images_per_sec"] < base["images_per_sec"] * (1 - throughput_tolerance):
+            regressions.append(f"threads={point['threads']} batch={point['batch_size']}: "
+                               f"{point['images_per_sec']:.1f} images/sec vs baseline {base['images_per_sec']:.1f}")
+    return regressions
+
+
+def run_benchmark(service, data_dir="data/PlantVillage", per_class=None, batch_sizes=DEFAULT_BATCH_SIZES,
+                  thread_counts=(1,), iterations=20, skip_accuracy=False, packed_dir=None):
+    """
+    With packed_dir (see app.packed_dataset) accuracy runs over the whole packed dataset and
+    throughput over its first rows; data_dir and per_class are then ignored.
+    """
+    dataset = None
+    if packed_dir:
+        from app.packed_dataset import PackedDataset
+
+        dataset = PackedDataset(packed_dir)
+    else:
+        samples = load_labelled_images(data_dir, per_class=per_class)
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "model_name": service.model_name,
+        "revision": service.revision,
+        "backend": service.backend,
+        "precision": service.precision,
+        "tta_views": service.tta_views,
+        "tta_threshold": service.tta_threshold if service.tta_views else None,
+        "torch_version": torch.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "data_dir": packed_dir or data_dir,
+        "per_class": None if packed_dir else per_class,
+    }
+    if not skip_accuracy:
+        if dataset is not None:
+            report["accuracy"] = evaluate_packed_accuracy(service, dataset)
+        else:
+            report["accuracy"] = evaluate_accuracy(service, samples)
+        print(f"[RESULT] top-1 accuracy {report['accuracy']['top1']:.4f} on {report['accuracy']['images']} images")
+    if dataset is not None:
+        arrays = list(dataset.images[:max(batch_sizes)])
+    else:
+        size = (service.preprocessor.height, service.preprocessor.width)
+        arrays = [service.preprocessor.to_uint8(decode_image(path, target_size=size))
+                  for path, _ in samples[:max(batch_sizes)]]
+    report["throughput"] = measure_throughput(service, arrays, batch_sizes, thread_counts, iterations)
+    report["peak_rss_mb"] = peak_rss_mb()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Accuracy and throughput benchmark over data/PlantVillage.")
+    parser.add_argument("--data-dir", default="data/PlantVillage")
+    parser.add_argument("--per-class", type=int, default=50, help="Images per class for accuracy (0 = all)")
+    parser.add_argument("--packed", default=None, help="Packed dataset directory (app.packed_dataset) to read instead")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=list(DEFAULT_BATCH_SIZES))
+    parser.add_argument("--threads", type=int, nargs="+", default=[torch.get_num_threads()])
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--skip-accuracy", action="store_true")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", default=None, help="Previous report; exit non-zero on regressions")
+    parser.add_argument("--accuracy-tolerance", type=float, default=0.005)
+    parser.add_argument("--throughput-tolerance", type=float, default=0.10)
+    parser.add_argument("--model", default="Akshay0706/Plant-Village-1-Epochs-Model")
+    parser.add_argument("--snapshot-dir", default=None)
+    parser.add_argument("--precision", default="fp32")
+    parser.add_argument("--backend", default="eager")
+    parser.add_argument("--tta-views", type=int, default=0, help="Test-time augmentation views (0 = off)")
+    parser.add_argument("--tta-threshold", type=float, default=0.9)
+    args = parser.parse_args()
+    configure_logging()
+
+    from app.plant_health_service import PlantHealthService
+
+    service = PlantHealthService(model_name=args.model, snapshot_dir=args.snapshot_dir, precision=args.precision,
+                                 backend=args.backend, tta_views=args.tta_views, tta_threshold=args.tta_threshold,
+                                 warmup=True)
+    report = run_benchmark(service, args.data_dir, per_class=args.per_class or None, batch_sizes=args.batch_sizes,
+                           thread_counts=args.threads, iterations=args.iterations, skip_accuracy=args.skip_accuracy,
+                           packed_dir=args.packed)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"[INFO] Report written to {args.output} (peak RSS {report['peak_rss_mb']:.0f} MB)")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_reports(report, baseline, args.accuracy_tolerance, args.throughput_tolerance)
+        for regression in regressions:
+            print(f"[REGRESSION] {regression}")
+        if regressions:
+            raise SystemExit(1)
+        print("[INFO] No regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
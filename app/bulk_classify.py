@@ -0,0 +1,236 @@
+# bulk_classify.py
+
+import argparse
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from app.instrumentation import configure_logging, stage_timer
+from app.precision import IMAGE_EXTENSIONS
+from app.preprocessing import decode_image
+
+
+def iter_image_paths(root):
+    """
+    Lazily walks root in a deterministic (sorted) order, yielding image file paths.
+    Only one directory listing is held in memory at a time.
+    """
+    with os.scandir(root) as it:
+        entries = sorted(it, key=lambda entry: entry.name)
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            yield from iter_image_paths(entry.path)
+        elif entry.name.lower().endswith(IMAGE_EXTENSIONS):
+            yield entry.path
+
+
+def iter_batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class JsonlSink:
+    def __init__(self, path, resume_state=None):
+        """
+        Appends one JSON object per line. On resume the file is truncated back to the last
+        checkpointed offset, dropping any partially written batch. Raises ValueError if the file
+        is missing or shorter than that offset, i.e. the checkpoint belongs to another output.
+        """
+        self.path = path
+        if resume_state:
+            size = os.path.getsize(path) if os.path.isfile(path) else None
+            if size is None or size < resume_state["offset"]:
+                raise ValueError(f"Checkpoint does not match output {path}: expected at least "
+                                 f"{resume_state['offset']} bytes, found {'no file' if size is None else size}; "
+                                 f"rerun without --resume to start fresh")
+        self._file = open(path, "a+b" if resume_state else "wb")
+        if resume_state:
+            self._file.truncate(resume_state["offset"])
+            self._file.seek(resume_state["offset"])
+
+    def written_paths(self):
+        self._file.seek(0)
+        paths = {json.loads(line)["path"] for line in self._file}
+        self._file.seek(0, os.SEEK_END)
+        return paths
+
+    def write(self, rows):
+        self._file.write("".join(json.dumps(row) + "\n" for row in rows).encode())
+        self._file.flush()
+        return {"offset": self._file.tell()}
+
+    def close(self):
+        self._file.flush()
+        return {"offset": self._file.tell()}
+
+
+class ParquetSink:
+    def __init__(self, path, resume_state=None, rows_per_file=4096):
+        """
+        Writes a directory of Parquet part files. Rows are buffered until rows_per_file, so the
+        checkpoint only advances when a part file is complete. A fresh run deletes the part
+        files of any previous run, which would otherwise be read back as part of the output.
+        """
+        import pyarrow  # noqa: F401 - fail fast if the optional dependency is missing
+
+        self.path = path
+        self.rows_per_file = rows_per_file
+        os.makedirs(path, exist_ok=True)
+        self.parts = resume_state["parts"] if resume_state else 0
+        for name in os.listdir(path):
+            if name.startswith("part-") and name.endswith(".parquet") and name[5:-8].isdigit() \
+                    and int(name[5:-8]) >= self.parts:
+                os.remove(os.path.join(path, name))
+        self._buffer = []
+
+    def written_paths(self):
+        import pyarrow.parquet as pq
+
+        paths = set()
+        for part in range(self.parts):
+            table = pq.read_table(os.path.join(self.path, f"part-{part:05d}.parquet"), columns=["path"])
+            paths.update(table.column("path").to_pylist())
+        return paths
+
+    def _flush_part(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        pq.write_table(pa.Table.from_pylist(self._buffer), os.path.join(self.path, f"part-{self.parts:05d}.parquet"))
+        self.parts += 1
+        self._buffer = []
+
+    def write(self, rows):
+        self._buffer.extend(rows)
+        if len(self._buffer) < self.rows_per_file:
+            return None  # Not durable yet
+        self._flush_part()
+        return {"parts": self.parts}
+
+    def close(self):
+        if self._buffer:
+            self._flush_part()
+        return {"parts": self.parts}
+
+
+def load_checkpoint(path):
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_checkpoint(path, processed, sink_state):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump({"processed": processed, "sink": sink_state}, f)
+    os.replace(tmp, path)  # Atomic, so a crash never leaves a torn checkpoint
+
+
+def classify_directory(service, root, output, fmt="jsonl", batch_size=32, decode_threads=4, prefetch=2,
+                       resume=False, progress_every=5.0):
+    """
+    Streams every image under root through the service and writes one row per image.
+    Decoding runs on a thread pool, `prefetch` batches ahead of the model, so JPEG decoding
+    overlaps with inference; memory stays bounded by (prefetch + 1) * batch_size decoded images.
+    Resumable: the checkpoint records how far the output is durably written, and a resume skips
+    the paths found in that part of the output, so images added under root or removed from it
+    since the interrupted run neither shift nor hide any work.
+    """
+    checkpoint_path = output + ".checkpoint.json"
+    checkpoint = load_checkpoint(checkpoint_path) if resume else None
+    if not resume and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)  # Describes the output this run replaces
+    sink_state = checkpoint["sink"] if checkpoint else None
+    sink = JsonlSink(output, sink_state) if fmt == "jsonl" else ParquetSink(output, sink_state)
+    done = sink.written_paths() if checkpoint else set()
+    if done:
+        print(f"[INFO] Resuming after {len(done)} already classified image(s)")
+
+    size = (service.preprocessor.height, service.preprocessor.width)
+    preprocessor = service.preprocessor
+
+    def load(path):
+        # Decode at reduced resolution and resize in the worker thread; the model only sees uint8 arrays
+        try:
+            with stage_timer("decode"):
+                return preprocessor.to_uint8(decode_image(path, target_size=size)), None
+        except Exception as e:
+            return None, str(e)
+
+    processed = len(done)
+    start = last_report = time.perf_counter()
+    done_this_run = 0
+    batches = iter_batches((path for path in iter_image_paths(root) if path not in done), batch_size)
+    with ThreadPoolExecutor(max_workers=decode_threads) as pool:
+        in_flight = deque()
+        for paths in islice(batches, prefetch):
+            in_flight.append((paths, [pool.submit(load, path) for path in paths]))
+        while in_flight:
+            paths, futures = in_flight.popleft()
+            # Keep the decoders busy on the next batch while this one runs through the model
+            for next_paths in islice(batches, 1):
+                in_flight.append((next_paths, [pool.submit(load, path) for path in next_paths]))
+            decoded = [future.result() for future in futures]
+            ok = [(path, array) for path, (array, error) in zip(paths, decoded) if array is not None]
+            results = iter(service.predict_batch([array for _, array in ok])) if ok else iter(())
+            rows = []
+            for path, (array, error) in zip(paths, decoded):
+                # Fixed column set, so every Parquet part file shares one schema
+                row = {"path": path, "predicted_label": None, "predicted_class_index": None,
+                       "confidence": None, "error": error}
+                if array is not None:
+                    result = next(results)
+                    row.update(predicted_label=result["predicted_label"],
+                               predicted_class_index=result["predicted_class_index"],
+                               confidence=result["confidence"])
+                rows.append(row)
+            state = sink.write(rows)
+            processed += len(paths)
+            done_this_run += len(paths)
+            if state is not None:
+                save_checkpoint(checkpoint_path, processed, state)
+            now = time.perf_counter()
+            if now - last_report >= progress_every:
+                print(f"[PROGRESS] {processed} image(s), {done_this_run / (now - start):.1f} images/sec")
+                last_report = now
+    save_checkpoint(checkpoint_path, processed, sink.close())
+    elapsed = time.perf_counter() - start
+    print(f"[INFO] Classified {done_this_run} image(s) in {elapsed:.1f}s "
+          f"({done_this_run / elapsed if elapsed else 0:.1f} images/sec), {processed} total in {output}")
+    return processed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream-classify every image under a directory.")
+    parser.add_argument("root", help="Directory to scan, e.g. data/PlantVillage")
+    parser.add_argument("--output", required=True, help="JSONL file or Parquet directory")
+    parser.add_argument("--format", choices=["jsonl", "parquet"], default="jsonl")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--decode-threads", type=int, default=4)
+    parser.add_argument("--prefetch", type=int, default=2, help="Batches decoded ahead of the model")
+    parser.add_argument("--resume", action="store_true", help="Continue from the output's checkpoint")
+    parser.add_argument("--model", default="Akshay0706/Plant-Village-1-Epochs-Model")
+    parser.add_argument("--snapshot-dir", default=None)
+    parser.add_argument("--precision", default="fp32")
+    parser.add_argument("--backend", default="eager")
+    args = parser.parse_args()
+    configure_logging()
+
+    from app.plant_health_service import PlantHealthService
+
+    service = PlantHealthService(model_name=args.model, snapshot_dir=args.snapshot_dir,
+                                 precision=args.precision, backend=args.backend, warmup=True)
+    classify_directory(service, args.root, args.output, fmt=args.format, batch_size=args.batch_size,
+                       decode_threads=args.decode_threads, prefetch=args.prefetch, resume=args.resume)
+
+
+if __name__ == "__main__":
+    main()
@@ -12,6 +12,20 @@ AWS_ACCESS_KEY_ID = os.getenv('AWS_ACCESS_KEY_ID')
 AWS_SECRET_ACCESS_KEY = os.getenv('AWS_SECRET_ACCESS_KEY')
 AWS_REGION = os.getenv('AWS_REGION', 'eu-north-1')
 AWS_BUCKET_NAME = os.getenv('AWS_BUCKET_NAME', 'leafcheck-uploads')
+AWS_ENDPOINT_URL = os.getenv('AWS_ENDPOINT_URL')  # S3-compatible endpoint (MinIO, moto server), unset for AWS
+
+# Image Storage Configuration
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 's3')  # s3 or local
+STORAGE_LOCAL_DIR = os.getenv('STORAGE_LOCAL_DIR', 'uploads')
+STORAGE_UPLOAD_WORKERS = int(os.getenv('STORAGE_UPLOAD_WORKERS', '4'))  # Images uploaded in parallel
+STORAGE_MAX_PENDING = int(os.getenv('STORAGE_MAX_PENDING', '64'))  # Queued uploads before submit() blocks
+STORAGE_MULTIPART_THRESHOLD_MB = float(os.getenv('STORAGE_MULTIPART_THRESHOLD_MB', '8'))
+STORAGE_MULTIPART_CHUNK_MB = float(os.getenv('STORAGE_MULTIPART_CHUNK_MB', '8'))
+
+# Derived Artifact Cache Configuration
+DERIVED_CACHE_DIR = os.getenv('DERIVED_CACHE_DIR', 'derived_cache')  # Thumbnails and model-ready arrays
+DERIVED_CACHE_MAX_MB = float(os.getenv('DERIVED_CACHE_MAX_MB', '2048'))  # LRU-evicted beyond this
+THUMBNAIL_SIZE = int(os.getenv('THUMBNAIL_SIZE', '256'))  # Longest thumbnail side in pixels
 
 # Database Configuration
 DB_NAME = os.getenv('DB_NAME', 'leafcheck')
@@ -23,6 +37,61 @@ DB_PORT = os.getenv('DB_PORT', '5432')
 # Application Configuration
 DEBUG = os.getenv('DEBUG', 'False').lower() == 'true'
 MODEL_PATH = os.getenv('MODEL_PATH', 'models/plant_health_model.pth')
+MODEL_SNAPSHOT_DIR = os.getenv('MODEL_SNAPSHOT_DIR')  # Local snapshot written by app/model_store.py
+INFERENCE_PRECISION = os.getenv('INFERENCE_PRECISION', 'fp32')  # fp32, int8 or bf16
+PRECISION_MIN_AGREEMENT = float(os.getenv('PRECISION_MIN_AGREEMENT', '0.98'))
+INFERENCE_BACKEND = os.getenv('INFERENCE_BACKEND', 'eager')  # eager, compile, torchscript or onnx
+
+# Image Decoding Configuration
+# Hard cap on decoded pixels (after DCT downscaling), guards against decompression bombs
+MAX_DECODED_PIXELS = int(os.getenv('MAX_DECODED_PIXELS', '50000000'))
+
+# Inference Batching Configuration
+BATCH_MAX_SIZE = int(os.getenv('BATCH_MAX_SIZE', '16'))
+BATCH_MAX_WAIT_MS = float(os.getenv('BATCH_MAX_WAIT_MS', '10'))
+INFERENCE_WORKERS = int(os.getenv('INFERENCE_WORKERS', '1'))  # Processes in the inference worker pool
+
+# Tiled Inference Configuration (PlantHealthService.predict_tiled)
+TILE_OVERLAP = float(os.getenv('TILE_OVERLAP', '0.25'))  # Fraction of a tile shared with its neighbour
+TILE_SCALES = tuple(float(s) for s in os.getenv('TILE_SCALES', '1.0,0.5').split(','))
+TILE_MAX_SIDE = int(os.getenv('TILE_MAX_SIDE', '4096'))  # Photos are downscaled to this longest side first
+TILE_BATCH_SIZE = int(os.getenv('TILE_BATCH_SIZE', '32'))  # Tiles per forward pass, bounds peak memory
+TILE_MIN_GREEN = float(os.getenv('TILE_MIN_GREEN', '0.05'))  # Tiles with less vegetation are background
+TILE_MIN_STD = float(os.getenv('TILE_MIN_STD', '6'))  # Tiles flatter than this are background
+
+# Test-Time Augmentation Configuration
+TTA_VIEWS = int(os.getenv('TTA_VIEWS', '0'))  # Augmented views per uncertain image, 0 = TTA off (max 8)
+TTA_CONFIDENCE_THRESHOLD = float(os.getenv('TTA_CONFIDENCE_THRESHOLD', '0.9'))  # Single-view confidence that skips TTA
+
+# Embedding Index Configuration (app/embeddings.py)
+EMBEDDING_DIR = os.getenv('EMBEDDING_DIR', 'embeddings')
+EMBEDDING_DTYPE = os.getenv('EMBEDDING_DTYPE', 'bfloat16')  # bfloat16, float16 or int8
+EMBEDDING_IVF_THRESHOLD = int(os.getenv('EMBEDDING_IVF_THRESHOLD', '50000'))  # Below this, search is brute force
+EMBEDDING_NPROBE = int(os.getenv('EMBEDDING_NPROBE', '8'))  # IVF lists scanned per query
+EMBEDDING_DUPLICATE_THRESHOLD = float(os.getenv('EMBEDDING_DUPLICATE_THRESHOLD', '0.97'))  # Cosine similarity
+EMBEDDING_SIMILAR_CASES = int(os.getenv('EMBEDDING_SIMILAR_CASES', '5'))  # Past cases returned with a result
+
+# Prediction Cache Configuration
+PREDICTION_CACHE_SIZE = int(os.getenv('PREDICTION_CACHE_SIZE', '1024'))
+PREDICTION_CACHE_TTL = float(os.getenv('PREDICTION_CACHE_TTL', '3600'))
+PREDICTION_CACHE_PATH = os.getenv('PREDICTION_CACHE_PATH')  # Unset disables the on-disk tier
+
+# Model Registry Configuration (app/model_registry.py)
+MODEL_SHADOW_FRACTION = float(os.getenv('MODEL_SHADOW_FRACTION', '0.1'))  # Requests re-scored on a candidate model
+MODEL_SHADOW_MAX_PENDING = int(os.getenv('MODEL_SHADOW_MAX_PENDING', '8'))  # Queued shadow requests before skipping
+MODEL_ADMIN_TOKEN = os.getenv('MODEL_ADMIN_TOKEN')  # Bearer token for POST /models*; unset disables them
+
+# Inference API Server Configuration
+SERVER_PORT = int(os.getenv('SERVER_PORT', '8000'))
+SERVER_MAX_QUEUE = int(os.getenv('SERVER_MAX_QUEUE', '32'))  # In-flight predictions before answering 429
+SERVER_REQUEST_TIMEOUT = float(os.getenv('SERVER_REQUEST_TIMEOUT', '10'))  # Seconds before answering 504
+SERVER_EXECUTOR_WORKERS = int(os.getenv('SERVER_EXECUTOR_WORKERS', '2'))
+SERVER_MAX_UPLOAD_MB = float(os.getenv('SERVER_MAX_UPLOAD_MB', '25'))
+
+# Instrumentation Configuration
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')  # DEBUG also logs every prediction
+PROFILE_EVERY_N = int(os.getenv('PROFILE_EVERY_N', '0'))  # Torch-profile 1 in N predict_batch calls, 0 = off
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
 
 # Validate required configuration
 def validate_config():
@@ -0,0 +1,99 @@
+# decode_benchmark.py
+
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from app.benchmark import percentile
+from app.model_store import peak_rss_mb
+from app.precision import holdout_slice
+from app.preprocessing import decode_image
+
+# Typical phone camera resolutions (12 MP and 48 MP, landscape)
+SYNTHETIC_SIZES = ((4032, 3024), (8000, 6000))
+
+
+def make_synthetic_photos(out_dir, sizes=SYNTHETIC_SIZES, per_size=2, seed=0):
+    """
+    Writes large JPEGs made of upscaled random blotches (compresses roughly like a real photo).
+    Every other file carries EXIF orientation 6 (rotated 90 degrees), as phones write it.
+    """
+    rng = np.random.default_rng(seed)
+    paths = []
+    for width, height in sizes:
+        for i in range(per_size):
+            small = rng.integers(0, 256, size=(height // 32, width // 32, 3), dtype=np.uint8)
+            image = Image.fromarray(small).resize((width, height), resample=Image.BICUBIC)
+            exif = Image.Exif()
+            if i % 2:
+                exif[0x0112] = 6
+            path = os.path.join(out_dir, f"synthetic_{width}x{height}_{i}.jpg")
+            image.save(path, quality=90, exif=exif)
+            paths.append(path)
+    return paths
+
+
+def bench_decode(paths, target_size):
+    """
+    Decodes every path and returns per-image timing and decoded buffer size, plus the
+    process peak RSS after the run (ru_maxrss is monotonic, so run the cheaper mode first).
+    """
+    times_ms, decoded_mb, sizes = [], [], []
+    for path in paths:
+        start = time.perf_counter()
+        image = decode_image(path, target_size=target_size)
+        times_ms.append((time.perf_counter() - start) * 1000)
+        decoded_mb.append(image.width * image.height * len(image.getbands()) / 2**20)
+        sizes.append(image.size)
+    return {
+        "images": len(paths),
+        "mean_ms": statistics.mean(times_ms),
+        "p95_ms": percentile(times_ms, 95),
+        "mean_decoded_mb": statistics.mean(decoded_mb),
+        "max_decoded_mb": max(decoded_mb),
+        "example_size": list(sizes[0]),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare full vs reduced-resolution (draft) JPEG decoding.")
+    parser.add_argument("--data-dir", default="data/PlantVillage")
+    parser.add_argument("--per-class", type=int, default=20)
+    parser.add_argument("--synthetic-per-size", type=int, default=2)
+    parser.add_argument("--output", default=None, help="Optional JSON report path")
+    args = parser.parse_args()
+
+    report = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        # Generated in a child process so the large source images don't inflate our peak RSS
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            synthetic = pool.submit(make_synthetic_photos, tmp, per_size=args.synthetic_per_size).result()
+        suites = {
+            "plant_village": holdout_slice(args.data_dir, per_class=args.per_class),
+            "synthetic_large": synthetic,
+        }
+        for name, paths in suites.items():
+            report[name] = {
+                "draft": bench_decode(paths, target_size=(224, 224)),
+                "full": bench_decode(paths, target_size=None),
+            }
+            for mode, stats in report[name].items():
+                print(f"[RESULT] {name:16s} {mode:5s} {stats['mean_ms']:8.2f} ms/image "
+                      f"(p95 {stats['p95_ms']:.2f}), decoded {stats['mean_decoded_mb']:.2f} MB/image, "
+                      f"peak RSS {stats['peak_rss_mb']:.0f} MB")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"[INFO] Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
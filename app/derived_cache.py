@@ -0,0 +1,244 @@
+# derived_cache.py
+
+import argparse
+import hashlib
+import io
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from app.config import DERIVED_CACHE_DIR, DERIVED_CACHE_MAX_MB, THUMBNAIL_SIZE
+from app.preprocessing import TensorPreprocessor, decode_image
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_SUFFIX = ".thumb.jpg"
+
+
+def image_digest(image_bytes):
+    """
+    SHA-256 of the original bytes, the same digest app.storage.content_key() stores images under.
+    """
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def make_derivatives(image_bytes, preprocessor, thumbnail_size=THUMBNAIL_SIZE):
+    """
+    Decodes an image once and returns (thumbnail JPEG bytes, HxWx3 uint8 model-ready array).
+    The array goes through the same decode_image + to_uint8 path as PlantHealthService.predict_bytes,
+    so predictions on it are identical to predictions on the original bytes.
+    """
+    # Same draft scale as predict_bytes, which still leaves at least twice the model resolution for the thumbnail
+    image = decode_image(image_bytes, target_size=(preprocessor.height, preprocessor.width))
+    array = preprocessor.to_uint8(image)
+    thumbnail = image.copy()
+    thumbnail.thumbnail((thumbnail_size, thumbnail_size))
+    buffer = io.BytesIO()
+    thumbnail.save(buffer, format="JPEG", quality=85, optimize=True)
+    return buffer.getvalue(), array
+
+
+class DerivedCache:
+    def __init__(self, root=DERIVED_CACHE_DIR, max_mb=DERIVED_CACHE_MAX_MB, preprocessor=None, store=None,
+                 thumbnail_size=THUMBNAIL_SIZE):
+        """
+        Disk cache of per-image derived artifacts, keyed by the digest of the original bytes:
+        - <digest>.thumb.jpg: thumbnail for UI listings;
+        - <digest>.<H>x<W>.npy: the resized uint8 array a model of that input size consumes, so
+          re-scoring (including with a new model of the same input size) skips decode and resize.
+
+        Total size is bounded by max_mb with least-recently-used eviction; the LRU order survives
+        restarts through file modification times, which every hit refreshes.
+        store: optional app.storage image store (S3 or local). Artifacts are also written there
+        under derived/ and fetched from it on a local miss, so other hosts can share them.
+        """
+        self.root = root
+        self.max_bytes = int(max_mb * 2**20)
+        self.preprocessor = preprocessor or TensorPreprocessor.from_metadata()
+        self.store = store
+        self.thumbnail_size = thumbnail_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # relative path -> size in bytes, least recently used first
+        self._total = 0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(root, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        found = []
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                if name.endswith(".part"):
+                    continue
+                path = os.path.join(directory, name)
+                stat = os.stat(path)
+                found.append((stat.st_mtime, os.path.relpath(path, self.root), stat.st_size))
+        for _, relative, size in sorted(found):
+            self._entries[relative] = size
+            self._total += size
+
+    def _array_name(self, digest):
+        return f"{digest[:2]}/{digest}.{self.preprocessor.height}x{self.preprocessor.width}.npy"
+
+    def _thumbnail_name(self, digest):
+        return f"{digest[:2]}/{digest}{THUMBNAIL_SUFFIX}"
+
+    def _read(self, relative):
+        path = os.path.join(self.root, relative)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            with self._lock:
+                self._total -= self._entries.pop(relative, 0)
+            data = None
+        if data is None and self.store is not None:
+            data = self.store.get("derived/" + relative)
+            if data is not None:
+                self._write(relative, data)
+        if data is not None:
+            with self._lock:
+                if relative in self._entries:
+                    self._entries.move_to_end(relative)
+            try:
+                os.utime(path)  # Persist the recency for the next process
+            except FileNotFoundError:
+                pass  # Evicted concurrently; the bytes already read are still valid
+        return data
+
+    def _write(self, relative, data):
+        path = os.path.join(self.root, relative)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self._lock:
+            self._total += len(data) - self._entries.pop(relative, 0)
+            self._entries[relative] = len(data)
+            evicted = []
+            while self._total > self.max_bytes and len(self._entries) > 1:
+                old, size = self._entries.popitem(last=False)
+                self._total -= size
+                evicted.append(old)
+        for old in evicted:
+            try:
+                os.remove(os.path.join(self.root, old))
+            except FileNotFoundError:
+                pass
+
+    def put(self, image_bytes, digest=None):
+        """
+        Builds and stores both artifacts for an original image. Returns its digest.
+        """
+        digest = digest or image_digest(image_bytes)
+        thumbnail, array = make_derivatives(image_bytes, self.preprocessor, self.thumbnail_size)
+        buffer = io.BytesIO()
+        np.save(buffer, array, allow_pickle=False)
+        for relative, data in ((self._thumbnail_name(digest), thumbnail), (self._array_name(digest), buffer.getvalue())):
+            self._write(relative, data)
+            if self.store is not None:
+                self.store.put("derived/" + relative, data,
+                               "image/jpeg" if relative.endswith(THUMBNAIL_SUFFIX) else "application/octet-stream")
+        return digest
+
+    def get_array(self, digest):
+        """
+        The model-ready uint8 array for an image, or None if it is not cached.
+        """
+        data = self._read(self._array_name(digest))
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return np.load(io.BytesIO(data), allow_pickle=False)
+
+    def get_thumbnail(self, digest):
+        return self._read(self._thumbnail_name(digest))
+
+    def array_for(self, image_bytes):
+        """
+        The model-ready array for original bytes: from the cache, or derived (and cached) now.
+        """
+        digest = image_digest(image_bytes)
+        array = self.get_array(digest)
+        if array is None:
+            self.put(image_bytes, digest)
+            array = self.get_array(digest)
+        return array
+
+    def digests(self):
+        """
+        Digests of every image with a cached array at the preprocessor's input size.
+        """
+        suffix = f".{self.preprocessor.height}x{self.preprocessor.width}.npy"
+        with self._lock:
+            return [os.path.basename(relative)[:-len(suffix)] for relative in self._entries if relative.endswith(suffix)]
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._total, "hits": self.hits, "misses": self.misses}
+
+
+def rescore(service, cache, digests, batch_size=64):
+    """
+    Runs the service over cached arrays only: no download, decode or resize.
+    Returns {digest: result}; digests without a cached array are skipped.
+    """
+    results = {}
+    for start in range(0, len(digests), batch_size):
+        chunk = [(digest, cache.get_array(digest)) for digest in digests[start:start + batch_size]]
+        chunk = [(digest, array) for digest, array in chunk if array is not None]
+        if chunk:
+            results.update(zip([digest for digest, _ in chunk], service.predict_batch([array for _, array in chunk])))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build derived artifacts or re-score images from them.")
+    parser.add_argument("command", choices=["warm", "rescore"])
+    parser.add_argument("--images", default="data/PlantVillage", help="Directory of originals (warm)")
+    parser.add_argument("--cache-dir", default=DERIVED_CACHE_DIR)
+    parser.add_argument("--model", default="Akshay0706/Plant-Village-1-Epochs-Model")
+    parser.add_argument("--snapshot-dir", default=None)
+    args = parser.parse_args()
+
+    from app.bulk_classify import iter_image_paths
+    from app.instrumentation import configure_logging
+
+    configure_logging()
+    if args.command == "warm":
+        cache = DerivedCache(args.cache_dir)
+        start = time.perf_counter()
+        count = 0
+        for path in iter_image_paths(args.images):
+            with open(path, "rb") as f:
+                try:
+                    cache.put(f.read())
+                except Exception as e:
+                    logger.warning("Skipping %s: %s", path, e)
+                    continue
+            count += 1
+        print(f"[INFO] Derived artifacts for {count} image(s) in {time.perf_counter() - start:.1f}s: {cache.stats()}")
+    else:
+        from app.plant_health_service import PlantHealthService
+
+        service = PlantHealthService(model_name=args.model, snapshot_dir=args.snapshot_dir, warmup=True)
+        cache = DerivedCache(args.cache_dir, preprocessor=service.preprocessor)
+        digests = cache.digests()
+        start = time.perf_counter()
+        results = rescore(service, cache, digests)
+        elapsed = time.perf_counter() - start
+        print(f"[RESULT] Re-scored {len(results)} cached image(s) in {elapsed:.1f}s "
+              f"({len(results) / elapsed if elapsed else 0:.1f} images/sec)")
+
+
+if __name__ == "__main__":
+    main()
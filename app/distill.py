@@ -0,0 +1,171 @@
+# distill.py
+
+import argparse
+import json
+import logging
+import os
+
+import numpy as np
+import torch
+from transformers import ViTForImageClassification
+
+from app.benchmark import evaluate_accuracy, evaluate_packed_accuracy, load_labelled_images, measure_throughput
+from app.instrumentation import configure_logging
+from app.precision import input_dtype_for
+from app.train import FolderDataset, PackedSubset, reconcile_labels, split_samples, train
+
+logger = logging.getLogger(__name__)
+
+# ImageNet-pretrained ViT-Tiny/Small from "Training data-efficient image transformers" (DeiT),
+# same 16x16 patch grid as the teacher; a randomly initialized student of this size barely learns
+# from a PlantVillage-sized dataset
+STUDENT_PRESETS = {
+    "vit-tiny": "facebook/deit-tiny-patch16-224",
+    "vit-small": "facebook/deit-small-patch16-224",
+}
+REPORT_FILE = "distill_report.json"
+
+
+def build_student(teacher_config, student="vit-tiny", label2id=None):
+    """
+    A ViTForImageClassification student with the teacher's input size and labels (label2id
+    when the data has classes the teacher lacks, see train.reconcile_labels), so it produces
+    the same result schema and PlantHealthService serves it unchanged.
+    student is a STUDENT_PRESETS name or a Hugging Face model name or directory; its pretrained
+    backbone is reused with a fresh classification head.
+    """
+    label2id = dict(label2id or teacher_config.label2id)
+    return ViTForImageClassification.from_pretrained(
+        STUDENT_PRESETS.get(student, student), image_size=teacher_config.image_size, num_labels=len(label2id),
+        id2label={i: label for label, i in label2id.items()}, label2id=label2id, ignore_mismatched_sizes=True)
+
+
+def distillation_loss(teacher_service, temperature=4.0, alpha=0.9, label2id=None):
+    """
+    Returns a train() loss_fn mixing the KL divergence to the teacher's temperature-softened
+    distribution (scaled by T^2, Hinton et al. 2015) with cross-entropy on the hard labels.
+    The teacher sees exactly the augmented batch the student sees, through its own runner
+    (so a reduced-precision or exported teacher speeds up distillation too).
+    label2id is the student's labelling if it differs from the teacher's; the soft term then
+    compares the two distributions over the classes both know.
+    """
+    teacher_label2id = teacher_service.model.config.label2id
+    shared = sorted((i, teacher_label2id[label]) for label, i in (label2id or teacher_label2id).items()
+                    if label in teacher_label2id)
+    if not shared:
+        raise ValueError("The teacher knows none of the student's classes")
+    student_columns = torch.tensor([i for i, _ in shared])
+    teacher_columns = torch.tensor([i for _, i in shared])
+
+    def loss_fn(logits, labels, pixel_values):
+        with torch.no_grad():
+            teacher_logits = teacher_service.runner(
+                pixel_values.to(teacher_service.device, dtype=input_dtype_for(teacher_service.precision))
+            ).float().to(logits.device)[:, teacher_columns.to(logits.device)]
+        soft = torch.nn.functional.kl_div(
+            torch.log_softmax(logits[:, student_columns.to(logits.device)] / temperature, dim=-1),
+            torch.log_softmax(teacher_logits / temperature, dim=-1),
+            reduction="batchmean", log_target=True,
+        ) * temperature ** 2
+        hard = torch.nn.functional.cross_entropy(logits, labels)
+        return alpha * soft + (1 - alpha) * hard
+
+    return loss_fn
+
+
+def compare(teacher, student, accuracy_fn, batch_sizes=(1, 32), iterations=20):
+    """
+    Size, latency and accuracy of teacher vs. student, both served through PlantHealthService.
+    accuracy_fn(service) returns an evaluate_accuracy() report.
+    """
+    report = {}
+    for name, service in (("teacher", teacher), ("student", student)):
+        # Latency does not depend on pixel values, only on the shape
+        arrays = [np.zeros((service.preprocessor.height, service.preprocessor.width, 3), dtype=np.uint8)]
+        accuracy = accuracy_fn(service)
+        report[name] = {
+            "parameters": sum(p.numel() for p in service.model.parameters()),
+            "weights_mb": sum(p.numel() * p.element_size() for p in service.model.parameters()) / 2**20,
+            "top1": accuracy["top1"],
+            "images": accuracy["images"],
+            "throughput": measure_throughput(service, arrays, batch_sizes, iterations=iterations),
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Distill the served ViT-base into a compact student.")
+    parser.add_argument("--data-dir", default="data/PlantVillage")
+    parser.add_argument("--packed", default=None, help="Packed dataset directory (app.packed_dataset) to read instead")
+    parser.add_argument("--teacher", default="Akshay0706/Plant-Village-1-Epochs-Model")
+    parser.add_argument("--teacher-snapshot-dir", default=None)
+    parser.add_argument("--teacher-precision", default="fp32", help="Teacher inference precision (fp32, int8, bf16)")
+    parser.add_argument("--student", default="vit-tiny",
+                        help=f"One of {sorted(STUDENT_PRESETS)} (pretrained DeiT) or another pretrained ViT to start from")
+    parser.add_argument("--output", default="models/plant-village-vit-student")
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--accumulation-steps", type=int, default=1)
+    parser.add_argument("--lr", type=float, default=5e-4)
+    parser.add_argument("--warmup-steps", type=int, default=100)
+    parser.add_argument("--temperature", type=float, default=4.0)
+    parser.add_argument("--alpha", type=float, default=0.9, help="Weight of the soft-label loss")
+    parser.add_argument("--val-fraction", type=float, default=0.1)
+    parser.add_argument("--precision", choices=["auto", "fp32", "bf16"], default="auto")
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument("--checkpoint-every", type=int, default=200)
+    parser.add_argument("--no-resume", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--benchmark-iterations", type=int, default=20)
+    args = parser.parse_args()
+    configure_logging()
+
+    from app.plant_health_service import PlantHealthService
+
+    teacher = PlantHealthService(model_name=args.teacher, snapshot_dir=args.teacher_snapshot_dir,
+                                 precision=args.teacher_precision, warmup=True)
+    size = (teacher.preprocessor.height, teacher.preprocessor.width)
+    if args.packed:
+        from app.packed_dataset import PackedDataset
+
+        packed = PackedDataset(args.packed)
+        label2id = reconcile_labels(teacher.model.config.label2id, packed.classes)
+        rows = [(row, packed.classes[label]) for row, label in enumerate(packed.labels)]
+        train_rows, val_rows = split_samples(rows, args.val_fraction, args.seed)
+        train_set = PackedSubset(packed, [row for row, _ in train_rows], label2id)
+        val_set = PackedSubset(packed, [row for row, _ in val_rows], label2id)
+        accuracy_fn = lambda service: evaluate_packed_accuracy(service, packed, rows=[row for row, _ in val_rows])
+    else:
+        samples = load_labelled_images(args.data_dir)
+        label2id = reconcile_labels(teacher.model.config.label2id, {name for _, name in samples})
+        train_samples, val_samples = split_samples(samples, args.val_fraction, args.seed)
+        train_set = FolderDataset(train_samples, label2id, size)
+        val_set = FolderDataset(val_samples, label2id, size)
+        accuracy_fn = lambda service: evaluate_accuracy(service, val_samples)
+
+    if label2id != teacher.model.config.label2id:
+        logger.info("The teacher does not know every class, distilling into a new %d-way head", len(label2id))
+    student = build_student(teacher.model.config, args.student, label2id)
+    train(student, teacher.processor, train_set, val_set, args.output, epochs=args.epochs,
+          batch_size=args.batch_size, accumulation_steps=args.accumulation_steps, lr=args.lr,
+          warmup_steps=args.warmup_steps, precision=args.precision, workers=args.workers,
+          checkpoint_every=args.checkpoint_every, resume=not args.no_resume, seed=args.seed,
+          model_name=f"{teacher.model_name}-distilled-{os.path.basename(args.student)}",
+          loss_fn=distillation_loss(teacher, args.temperature, args.alpha, label2id))
+
+    served = PlantHealthService(snapshot_dir=args.output, warmup=True)
+    report = compare(teacher, served, accuracy_fn,
+                     iterations=args.benchmark_iterations)
+    with open(os.path.join(args.output, REPORT_FILE), "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"[RESULT] {'model':<8} {'params':>12} {'MB':>7} {'top-1':>7} " + " ".join(
+        f"{'batch ' + str(p['batch_size']) + ' img/s':>16}" for p in report["teacher"]["throughput"]))
+    for name, row in report.items():
+        print(f"[RESULT] {name:<8} {row['parameters']:12,d} {row['weights_mb']:7.1f} {row['top1']:7.4f} " + " ".join(
+            f"{p['images_per_sec']:16.1f}" for p in row["throughput"]))
+    print(f"[INFO] Serve the student with MODEL_SNAPSHOT_DIR={args.output}; report in "
+          f"{os.path.join(args.output, REPORT_FILE)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,454 @@
+# embeddings.py
+
+import argparse
+import json
+import logging
+import math
+import mmap
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+import torch
+
+from app.config import (
+    EMBEDDING_DIR,
+    EMBEDDING_DTYPE,
+    EMBEDDING_DUPLICATE_THRESHOLD,
+    EMBEDDING_IVF_THRESHOLD,
+    EMBEDDING_NPROBE,
+)
+
+logger = logging.getLogger(__name__)
+
+# On-disk element types. bfloat16 has no NumPy dtype and is kept as raw 16-bit words; torch
+# scores it without any conversion, several times faster on CPU than float16 at the same size.
+DTYPES = {"bfloat16": np.int16, "float16": np.float16, "int8": np.int8}
+INT8_SCALE = 127.0  # Embeddings are L2-normalized, so every component lies in [-1, 1]
+FORMAT_VERSION = 1
+
+
+def encode(vectors, dtype):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if dtype == "int8":
+        return np.round(vectors * INT8_SCALE).astype(np.int8)
+    if dtype == "bfloat16":
+        return torch.from_numpy(vectors).bfloat16().view(torch.int16).numpy()
+    return vectors.astype(np.float16)
+
+
+def decode(block, dtype):
+    """
+    Stored rows -> tensor to score against: bfloat16 as is, the other types as float32.
+    """
+    tensor = torch.from_numpy(block)
+    if dtype == "bfloat16":
+        return tensor.view(torch.bfloat16)
+    tensor = tensor.float()
+    return tensor / INT8_SCALE if dtype == "int8" else tensor
+
+
+def shortlist_size(k, rows):
+    return min(rows, 4 * k + 32)
+
+
+def top_k(block, queries, k):
+    """
+    (scores, positions) of the k decoded rows most similar to each unit query, [queries, k].
+    bfloat16 products carry about three significant digits, too coarse to order close
+    neighbours, so they only pick a shortlist that is rescored in float32.
+    """
+    k = min(k, len(block))
+    if block.dtype != torch.bfloat16:
+        return (queries @ block.T).topk(k, dim=1)
+    _, shortlist = (queries.bfloat16() @ block.T).topk(shortlist_size(k, len(block)), dim=1)
+    scores = torch.einsum("qd,qcd->qc", queries, block[shortlist].float())
+    scores, keep = scores.topk(k, dim=1)
+    return scores, shortlist.gather(1, keep)
+
+
+def _write_json(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+
+def _stamp(path):
+    """
+    Identifies one version of a file rewritten by _write_json (a replace gives it a new inode).
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_mtime_ns
+
+
+def _map(path, dtype, shape):
+    # Copy-on-write maps are writable views, which torch.from_numpy accepts without copying
+    if not shape[0]:
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="c", shape=shape)
+
+
+class EmbeddingStore:
+    """
+    Append-only, memory-mapped store of L2-normalized image embeddings, one row per analysis:
+        vectors.bin     N x dim bfloat16 or float16, or int8 scaled by 127 (half the size again)
+        rows.i64        N x 3: Image id, Prediction id, predicted class index
+        confidence.f32  N confidences of those predictions
+        meta.json       dim, dtype and the committed row count
+    Rows are committed by rewriting meta.json after the data, so readers (other threads or
+    processes) only ever map complete rows. There must be a single writing process.
+    """
+
+    def __init__(self, root=EMBEDDING_DIR, dim=None, dtype=EMBEDDING_DTYPE):
+        self.root = root
+        self._lock = threading.Lock()
+        self._maps = None
+        self._recovered = False
+        meta_path = os.path.join(root, "meta.json")
+        if os.path.isfile(meta_path):
+            with open(meta_path) as f:
+                self.meta = json.load(f)
+            if dim is not None and dim != self.meta["dim"]:
+                raise ValueError(f"{root} holds {self.meta['dim']}-dimensional embeddings, not {dim}")
+        else:
+            if dim is None:
+                raise ValueError(f"No embedding store in {root}; pass dim to create one")
+            if dtype not in DTYPES:
+                raise ValueError(f"Unknown embedding dtype '{dtype}', expected one of {sorted(DTYPES)}")
+            os.makedirs(root, exist_ok=True)
+            for name in ("vectors.bin", "rows.i64", "confidence.f32"):
+                open(os.path.join(root, name), "wb").close()
+            self.meta = {"version": FORMAT_VERSION, "dim": dim, "dtype": dtype, "count": 0}
+            _write_json(meta_path, self.meta)
+        self._meta_stamp = _stamp(meta_path)
+        self.dim, self.dtype = self.meta["dim"], self.meta["dtype"]
+
+    def __len__(self):
+        return self.meta["count"]
+
+    def _files(self):
+        row_bytes = self.dim * np.dtype(DTYPES[self.dtype]).itemsize
+        return (("vectors.bin", row_bytes), ("rows.i64", 24), ("confidence.f32", 4))
+
+    def add(self, vectors, image_ids, prediction_ids, class_indices, confidences):
+        """
+        Appends rows and returns the row number of the first one.
+        """
+        vectors = encode(vectors, self.dtype).reshape(-1, self.dim)
+        rows = np.stack([np.asarray(image_ids), np.asarray(prediction_ids), np.asarray(class_indices)],
+                        axis=1).astype(np.int64)
+        with self._lock:
+            count = self.meta["count"]
+            if not self._recovered:
+                # Drop rows a crashed writer appended but never committed
+                for name, row_bytes in self._files():
+                    with open(os.path.join(self.root, name), "ab") as f:
+                        f.truncate(count * row_bytes)
+                self._recovered = True
+            for name, data in (("vectors.bin", vectors), ("rows.i64", rows),
+                               ("confidence.f32", np.asarray(confidences, dtype=np.float32))):
+                with open(os.path.join(self.root, name), "ab") as f:
+                    f.write(np.ascontiguousarray(data).tobytes())
+            self.meta["count"] = count + len(vectors)
+            _write_json(os.path.join(self.root, "meta.json"), self.meta)
+            self._meta_stamp = _stamp(os.path.join(self.root, "meta.json"))
+        return count
+
+    def refresh(self):
+        """
+        Picks up rows committed by another process. Costs one stat() when nothing changed.
+        """
+        meta_path = os.path.join(self.root, "meta.json")
+        with self._lock:
+            stamp = _stamp(meta_path)
+            if stamp == self._meta_stamp:
+                return
+            with open(meta_path) as f:
+                self.meta = json.load(f)
+            self._meta_stamp = stamp
+
+    def arrays(self):
+        """
+        (vectors, rows, confidence) memory maps of every committed row.
+        """
+        with self._lock:
+            count = self.meta["count"]
+            if self._maps is None or self._maps[0] != count:
+                self._maps = (
+                    count,
+                    _map(os.path.join(self.root, "vectors.bin"), DTYPES[self.dtype], (count, self.dim)),
+                    _map(os.path.join(self.root, "rows.i64"), np.int64, (count, 3)),
+                    _map(os.path.join(self.root, "confidence.f32"), np.float32, (count,)),
+                )
+            return self._maps[1:]
+
+
+class VectorIndex:
+    def __init__(self, store, ivf_threshold=EMBEDDING_IVF_THRESHOLD, nprobe=EMBEDDING_NPROBE, chunk_rows=131072):
+        """
+        Cosine-similarity k-NN over an EmbeddingStore.
+        Below ivf_threshold rows, or before build() has run, every query is an exact chunked
+        matrix product over all vectors. Beyond it an inverted-file (IVF) index is used: the
+        vectors are clustered into ~2 sqrt(N) lists, stored list by list, and a query only scans
+        the nprobe lists whose centroids are closest. Rows added after the last build() are
+        always scanned exactly, so results never miss recent analyses.
+        Every search picks up rows committed and indexes built by other processes.
+        """
+        self.store = store
+        self.ivf_threshold = ivf_threshold
+        self.nprobe = nprobe
+        self.chunk_rows = chunk_rows
+        self.ivf = None
+        self.load()
+
+    def _ivf_dir(self):
+        return os.path.join(self.store.root, "ivf")
+
+    def load(self):
+        """
+        (Re)loads the IVF index written by build(), if any.
+        """
+        path = self._ivf_dir()
+        self._ivf_stamp = _stamp(os.path.join(path, "meta.json"))
+        if self._ivf_stamp is None:
+            self.ivf = None
+            return
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        self.ivf = dict(
+            meta,
+            centroids=torch.from_numpy(np.load(os.path.join(path, "centroids.npy"))),
+            offsets=np.load(os.path.join(path, "offsets.npy")),
+            order=np.load(os.path.join(path, "order.npy"), mmap_mode="r"),
+            vectors=_map(os.path.join(path, "vectors.bin"), DTYPES[self.store.dtype], (meta["count"], self.store.dim)),
+        )
+
+    def warm(self):
+        """
+        Faults every page of the IVF lists into this process's mapping by reading one byte per
+        page, so the first queries after startup do not pay for it (a cold list adds several
+        milliseconds to a query). Returns the bytes covered.
+        """
+        if self.ivf is None:
+            return 0
+        raw = self.ivf["vectors"].reshape(-1).view(np.uint8)
+        raw[::mmap.PAGESIZE].sum()
+        return raw.nbytes
+
+    def build(self, nlist=None, iterations=10, sample_per_list=64, seed=0):
+        """
+        Trains spherical k-means centroids on a sample, assigns every row and writes the
+        list-ordered copy of the vectors. Meant to run offline (python -m app.embeddings build)
+        whenever many rows were added; the swap to the new index is atomic for new readers.
+        """
+        vectors, _, _ = self.store.arrays()
+        count = len(vectors)
+        if not count:
+            raise ValueError("Cannot build an index over an empty store")
+        nlist = nlist or max(1, int(2 * math.sqrt(count)))
+        rng = np.random.default_rng(seed)
+        sample_rows = np.sort(rng.choice(count, min(count, nlist * sample_per_list), replace=False))
+        sample = decode(np.asarray(vectors[sample_rows]), self.store.dtype).float()
+        nlist = min(nlist, len(sample))
+        centroids = sample[torch.from_numpy(rng.choice(len(sample), nlist, replace=False))].clone()
+        for _ in range(iterations):
+            assign = (sample @ centroids.T).argmax(dim=1)
+            sums = torch.zeros_like(centroids).index_add_(0, assign, sample)
+            filled = torch.bincount(assign, minlength=nlist) > 0
+            centroids[filled] = torch.nn.functional.normalize(sums[filled], dim=1)
+        assignments = np.empty(count, dtype=np.int64)
+        for start in range(0, count, self.chunk_rows):
+            block = decode(np.asarray(vectors[start:start + self.chunk_rows]), self.store.dtype)
+            assignments[start:start + len(block)] = (block @ centroids.to(block.dtype).T).argmax(dim=1).numpy()
+        order = np.argsort(assignments, kind="stable")
+        offsets = np.searchsorted(assignments[order], np.arange(nlist + 1))
+
+        tmp = tempfile.mkdtemp(dir=self.store.root, prefix="ivf.")
+        with open(os.path.join(tmp, "vectors.bin"), "wb") as f:
+            for start in range(0, count, self.chunk_rows):
+                f.write(np.ascontiguousarray(vectors[order[start:start + self.chunk_rows]]).tobytes())
+        np.save(os.path.join(tmp, "centroids.npy"), centroids.numpy())
+        np.save(os.path.join(tmp, "offsets.npy"), offsets)
+        np.save(os.path.join(tmp, "order.npy"), order)
+        _write_json(os.path.join(tmp, "meta.json"), {"count": count, "nlist": nlist})
+        # Readers still mapping the old files keep valid (unlinked) pages
+        old = self._ivf_dir() + ".old"
+        if os.path.isdir(self._ivf_dir()):
+            os.replace(self._ivf_dir(), old)
+        os.replace(tmp, self._ivf_dir())
+        shutil.rmtree(old, ignore_errors=True)
+        self.load()
+        return {"count": count, "nlist": nlist, "largest_list": int(np.diff(offsets).max())}
+
+    def _exact(self, queries, vectors, first_row, k):
+        """
+        Top-k (scores, rows) per query over vectors[first_row:], chunk by chunk.
+        """
+        best_scores = torch.full((len(queries), 0), -2.0)
+        best_rows = torch.empty((len(queries), 0), dtype=torch.long)
+        for start in range(first_row, len(vectors), self.chunk_rows):
+            block = decode(np.asarray(vectors[start:start + self.chunk_rows]), self.store.dtype)
+            scores, rows = top_k(block, queries, k)
+            best_scores, keep = torch.cat([best_scores, scores], dim=1).topk(
+                min(k, best_scores.shape[1] + scores.shape[1]), dim=1)
+            best_rows = torch.cat([best_rows, rows + start], dim=1).gather(1, keep)
+        return best_scores, best_rows
+
+    def _probe(self, query, k):
+        """
+        Top-k (scores, rows) of one unit query over its nprobe closest IVF lists. Each list is
+        scored in place in the memory map into one buffer, instead of first gathering the lists
+        into a copy; bfloat16 scores only pick a shortlist that is rescored in float32 (see top_k).
+        """
+        ivf, dtype = self.ivf, self.store.dtype
+        lists = (ivf["centroids"] @ query).topk(min(self.nprobe, ivf["nlist"])).indices.tolist()
+        spans = [(int(ivf["offsets"][i]), int(ivf["offsets"][i + 1])) for i in sorted(lists)]
+        positions = np.concatenate([np.arange(a, b) for a, b in spans])
+        scores = torch.empty(len(positions), dtype=torch.bfloat16 if dtype == "bfloat16" else torch.float32)
+        filled = 0
+        for a, b in spans:
+            torch.mv(decode(ivf["vectors"][a:b], dtype), query.to(scores.dtype), out=scores[filled:filled + b - a])
+            filled += b - a
+        if dtype == "bfloat16":
+            _, shortlist = scores.topk(shortlist_size(k, len(scores)))
+            positions = np.sort(positions[shortlist.numpy()])
+            scores = decode(ivf["vectors"][positions], dtype).float() @ query
+        scores, keep = scores.topk(min(k, len(scores)))
+        return scores, torch.from_numpy(ivf["order"][positions[keep.numpy()]])
+
+    def search(self, queries, k=5, exact=False):
+        """
+        The k most similar stored rows for each query embedding (one vector or a matrix).
+        Returns one list per query of dicts: row, similarity, image_id, prediction_id,
+        predicted_class_index, confidence; best match first.
+        """
+        queries = torch.nn.functional.normalize(
+            torch.as_tensor(np.atleast_2d(np.asarray(queries, dtype=np.float32))), dim=1)
+        self.store.refresh()
+        if _stamp(os.path.join(self._ivf_dir(), "meta.json")) != self._ivf_stamp:
+            self.load()  # Rebuilt by another process
+        vectors, rows, confidence = self.store.arrays()
+        count = len(vectors)
+        indexed = 0
+        if not exact and self.ivf is not None and count >= self.ivf_threshold:
+            indexed = min(self.ivf["count"], count)
+        scores, found = self._exact(queries, vectors, indexed, k)
+        results = []
+        for query, tail_scores, tail_rows in zip(queries, scores, found):
+            if indexed:
+                ivf_scores, ivf_rows = self._probe(query, k)
+                tail_scores = torch.cat([tail_scores, ivf_scores])
+                tail_rows = torch.cat([tail_rows, ivf_rows])
+            top_scores, keep = tail_scores.topk(min(k, len(tail_scores)))
+            results.append([
+                {
+                    "row": int(row),
+                    "similarity": float(score),
+                    "image_id": int(rows[row, 0]),
+                    "prediction_id": int(rows[row, 1]),
+                    "predicted_class_index": int(rows[row, 2]),
+                    "confidence": float(confidence[row]),
+                }
+                for score, row in zip(top_scores.tolist(), tail_rows[keep].tolist())
+            ])
+        return results
+
+    def find_duplicate(self, embedding, threshold=EMBEDDING_DUPLICATE_THRESHOLD):
+        """
+        The stored row most similar to embedding if it reaches threshold, else None.
+        """
+        matches = self.search(embedding, k=1)[0]
+        return matches[0] if matches and matches[0]["similarity"] >= threshold else None
+
+
+def synthetic_embeddings(count, dim, clusters=2000, noise=0.5, seed=0, chunk=50000):
+    """
+    Yields chunks of clustered unit vectors, a stand-in for real image embeddings
+    (which group by class and by photo), for benchmarking.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    for start in range(0, count, chunk):
+        n = min(chunk, count - start)
+        block = centers[rng.integers(0, clusters, n)] + rng.standard_normal((n, dim)).astype(np.float32) * (
+            noise / math.sqrt(dim))
+        yield block / np.linalg.norm(block, axis=1, keepdims=True)
+
+
+def _latencies_ms(fn, queries):
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        fn(query)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2], timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or benchmark the embedding index.")
+    parser.add_argument("command", choices=["build", "bench"])
+    parser.add_argument("--dir", default=EMBEDDING_DIR)
+    parser.add_argument("--nlist", type=int, default=None, help="IVF lists (default: 2 sqrt(rows))")
+    parser.add_argument("--rows", type=int, default=1000000, help="Synthetic rows (bench)")
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--dtype", choices=sorted(DTYPES), default=EMBEDDING_DTYPE)
+    parser.add_argument("--nprobe", type=int, default=EMBEDDING_NPROBE)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    from app.instrumentation import configure_logging
+
+    configure_logging()
+    if args.command == "build":
+        store = EmbeddingStore(args.dir)
+        start = time.perf_counter()
+        info = VectorIndex(store).build(nlist=args.nlist)
+        print(f"[INFO] Indexed {info['count']} embeddings into {info['nlist']} lists in "
+              f"{time.perf_counter() - start:.1f}s (largest list {info['largest_list']})")
+        return
+
+    root = tempfile.mkdtemp(prefix="embedding_benchmark_")
+    try:
+        store = EmbeddingStore(root, dim=args.dim, dtype=args.dtype)
+        start = time.perf_counter()
+        for block in synthetic_embeddings(args.rows, args.dim):
+            store.add(block, np.full(len(block), -1), np.full(len(block), -1), np.zeros(len(block)),
+                      np.ones(len(block)))
+        print(f"[INFO] Stored {len(store)} {args.dtype} embeddings in {time.perf_counter() - start:.1f}s")
+        index = VectorIndex(store, ivf_threshold=0, nprobe=args.nprobe)
+        start = time.perf_counter()
+        info = index.build(nlist=args.nlist)
+        print(f"[INFO] Built {info['nlist']} IVF lists in {time.perf_counter() - start:.1f}s")
+        start = time.perf_counter()
+        warmed = index.warm()
+        print(f"[INFO] Warmed {warmed / 2**20:.0f} MB of lists in {time.perf_counter() - start:.1f}s")
+        # Near-duplicates of stored rows: what duplicate detection and similar-case lookup ask for
+        rng = np.random.default_rng(1)
+        vectors, _, _ = store.arrays()
+        targets = np.sort(rng.choice(len(store), args.queries, replace=False))
+        queries = decode(np.asarray(vectors[targets]), args.dtype).float().numpy()
+        queries += rng.standard_normal(queries.shape).astype(np.float32) * (0.2 / math.sqrt(args.dim))
+        exact = [[m["row"] for m in index.search(q, k=10, exact=True)[0]] for q in queries[:50]]
+        approx = [[m["row"] for m in index.search(q, k=10)[0]] for q in queries[:50]]
+        recall = np.mean([len(set(a) & set(e)) / len(e) for a, e in zip(approx, exact)])
+        exact_p50, exact_p99 = _latencies_ms(lambda q: index.search(q, k=10, exact=True), queries[:20])
+        ivf_p50, ivf_p99 = _latencies_ms(lambda q: index.search(q, k=10), queries)
+        print(f"[RESULT] {len(store)} x {args.dim} {args.dtype}, k=10")
+        print(f"[RESULT] exact: p50 {exact_p50:.2f} ms  p99 {exact_p99:.2f} ms")
+        print(f"[RESULT] IVF (nprobe {args.nprobe}): p50 {ivf_p50:.2f} ms  p99 {ivf_p99:.2f} ms  "
+              f"recall@10 {recall:.3f}")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+# inference_backends.py
+
+import argparse
+import os
+
+import torch
+
+from app.instrumentation import configure_logging
+
+# Exported artifacts live next to plant_village_vit_metadata.json at the repository root
+ARTIFACT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ONNX_FILE = "plant_village_vit.onnx"
+TORCHSCRIPT_FILE = "plant_village_vit.torchscript.pt"
+BACKENDS = ("eager", "torchscript", "compile", "onnx")
+
+
+class _LogitsOnly(torch.nn.Module):
+    """
+    Wraps a ViTForImageClassification so tracing/exporting sees a plain tensor -> tensor function.
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        return self.model(pixel_values=pixel_values).logits
+
+
+def default_artifact_path(backend):
+    return os.path.join(ARTIFACT_DIR, ONNX_FILE if backend == "onnx" else TORCHSCRIPT_FILE)
+
+
+def export_onnx(model, path=None, image_size=224, opset=17):
+    """
+    Exports the model to ONNX with a dynamic batch dimension.
+    """
+    path = path or default_artifact_path("onnx")
+    dummy = torch.zeros(1, 3, image_size, image_size)
+    torch.onnx.export(
+        _LogitsOnly(model.float()).eval(),
+        (dummy,),
+        path,
+        input_names=["pixel_values"],
+        output_names=["logits"],
+        dynamic_axes={"pixel_values": {0: "batch"}, "logits": {0: "batch"}},
+        opset_version=opset,
+        dynamo=False,
+    )
+    return path
+
+
+def export_torchscript(model, path=None, image_size=224):
+    """
+    Traces the model into a frozen TorchScript module.
+    """
+    path = path or default_artifact_path("torchscript")
+    dummy = torch.zeros(2, 3, image_size, image_size)
+    with torch.no_grad():
+        traced = torch.jit.trace(_LogitsOnly(model.float()).eval(), dummy)
+        traced = torch.jit.freeze(traced)
+    traced.save(path)
+    return path
+
+
+class EagerBackend:
+    def __init__(self, model):
+        self.model = model
+
+    def __call__(self, pixel_values):
+        return self.model(pixel_values).logits.float()
+
+
+class CompiledBackend:
+    def __init__(self, model):
+        """
+        torch.compile graph-captures the model on the first call per input shape.
+        """
+        self.module = torch.compile(_LogitsOnly(model))
+
+    def __call__(self, pixel_values):
+        return self.module(pixel_values).float()
+
+
+class TorchScriptBackend:
+    def __init__(self, path, device="cpu"):
+        self.module = torch.jit.load(path, map_location=device).eval()
+
+    def __call__(self, pixel_values):
+        return self.module(pixel_values.float())
+
+
+class OnnxRuntimeBackend:
+    def __init__(self, path, intra_op_threads=0, inter_op_threads=0):
+        """
+        Runs the exported graph with ONNX Runtime on CPU. Thread counts of 0 let ORT decide.
+        """
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+        self.session = ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+
+    def __call__(self, pixel_values):
+        logits = self.session.run(["logits"], {"pixel_values": pixel_values.float().cpu().numpy()})[0]
+        return torch.from_numpy(logits)
+
+
+def create_backend(backend, model, path=None, device="cpu", intra_op_threads=0, inter_op_threads=0):
+    """
+    Builds the callable (pixel_values -> logits) that PlantHealthService runs its forward pass through.
+    """
+    if backend == "eager":
+        return EagerBackend(model)
+    if backend == "compile":
+        return CompiledBackend(model)
+    path = path or default_artifact_path(backend)
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"No exported {backend} model at {path}; run `python -m app.inference_backends export`")
+    if backend == "torchscript":
+        return TorchScriptBackend(path, device=device)
+    if backend == "onnx":
+        return OnnxRuntimeBackend(path, intra_op_threads=intra_op_threads, inter_op_threads=inter_op_threads)
+    raise ValueError(f"Unknown backend '{backend}', expected one of {BACKENDS}")
+
+
+def check_parity(model, backend, pixel_values, atol=1e-3):
+    """
+    Compares a backend against the eager model on the same inputs.
+    Returns the max absolute logit difference, top-1 agreement and whether both are within tolerance.
+    """
+    with torch.no_grad():
+        expected = model(pixel_values).logits.float()
+        actual = backend(pixel_values)
+    max_abs_diff = (expected - actual).abs().max().item()
+    agreement = (expected.argmax(-1) == actual.argmax(-1)).float().mean().item()
+    return {"max_abs_diff": max_abs_diff, "top1_agreement": agreement, "ok": max_abs_diff <= atol and agreement == 1.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export PlantHealthService's model and check backend parity.")
+    parser.add_argument("command", choices=["export", "parity"])
+    parser.add_argument("--format", choices=["onnx", "torchscript"], default="onnx")
+    parser.add_argument("--model", default="Akshay0706/Plant-Village-1-Epochs-Model")
+    parser.add_argument("--snapshot-dir", default=None)
+    parser.add_argument("--out", default=None, help="Artifact path (defaults to the repository root)")
+    parser.add_argument("--images", type=int, default=8, help="Held-out images used for the parity check")
+    parser.add_argument("--atol", type=float, default=1e-3)
+    args = parser.parse_args()
+    configure_logging()
+
+    from app.plant_health_service import PlantHealthService
+    from app.precision import holdout_slice
+    from PIL import Image
+
+    service = PlantHealthService(model_name=args.model, snapshot_dir=args.snapshot_dir, device="cpu", backend="eager")
+    size = service.processor.size["height"]
+    if args.command == "export":
+        exporter = export_onnx if args.format == "onnx" else export_torchscript
+        path = exporter(service.model, args.out, image_size=size)
+        print(f"[INFO] Exported {args.format} model to {path}")
+
+    backend = create_backend(args.format, service.model, path=args.out)
+    paths = holdout_slice(per_class=1)[:args.images]
+    images = [Image.open(p).convert("RGB") for p in paths]
+    pixel_values = service.processor(images=images, return_tensors="pt")["pixel_values"]
+    report = check_parity(service.model, backend, pixel_values, atol=args.atol)
+    print(f"[INFO] Parity vs eager on {len(images)} images: {report}")
+    if not report["ok"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+# instrumentation.py
+
+import bisect
+import itertools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from app.config import LOG_LEVEL, PROFILE_DIR, PROFILE_EVERY_N
+
+# Latency buckets in seconds, from sub-millisecond decode to multi-second cold batches
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def configure_logging(level=LOG_LEVEL):
+    """
+    Configures the root logger for the CLIs and the server. Library code only calls
+    logging.getLogger(__name__) and logs per-prediction details at DEBUG, so the hot path
+    stays silent unless LOG_LEVEL=DEBUG.
+    """
+    logging.basicConfig(level=getattr(logging, str(level).upper(), logging.WARNING),
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels.get(name, "") for name in self.labelnames), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        """
+        Cumulative-bucket histogram. observe() is a bisect and three additions under a lock.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def snapshot(self, **labels):
+        """
+        Returns (count, sum) for one label set.
+        """
+        series = self._series.get(tuple(labels.get(name, "") for name in self.labelnames))
+        if series is None:
+            return 0, 0.0
+        return sum(series[:-1]), series[-1]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = list(itertools.accumulate(series[:-1]))
+                for bound, count in zip(self.buckets, cumulative):
+                    labels = _format_labels(self.labelnames, key, [("le", repr(bound))])
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', '+Inf')])} "
+                             f"{cumulative[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {series[-1]}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric '{name}' is already registered as a {type(metric).__name__}")
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets)
+
+    def render_prometheus(self):
+        """
+        Renders every metric in the Prometheus text exposition format (version 0.0.4).
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+STAGE_SECONDS = REGISTRY.histogram("leafcheck_stage_seconds", "Time spent per inference stage.", ("stage",))
+IMAGES_TOTAL = REGISTRY.counter("leafcheck_images_total", "Images that went through the model.")
+BATCHES_TOTAL = REGISTRY.counter("leafcheck_batches_total", "Forward passes run.")
+BATCH_SIZE = REGISTRY.histogram("leafcheck_batch_size", "Images per forward pass.",
+                                buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+ERRORS_TOTAL = REGISTRY.counter("leafcheck_errors_total", "Failed requests by stage.", ("stage",))
+CACHE_TOTAL = REGISTRY.counter("leafcheck_cache_requests_total", "Prediction cache lookups.", ("result",))
+TTA_TOTAL = REGISTRY.counter("leafcheck_tta_total", "Images by test-time augmentation outcome.", ("result",))
+MODEL_SWAPS_TOTAL = REGISTRY.counter("leafcheck_model_swaps_total", "Active model versions swapped in.")
+SHADOW_TOTAL = REGISTRY.counter("leafcheck_shadow_predictions_total", "Shadow-scored requests by outcome.", ("result",))
+
+
+@contextmanager
+def stage_timer(stage):
+    """
+    Records the wall time of the block in leafcheck_stage_seconds{stage=...}.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+
+class SamplingProfiler:
+    def __init__(self, every_n=PROFILE_EVERY_N, output_dir=PROFILE_DIR):
+        """
+        Runs the torch profiler around 1 in every_n calls and writes a Chrome trace per sample
+        to output_dir (open in chrome://tracing or Perfetto). every_n=0 disables it, and then
+        profile() costs one integer comparison.
+        """
+        self.every_n = every_n
+        self.output_dir = output_dir
+        self._calls = itertools.count(1)
+        self._logger = logging.getLogger(__name__)
+
+    @contextmanager
+    def profile(self, name="predict_batch"):
+        if not self.every_n or next(self._calls) % self.every_n:
+            yield
+            return
+        from torch.profiler import ProfilerActivity, profile
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        with profile(activities=[ProfilerActivity.CPU], record_shapes=True) as prof:
+            yield
+        path = os.path.join(self.output_dir, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+                                             f"-{time.perf_counter_ns()}.json")
+        prof.export_chrome_trace(path)
+        self._logger.info("Profiler trace written to %s", path)
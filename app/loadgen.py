@@ -0,0 +1,344 @@
+# loadgen.py
+
+import argparse
+import json
+import os
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from app.benchmark import git_commit, percentile
+from app.config import SERVER_PORT
+from app.instrumentation import configure_logging
+from app.precision import IMAGE_EXTENSIONS
+
+DEFAULT_IMAGES = ("test/test_leaf.JPG",)
+LATENCY_BUCKETS_MS = tuple(round(2 ** (i / 2), 1) for i in range(33))  # 1 ms .. 65 s, sqrt(2) apart
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+def load_image_pool(paths, limit=None):
+    """
+    Reads the images at paths (files, or directories searched recursively) into memory, so
+    disk reads never show up in the measured latency. Returns (path, bytes) pairs.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in sorted(os.walk(path)):
+                files.extend(os.path.join(root, name) for name in sorted(names)
+                             if name.lower().endswith(IMAGE_EXTENSIONS))
+        else:
+            files.append(path)
+    pool = []
+    for path in files[:limit]:
+        with open(path, "rb") as f:
+            pool.append((path, f.read()))
+    if not pool:
+        raise ValueError(f"No images found in {list(paths)}")
+    return pool
+
+
+def arrival_times(rate, duration, process="poisson", seed=0):
+    """
+    Open-loop send times (seconds from the start) for rate requests/sec over duration seconds:
+    exponential gaps ("poisson", bursty like real users) or evenly spaced ("uniform").
+    """
+    if process == "uniform":
+        return list(np.arange(0, duration, 1 / rate))
+    rng = np.random.default_rng(seed)
+    times, t = [], rng.exponential(1 / rate)
+    while t < duration:
+        times.append(t)
+        t += rng.exponential(1 / rate)
+    return times
+
+
+def load_request_log(path, pool, rate=None, speed=1.0):
+    """
+    Builds a schedule from a JSON-lines request log, one request per line:
+        {"t": <seconds since the first request>, "image": <path>}
+    Both keys are optional: lines without "t" are spaced at `rate` requests/sec and lines
+    without "image" take the next image of the pool, so any JSON-lines log (e.g. a
+    requests.jsonl) can be replayed. speed > 1 replays faster than recorded.
+    Returns (time, path, bytes) triples sorted by time.
+    """
+    with open(path) as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+    images = {}
+    schedule = []
+    for i, entry in enumerate(entries):
+        t = entry.get("t")
+        if t is None:
+            if not rate:
+                raise ValueError(f"Line {i + 1} of {path} has no 't'; pass a rate to space such requests")
+            t = i / rate
+        image = entry.get("image")
+        if image is None:
+            image, body = pool[i % len(pool)]
+        else:
+            if image not in images:
+                with open(image, "rb") as f:
+                    images[image] = f.read()
+            body = images[image]
+        schedule.append((float(t) / speed, image, body))
+    schedule.sort(key=lambda item: item[0])
+    return schedule
+
+
+class InProcessTarget:
+    def __init__(self, predictor):
+        """
+        Calls predict_bytes() of a PlantHealthService (or InferenceWorkerPool) directly.
+        """
+        self.predictor = predictor
+        self.name = f"in-process {type(predictor).__name__}"
+
+    def __call__(self, body):
+        return "ok" if self.predictor.predict_bytes(body) is not None else "error"
+
+
+class HttpTarget:
+    def __init__(self, url, timeout=30.0):
+        """
+        POSTs each image as a multipart upload to the server's /predictions endpoint
+        (app/server.py). 429 answers count as "rejected", other failures as "error".
+        """
+        self.url = url.rstrip("/") + "/predictions"
+        self.timeout = timeout
+        self.name = f"http {self.url}"
+
+    def __call__(self, body):
+        boundary = uuid.uuid4().hex
+        data = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"image\"; filename=\"image.jpg\"\r\n"
+                f"Content-Type: image/jpeg\r\n\r\n").encode() + body + f"\r\n--{boundary}--\r\n".encode()
+        request = urllib.request.Request(self.url, data=data, method="POST",
+                                         headers={"Content-Type": f"multipart/form-data; boundary={boundary}"})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+        except urllib.error.HTTPError as e:
+            return "rejected" if e.code == 429 else "error"
+        except OSError:
+            return "error"
+        return "ok"
+
+
+def run_schedule(target, schedule, concurrency=4, drain_timeout=60.0):
+    """
+    Sends the scheduled requests open-loop: each one is queued at its send time whether or
+    not earlier ones have finished, and up to `concurrency` are in flight at once.
+    Returns a structured array of (intended, started, finished) times in seconds since the
+    start, with the status of each request. Requests still queued drain_timeout seconds
+    after the last send time are dropped (NaN start and finish, status "dropped").
+    """
+    records = np.full(len(schedule), np.nan, dtype=[("intended", "f8"), ("started", "f8"), ("finished", "f8")])
+    statuses = ["dropped"] * len(schedule)
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="loadgen")
+    start = time.perf_counter()
+
+    def send(i, body):
+        records["started"][i] = time.perf_counter() - start
+        try:
+            status = target(body)
+        except Exception:
+            status = "error"
+        records["finished"][i] = time.perf_counter() - start
+        statuses[i] = status
+
+    futures = []
+    for i, (t, _, body) in enumerate(schedule):
+        delay = t - (time.perf_counter() - start)
+        if delay > 0:
+            time.sleep(delay)
+        # The intended time, not the actual one: a stalled sender must not hide queueing
+        records["intended"][i] = t
+        futures.append(executor.submit(send, i, body))
+    deadline = time.perf_counter() + drain_timeout
+    for future in futures:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            break
+        try:
+            future.result(timeout=remaining)
+        except Exception:
+            break
+    for future in futures:
+        future.cancel()
+    executor.shutdown(wait=True)
+    return records, statuses
+
+
+def _latency_summary(latencies_ms):
+    if not len(latencies_ms):
+        return None
+    summary = {f"p{q:g}": percentile(latencies_ms, q) for q in PERCENTILES}
+    summary["mean"] = float(np.mean(latencies_ms))
+    summary["max"] = float(np.max(latencies_ms))
+    return summary
+
+
+def summarize(records, statuses, offered_rate, duration, interval=1.0):
+    """
+    Stage report: counts, error rate, throughput, service time (start to finish) and
+    response time (intended send to finish, i.e. corrected for coordinated omission)
+    percentiles, a response time histogram and a timeline of per-interval throughput,
+    latency, queue depth (sent but not started) and requests in flight.
+    """
+    statuses = np.asarray(statuses)
+    done = ~np.isnan(records["finished"])
+    ok = done & (statuses == "ok")
+    response_ms = (records["finished"] - records["intended"]) * 1000
+    service_ms = (records["finished"] - records["started"]) * 1000
+    end = float(np.nanmax(records["finished"])) if done.any() else duration
+    counts, _ = np.histogram(response_ms[ok], bins=(0,) + LATENCY_BUCKETS_MS + (np.inf,))
+    started = np.where(np.isnan(records["started"]), np.inf, records["started"])
+    finished = np.where(np.isnan(records["finished"]), np.inf, records["finished"])
+    timeline = []
+    for t0 in np.arange(0, max(end, duration), interval):
+        t1 = t0 + interval
+        window = ok & (finished >= t0) & (finished < t1)
+        timeline.append({
+            "t": round(float(t0), 3),
+            "sent": int(((records["intended"] >= t0) & (records["intended"] < t1)).sum()),
+            "completed": int(window.sum()),
+            "errors": int((done & ~ok & (finished >= t0) & (finished < t1)).sum()),
+            "throughput": float(window.sum() / interval),
+            "response_p50_ms": percentile(response_ms[window], 50) if window.any() else None,
+            "response_p99_ms": percentile(response_ms[window], 99) if window.any() else None,
+            "queue_depth": int(((records["intended"] <= t1) & (started > t1)).sum()),
+            "in_flight": int(((started <= t1) & (finished > t1)).sum()),
+        })
+    total = len(records)
+    return {
+        "offered_rate": offered_rate,
+        "duration_s": duration,
+        "requests": total,
+        "sent_rate": total / duration if duration else 0.0,
+        "completed": int(ok.sum()),
+        "errors": int((statuses == "error").sum()),
+        "rejected": int((statuses == "rejected").sum()),
+        "dropped": int((statuses == "dropped").sum()),
+        "error_rate": float((total - ok.sum()) / total) if total else 0.0,
+        "throughput": float(ok.sum() / max(end, duration)) if total else 0.0,
+        "response_ms": _latency_summary(response_ms[ok]),
+        "service_ms": _latency_summary(service_ms[ok]),
+        "histogram": {"le_ms": list(LATENCY_BUCKETS_MS) + ["+Inf"], "counts": counts.tolist()},
+        "timeline": timeline,
+    }
+
+
+def find_saturation(stages, slo_ms=1000.0, min_throughput_ratio=0.95, max_error_rate=0.01):
+    """
+    The lowest offered rate at which the target stops keeping up: throughput below
+    min_throughput_ratio of the rate actually sent (random arrivals rarely hit the offered
+    rate exactly), corrected p99 above slo_ms or more than
+    max_error_rate failures. None if every stage kept up.
+    """
+    for stage in stages:
+        p99 = stage["response_ms"]["p99"] if stage["response_ms"] else float("inf")
+        if (stage["throughput"] < min_throughput_ratio * stage["sent_rate"] or p99 > slo_ms
+                or stage["error_rate"] > max_error_rate):
+            return stage["offered_rate"]
+    return None
+
+
+def run_load(target, pool, rates=(1.0,), duration=30.0, concurrency=4, process="poisson", log=None, speed=1.0,
+             drain_timeout=60.0, interval=1.0, slo_ms=1000.0, seed=0):
+    """
+    Runs one stage per offered rate (or a single replay of a request log) and returns the
+    report. Stages run back to back, lowest rate first, so the saturation point is the first
+    stage that falls behind.
+    """
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "target": target.name,
+        "concurrency": concurrency,
+        "arrivals": "replay" if log else process,
+        "request_log": log,
+        "image_pool": len(pool),
+        "slo_ms": slo_ms,
+        "stages": [],
+    }
+    if log:
+        stages = [(rates[0] if rates else None, load_request_log(log, pool, rate=rates[0] if rates else None,
+                                                                 speed=speed))]
+    else:
+        stages = []
+        for rate in sorted(rates):
+            times = arrival_times(rate, duration, process, seed)
+            stages.append((rate, [(t, *pool[i % len(pool)]) for i, t in enumerate(times)]))
+    for rate, schedule in stages:
+        if not schedule:
+            continue
+        length = max(duration if not log else 0.0, schedule[-1][0])
+        offered = rate if rate and not log else len(schedule) / max(length, 1e-9)
+        print(f"[INFO] Stage: {len(schedule)} requests at {offered:.2f}/s for {length:.1f}s")
+        records, statuses = run_schedule(target, schedule, concurrency, drain_timeout)
+        stage = summarize(records, statuses, offered, length, interval)
+        report["stages"].append(stage)
+        response = stage["response_ms"] or {}
+        print(f"[RESULT] offered {offered:7.2f}/s  achieved {stage['throughput']:7.2f}/s  "
+              f"p50 {response.get('p50', float('nan')):8.1f} ms  p99 {response.get('p99', float('nan')):8.1f} ms  "
+              f"errors {stage['error_rate']:.1%}")
+    report["saturation_rate"] = find_saturation(report["stages"], slo_ms)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Open-loop load generator for the inference path.")
+    parser.add_argument("--url", default=None,
+                        help=f"Server to load, e.g. http://localhost:{SERVER_PORT} (default: in-process service)")
+    parser.add_argument("--images", nargs="+", default=list(DEFAULT_IMAGES), help="Image files or directories")
+    parser.add_argument("--pool-size", type=int, default=None, help="Use at most this many images")
+    parser.add_argument("--rates", type=float, nargs="+", default=[1.0], help="Offered requests/sec, one stage each")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds per stage")
+    parser.add_argument("--arrivals", choices=["poisson", "uniform"], default="poisson")
+    parser.add_argument("--log", default=None, help="Replay this JSON-lines request log instead")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed-up factor")
+    parser.add_argument("--concurrency", type=int, default=4, help="Maximum requests in flight")
+    parser.add_argument("--drain-timeout", type=float, default=60.0)
+    parser.add_argument("--interval", type=float, default=1.0, help="Timeline resolution in seconds")
+    parser.add_argument("--slo-ms", type=float, default=1000.0, help="p99 response time that marks saturation")
+    parser.add_argument("--output", default="loadgen_report.json")
+    parser.add_argument("--model", default="Akshay0706/Plant-Village-1-Epochs-Model")
+    parser.add_argument("--snapshot-dir", default=None)
+    parser.add_argument("--workers", type=int, default=1, help="In-process inference worker processes")
+    args = parser.parse_args()
+    configure_logging()
+
+    pool = load_image_pool(args.images, args.pool_size)
+    predictor = None
+    if args.url:
+        target = HttpTarget(args.url)
+    elif args.workers > 1:
+        from app.worker_pool import InferenceWorkerPool
+
+        predictor = InferenceWorkerPool(args.workers, model_name=args.model, snapshot_dir=args.snapshot_dir)
+        target = InProcessTarget(predictor)
+    else:
+        from app.plant_health_service import PlantHealthService
+
+        target = InProcessTarget(PlantHealthService(model_name=args.model, snapshot_dir=args.snapshot_dir,
+                                                    warmup=True))
+    try:
+        report = run_load(target, pool, rates=args.rates, duration=args.duration, concurrency=args.concurrency,
+                          process=args.arrivals, log=args.log, speed=args.speed, drain_timeout=args.drain_timeout,
+                          interval=args.interval, slo_ms=args.slo_ms)
+    finally:
+        if predictor is not None:
+            predictor.close()
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    saturation = report["saturation_rate"]
+    print(f"[INFO] Report written to {args.output}; "
+          + (f"saturated at {saturation:.2f} requests/sec" if saturation is not None else "no stage saturated"))
+
+
+if __name__ == "__main__":
+    main()
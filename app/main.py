@@ -1,16 +1,12 @@
 import streamlit as st
-import boto3
-from config import validate_config, AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_REGION, AWS_BUCKET_NAME
+from config import validate_config, AWS_REGION, AWS_BUCKET_NAME
+from app.storage import get_s3_client
 
 def test_aws_connection():
     """Test AWS S3 connection by listing buckets"""
     try:
-        s3 = boto3.client(
-            's3',
-            aws_access_key_id=AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-            region_name=AWS_REGION
-        )
+        # Shared, pooled client (see app/storage.py) instead of a new one on every rerun
+        s3 = get_s3_client()
         buckets = s3.list_buckets()
         return True, f"Successfully connected to AWS. Found {len(buckets['Buckets'])} buckets."
     except Exception as e:
@@ -0,0 +1,292 @@
+# model_registry.py
+
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from app.benchmark import percentile
+from app.config import MODEL_SHADOW_FRACTION, MODEL_SHADOW_MAX_PENDING
+from app.instrumentation import MODEL_SWAPS_TOTAL, SHADOW_TOTAL
+
+logger = logging.getLogger(__name__)
+
+
+def default_service_factory(**kwargs):
+    """
+    A warmed-up PlantHealthService; kwargs override its constructor defaults (model_name,
+    revision, snapshot_dir, precision, backend, ...).
+    """
+    from app.plant_health_service import PlantHealthService
+
+    return PlantHealthService(**dict({"warmup": True}, **kwargs))
+
+
+def model_version(service):
+    return getattr(service, "model_version", None) or getattr(service, "model_name", type(service).__name__)
+
+
+class ModelRegistry:
+    def __init__(self, service_factory=default_service_factory, shadow_fraction=MODEL_SHADOW_FRACTION,
+                 shadow_max_pending=MODEL_SHADOW_MAX_PENDING, shadow_samples=10000, **initial):
+        """
+        Serves predictions from one active model version that can be replaced while serving.
+
+        - load() builds a new version with service_factory(**options) on a background thread
+          (the factory warms it up), then swaps it in atomically: requests that already
+          picked the old version finish on it, new ones go to the new version, and the old
+          one is closed (if it has close()) once its last request is done.
+        - load(..., shadow=True) installs the version as a candidate instead: a shadow_fraction
+          of requests is re-scored on it in the background, off the request path, to compare
+          latency and top-1 agreement (shadow_report()) before promote().
+
+        The initial version is built synchronously from `initial` (the factory's kwargs).
+        Anything with predict_bytes() works as a service, e.g. an InferenceWorkerPool.
+        """
+        self.service_factory = service_factory
+        self.shadow_fraction = shadow_fraction
+        self.shadow_max_pending = shadow_max_pending
+        self._lock = threading.Lock()
+        self._in_flight = {}  # id(service) -> requests running on it
+        self._retired = {}  # id(service) -> replaced service still finishing requests
+        self._loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ModelRegistry")
+        self._shadow = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ModelRegistryShadow")
+        self._shadow_pending = 0
+        self._shadow_stats = None
+        self._shadow_samples = shadow_samples
+        self._loading = None
+        self.load_error = None
+        self.swaps = 0
+        self.candidate = None
+        self.active = service_factory(**initial)
+        logger.info("Serving model %s", model_version(self.active))
+
+    def load(self, shadow=False, **options):
+        """
+        Starts building a version from service_factory(**options) in the background and returns
+        a Future of it. Once built it becomes active, or the shadow candidate with shadow=True.
+        """
+        def build():
+            start = time.perf_counter()
+            try:
+                service = self.service_factory(**options)
+            except Exception as e:
+                # The active version keeps serving
+                logger.error("Loading model %s failed: %s", options, e)
+                self.load_error = str(e)
+                raise
+            self.load_error = None
+            logger.info("Loaded model %s in %.1fs", model_version(service), time.perf_counter() - start)
+            if shadow:
+                self.set_candidate(service)
+            else:
+                self.activate(service)
+            return service
+
+        with self._lock:
+            self._loading = self._loader.submit(build)
+            return self._loading
+
+    def activate(self, service):
+        """
+        Makes service the active version; the previous one drains and is closed.
+        """
+        with self._lock:
+            previous, self.active = self.active, service
+            self.swaps += 1
+            if previous is not None and previous is not service:
+                self._retired[id(previous)] = previous
+        MODEL_SWAPS_TOTAL.inc()
+        logger.info("Swapped model %s -> %s", model_version(previous), model_version(service))
+        self._close_if_retired(previous)
+
+    def set_candidate(self, service, fraction=None):
+        """
+        Installs (or with None removes) the shadow candidate and resets the shadow statistics.
+        """
+        with self._lock:
+            previous, self.candidate = self.candidate, service
+            if fraction is not None:
+                self.shadow_fraction = fraction
+            self._shadow_stats = {"requests": 0, "agreements": 0, "errors": 0, "skipped": 0,
+                                  "active_ms": deque(maxlen=self._shadow_samples),
+                                  "candidate_ms": deque(maxlen=self._shadow_samples)}
+            if previous is not None and previous is not service:
+                self._retired[id(previous)] = previous
+        self._close_if_retired(previous)
+
+    def promote(self):
+        """
+        Makes the shadow candidate the active version.
+        """
+        with self._lock:
+            candidate, self.candidate = self.candidate, None
+        if candidate is None:
+            raise RuntimeError("No candidate model to promote")
+        self.activate(candidate)
+
+    def _acquire(self, service_attr):
+        with self._lock:
+            service = getattr(self, service_attr)
+            if service is not None:
+                self._in_flight[id(service)] = self._in_flight.get(id(service), 0) + 1
+            return service
+
+    def _release(self, service):
+        with self._lock:
+            self._in_flight[id(service)] -= 1
+            if self._in_flight[id(service)]:
+                return
+            del self._in_flight[id(service)]
+        self._close_if_retired(service)
+
+    def _close_if_retired(self, service):
+        with self._lock:
+            if id(service) in self._in_flight:
+                return  # Its last request closes it
+            retired = self._retired.pop(id(service), None)
+        if retired is not None:
+            close = getattr(retired, "close", None)
+            if close is not None:
+                close()
+            logger.info("Retired model %s", model_version(retired))
+
+    def _call(self, method, *args, **kwargs):
+        service = self._acquire("active")
+        try:
+            return getattr(service, method)(*args, **kwargs)
+        finally:
+            self._release(service)
+
+    def predict(self, image):
+        return self._call("predict", image)
+
+    def predict_batch(self, images):
+        return self._call("predict_batch", images)
+
+    def predict_from_path(self, image_path, user_id=None):
+        return self._call("predict_from_path", image_path, user_id=user_id)
+
+    def predict_bytes(self, image_bytes):
+        """
+        Runs prediction on the active version; a shadow_fraction of requests is also queued for
+        the candidate. The result carries the active "model_version".
+        """
+        service = self._acquire("active")
+        try:
+            start = time.perf_counter()
+            result = service.predict_bytes(image_bytes)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+        finally:
+            self._release(service)
+        if result is not None and self.candidate is not None and random.random() < self.shadow_fraction:
+            self._submit_shadow(image_bytes, result, elapsed_ms)
+        return result
+
+    def _submit_shadow(self, image_bytes, result, active_ms):
+        with self._lock:
+            stats = self._shadow_stats
+            if self._shadow_pending >= self.shadow_max_pending:
+                # Shadow work must never build up behind live traffic
+                stats["skipped"] += 1
+                SHADOW_TOTAL.inc(result="skipped")
+                return
+            self._shadow_pending += 1
+        self._shadow.submit(self._score_shadow, image_bytes, result, active_ms, stats)
+
+    def _score_shadow(self, image_bytes, result, active_ms, stats):
+        candidate = self._acquire("candidate")
+        try:
+            if candidate is None:
+                return
+            start = time.perf_counter()
+            try:
+                shadow = candidate.predict_bytes(image_bytes)
+            except Exception as e:
+                logger.warning("Shadow prediction on %s failed: %s", model_version(candidate), e)
+                shadow = None
+            candidate_ms = (time.perf_counter() - start) * 1000
+            with self._lock:
+                if stats is not self._shadow_stats:
+                    return  # The candidate changed while this request was queued
+                stats["requests"] += 1
+                if shadow is None:
+                    stats["errors"] += 1
+                    SHADOW_TOTAL.inc(result="error")
+                    return
+                agree = shadow["predicted_class_index"] == result["predicted_class_index"]
+                stats["agreements"] += agree
+                stats["active_ms"].append(active_ms)
+                stats["candidate_ms"].append(candidate_ms)
+            SHADOW_TOTAL.inc(result="agree" if agree else "disagree")
+        finally:
+            with self._lock:
+                self._shadow_pending -= 1
+            if candidate is not None:
+                self._release(candidate)
+
+    def shadow_report(self):
+        """
+        Top-1 agreement and latency of the candidate vs. the active version on shadowed requests.
+        The latencies are not measured under the same conditions: active_ms is timed on the live
+        path (with its concurrency, batching and cache hits), candidate_ms one request at a time
+        on the shadow thread. Treat them as a sanity check, not a benchmark; compare the models
+        with app/benchmark.py before promoting on latency.
+        """
+        with self._lock:
+            if self.candidate is None:
+                return None
+            stats = dict(self._shadow_stats, active_ms=list(self._shadow_stats["active_ms"]),
+                         candidate_ms=list(self._shadow_stats["candidate_ms"]))
+            active, candidate = model_version(self.active), model_version(self.candidate)
+        scored = stats["requests"] - stats["errors"]
+        report = {
+            "active": active,
+            "candidate": candidate,
+            "fraction": self.shadow_fraction,
+            "requests": stats["requests"],
+            "errors": stats["errors"],
+            "skipped": stats["skipped"],
+            "agreement": stats["agreements"] / scored if scored else None,
+        }
+        for side in ("active_ms", "candidate_ms"):
+            samples = stats[side]
+            report[side] = {"p50": percentile(samples, 50), "p99": percentile(samples, 99)} if samples else None
+        return report
+
+    def status(self):
+        with self._lock:
+            loading = self._loading is not None and not self._loading.done()
+            active = model_version(self.active)
+            retired = [model_version(service) for service in self._retired.values()]
+            swaps = self.swaps
+        return {
+            "active": active,
+            "loading": loading,
+            "load_error": self.load_error,
+            "retiring": retired,
+            "swaps": swaps,
+            "shadow": self.shadow_report(),
+        }
+
+    def close(self):
+        """
+        Waits for pending loads and shadow work, then closes every version.
+        """
+        self._loader.shutdown(wait=True)
+        self._shadow.shutdown(wait=True)
+        with self._lock:
+            services = [self.active, self.candidate, *self._retired.values()]
+            self._retired.clear()
+        for service in services:
+            close = getattr(service, "close", None)
+            if close is not None:
+                close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,140 @@
+# model_store.py
+
+import argparse
+import json
+import os
+import resource
+import time
+
+import torch
+from transformers import ViTConfig, ViTImageProcessor, ViTForImageClassification
+
+from app.instrumentation import configure_logging
+
+# Warm-start artifact: a plain torch state dict that can be memory-mapped, so worker processes
+# loading the same file share one copy of the weight pages through the OS page cache.
+WEIGHTS_FILE = "weights.pt"
+SNAPSHOT_INFO_FILE = "snapshot.json"
+
+
+def current_rss_mb():
+    """
+    Returns the resident set size of this process in MB (falls back to peak RSS off Linux).
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def process_pss_mb(pid="self"):
+    """
+    Returns the proportional set size of a process in MB: shared pages are divided between
+    the processes mapping them, so summing PSS over workers gives their real combined footprint.
+    """
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return current_rss_mb() if pid == "self" else 0.0
+
+
+def peak_rss_mb():
+    """
+    Returns the peak resident set size of this process in MB.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def is_snapshot(path):
+    """
+    True if path is a directory written by snapshot_model().
+    """
+    return bool(path) and os.path.isfile(os.path.join(path, SNAPSHOT_INFO_FILE))
+
+
+def snapshot_model(model_name, out_dir, revision=None):
+    """
+    Resolves a model once through the Hugging Face hub and pins it to a local directory:
+    config, preprocessor config, safetensors weights and the memory-mappable warm-start artifact.
+    """
+    model = ViTForImageClassification.from_pretrained(model_name, revision=revision)
+    processor = ViTImageProcessor.from_pretrained(model_name, revision=revision)
+    return write_snapshot(model, processor, out_dir, model_name, revision or "main")
+
+
+def write_snapshot(model, processor, out_dir, model_name, revision, **extra_info):
+    """
+    Writes an in-memory model and processor as a snapshot directory (see snapshot_model()).
+    extra_info is recorded in snapshot.json alongside the name and revision.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    model.save_pretrained(out_dir)
+    processor.save_pretrained(out_dir)
+    torch.save(model.state_dict(), os.path.join(out_dir, WEIGHTS_FILE))
+    info = {
+        "model_name": model_name,
+        "revision": revision,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "weights_file": WEIGHTS_FILE,
+        **extra_info,
+    }
+    with open(os.path.join(out_dir, SNAPSHOT_INFO_FILE), "w") as f:
+        json.dump(info, f, indent=2)
+    return info
+
+
+def load_snapshot_info(snapshot_dir):
+    with open(os.path.join(snapshot_dir, SNAPSHOT_INFO_FILE)) as f:
+        return json.load(f)
+
+
+def load_model(snapshot_dir, mmap=True):
+    """
+    Loads a ViTForImageClassification from a local snapshot without any hub lookups.
+    With mmap=True the parameters are views onto the memory-mapped warm-start artifact
+    instead of freshly allocated fp32 copies.
+    """
+    weights_path = os.path.join(snapshot_dir, WEIGHTS_FILE)
+    if mmap and os.path.isfile(weights_path):
+        config = ViTConfig.from_pretrained(snapshot_dir, local_files_only=True)
+        # Build the module graph without allocating weights, then adopt the mapped tensors
+        with torch.device("meta"):
+            model = ViTForImageClassification(config)
+        state_dict = torch.load(weights_path, mmap=True, weights_only=True, map_location="cpu")
+        model.load_state_dict(state_dict, assign=True)
+        return model.eval()
+    return ViTForImageClassification.from_pretrained(snapshot_dir, local_files_only=True).eval()
+
+
+def load_processor(snapshot_dir):
+    return ViTImageProcessor.from_pretrained(snapshot_dir, local_files_only=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pin a model to a local snapshot for fast, offline startup.")
+    parser.add_argument("--model", default="Akshay0706/Plant-Village-1-Epochs-Model")
+    parser.add_argument("--revision", default=None)
+    parser.add_argument("--out", default="models/plant-village-vit")
+    parser.add_argument("--check", action="store_true", help="Load the snapshot afterwards and report cold start")
+    args = parser.parse_args()
+    configure_logging()
+
+    info = snapshot_model(args.model, args.out, revision=args.revision)
+    print(f"[INFO] Snapshot of {info['model_name']}@{info['revision']} written to {args.out}")
+    if args.check:
+        from app.plant_health_service import PlantHealthService
+
+        service = PlantHealthService(snapshot_dir=args.out, warmup=True)
+        print(f"[INFO] Startup stats: {service.startup_stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+# packed_dataset.py
+
+import argparse
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from app.bulk_classify import iter_batches
+from app.benchmark import load_labelled_images
+from app.instrumentation import configure_logging
+from app.preprocessing import TensorPreprocessor, decode_image
+
+logger = logging.getLogger(__name__)
+
+CLASSES_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "plant_village_vit_classes.json")
+FORMAT_VERSION = 1
+
+
+def load_class_names(data_dir, classes_path=CLASSES_PATH):
+    """
+    Class names in label-id order from plant_village_vit_classes.json ({"<id>": "<name>"}), so
+    packed labels are the model's own ids. Falls back to the sorted class folder names when the
+    file is missing or does not name every folder.
+    """
+    folders = sorted(entry.name for entry in os.scandir(data_dir) if entry.is_dir())
+    try:
+        with open(classes_path) as f:
+            mapping = json.load(f)
+        names = [str(mapping[key]) for key in sorted(mapping, key=int)]
+    except (OSError, ValueError, KeyError):
+        names = []
+    if set(folders) <= set(names):
+        return names
+    logger.warning("%s does not name the folders of %s, using the folder names as classes", classes_path, data_dir)
+    return folders
+
+
+class PackedDataset:
+    """
+    A PlantVillage-style dataset decoded once into a directory of flat files:
+        images.u8   N x H x W x 3 uint8 pixels at model resolution, row after row
+        labels.i16  N int16 class ids
+        paths.txt   N original paths, one per line
+        meta.json   shape, class names and the committed row count
+
+    The files are opened as read-only memory maps, so a batch is a view into the page cache:
+    no file opens, no JPEG decode, no copy. Appends write rows past the end of the arrays and
+    commit them by rewriting meta.json last; readers only ever see committed rows.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        with open(os.path.join(root, "meta.json")) as f:
+            self.meta = json.load(f)
+        if self.meta.get("version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported packed dataset version {self.meta.get('version')!r} in {root}")
+        self.height, self.width = self.meta["height"], self.meta["width"]
+        self.classes = self.meta["classes"]
+        count = self.meta["count"]
+        if count:
+            self.images = np.memmap(os.path.join(root, "images.u8"), dtype=np.uint8, mode="r",
+                                    shape=(count, self.height, self.width, 3))
+            self.labels = np.memmap(os.path.join(root, "labels.i16"), dtype=np.int16, mode="r", shape=(count,))
+        else:
+            self.images = np.empty((0, self.height, self.width, 3), dtype=np.uint8)
+            self.labels = np.empty((0,), dtype=np.int16)
+        self._paths = None
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, index):
+        return self.images[index], int(self.labels[index])
+
+    @property
+    def paths(self):
+        if self._paths is None:
+            with open(os.path.join(self.root, "paths.txt"), encoding="utf-8") as f:
+                self._paths = f.read().splitlines()[:len(self)]
+        return self._paths
+
+    def batches(self, batch_size=32, shuffle=False, seed=0, drop_last=False):
+        """
+        Yields (images, labels) slices of the memory maps. With shuffle=True the order of the
+        batches is shuffled, not the rows within one, so every batch stays a zero-copy view;
+        use indices() for a per-row permutation.
+        """
+        starts = list(range(0, len(self), batch_size))
+        if drop_last and starts and len(self) - starts[-1] < batch_size:
+            starts.pop()
+        if shuffle:
+            np.random.default_rng(seed).shuffle(starts)
+        for start in starts:
+            yield self.images[start:start + batch_size], self.labels[start:start + batch_size]
+
+    def indices(self, seed=0):
+        """
+        A per-row random permutation, for loaders that gather rows themselves.
+        """
+        return np.random.default_rng(seed).permutation(len(self))
+
+
+def _append_rows(root, arrays, labels, paths):
+    with open(os.path.join(root, "images.u8"), "ab") as f:
+        for array in arrays:
+            f.write(np.ascontiguousarray(array, dtype=np.uint8).tobytes())
+    with open(os.path.join(root, "labels.i16"), "ab") as f:
+        f.write(np.asarray(labels, dtype=np.int16).tobytes())
+    with open(os.path.join(root, "paths.txt"), "a", encoding="utf-8") as f:
+        f.write("".join(path + "\n" for path in paths))
+
+
+def _truncate_to(root, meta):
+    """
+    Drops rows written after the last committed meta.json, e.g. by an interrupted pack.
+    """
+    count, row_bytes = meta["count"], meta["height"] * meta["width"] * 3
+    for name, size in (("images.u8", count * row_bytes), ("labels.i16", count * 2)):
+        with open(os.path.join(root, name), "ab") as f:
+            f.truncate(size)
+    with open(os.path.join(root, "paths.txt"), encoding="utf-8") as f:
+        paths = f.read().splitlines()[:count]
+    with open(os.path.join(root, "paths.txt"), "w", encoding="utf-8") as f:
+        f.write("".join(path + "\n" for path in paths))
+    return paths
+
+
+def _write_meta(root, meta):
+    tmp = os.path.join(root, "meta.json.tmp")
+    with open(tmp, "w") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp, os.path.join(root, "meta.json"))
+
+
+def pack(data_dir, output, size=None, classes_path=CLASSES_PATH, batch_size=256, decode_threads=4):
+    """
+    Decodes every image under data_dir's class folders into a PackedDataset at output.
+    If output already exists, only images whose path is not packed yet are appended, so
+    re-running after new images arrive is incremental. Undecodable images are skipped.
+    Returns the number of rows added.
+    """
+    os.makedirs(output, exist_ok=True)
+    if os.path.isfile(os.path.join(output, "meta.json")):
+        with open(os.path.join(output, "meta.json")) as f:
+            meta = json.load(f)
+        existing = set(_truncate_to(output, meta))
+    else:
+        if size is None:
+            default = TensorPreprocessor.from_metadata()
+            size = (default.height, default.width)
+        height, width = size
+        meta = {"version": FORMAT_VERSION, "height": height, "width": width,
+                "classes": load_class_names(data_dir, classes_path), "count": 0}
+        for name in ("images.u8", "labels.i16", "paths.txt"):
+            open(os.path.join(output, name), "wb").close()
+        existing = set()
+    preprocessor = TensorPreprocessor(size=(meta["height"], meta["width"]))
+    class_ids = {name: i for i, name in enumerate(meta["classes"])}
+    samples = [(path, label) for path, label in load_labelled_images(data_dir) if path not in existing]
+    unknown = {label for _, label in samples} - set(class_ids)
+    if unknown:
+        raise ValueError(f"Folders {sorted(unknown)} are not classes of the packed dataset {output}")
+
+    def load(sample):
+        try:
+            return preprocessor.to_uint8(decode_image(sample[0], target_size=(meta["height"], meta["width"])))
+        except Exception as e:
+            logger.warning("Skipping %s: %s", sample[0], e)
+            return None
+
+    added = 0
+    with ThreadPoolExecutor(max_workers=decode_threads) as executor:
+        for chunk in iter_batches(samples, batch_size):
+            rows = [(array, sample) for array, sample in zip(executor.map(load, chunk), chunk) if array is not None]
+            _append_rows(output, [array for array, _ in rows], [class_ids[label] for _, (_, label) in rows],
+                         [path for _, (path, _) in rows])
+            added += len(rows)
+            meta["count"] += len(rows)
+            _write_meta(output, meta)
+            logger.info("Packed %d/%d new images", added, len(samples))
+    return added
+
+
+def read_throughput(dataset, batch_size=64, epochs=3):
+    """
+    Images/sec of a full pass over the packed data, touching every pixel (the sum forces reads).
+    """
+    start = time.perf_counter()
+    for _ in range(epochs):
+        for images, _ in dataset.batches(batch_size):
+            images.sum(dtype=np.uint64)
+    return len(dataset) * epochs / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack a class-per-folder image tree into a memory-mapped dataset.")
+    parser.add_argument("command", choices=["pack", "bench"])
+    parser.add_argument("--data-dir", default="data/PlantVillage")
+    parser.add_argument("--output", default="data/PlantVillage.packed")
+    parser.add_argument("--size", type=int, nargs=2, default=None, metavar=("HEIGHT", "WIDTH"),
+                        help="Model resolution (default: from plant_village_vit_metadata.json)")
+    parser.add_argument("--decode-threads", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=64)
+    args = parser.parse_args()
+    configure_logging()
+
+    if args.command == "pack":
+        start = time.perf_counter()
+        added = pack(args.data_dir, args.output, size=args.size, decode_threads=args.decode_threads)
+        dataset = PackedDataset(args.output)
+        print(f"[INFO] Added {added} images in {time.perf_counter() - start:.1f}s; {args.output} holds "
+              f"{len(dataset)} images of {dataset.height}x{dataset.width} in {len(dataset.classes)} classes")
+    else:
+        dataset = PackedDataset(args.output)
+        packed = read_throughput(dataset, args.batch_size)
+        paths = dataset.paths[:args.batch_size * 4]
+        start = time.perf_counter()
+        for path in paths:
+            decode_image(path, target_size=(dataset.height, dataset.width))
+        decoded = len(paths) / (time.perf_counter() - start)
+        print(f"[RESULT] packed read {packed:.0f} images/sec, JPEG decode {decoded:.0f} images/sec "
+              f"({packed / decoded:.0f}x)")
+
+
+if __name__ == "__main__":
+    main()
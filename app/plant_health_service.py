@@ -1,66 +1,416 @@
 # plant_health_service.py
 
+import logging
+import os
+import threading
+import time
+
 from transformers import ViTImageProcessor, ViTForImageClassification
-from PIL import Image
 import torch
+from PIL import Image
+
+from app.config import MODEL_SNAPSHOT_DIR, INFERENCE_PRECISION, PRECISION_MIN_AGREEMENT, INFERENCE_BACKEND, PROFILE_EVERY_N
+from app.config import TTA_CONFIDENCE_THRESHOLD, TTA_VIEWS, EMBEDDING_DUPLICATE_THRESHOLD, EMBEDDING_SIMILAR_CASES
+from app.inference_backends import BACKENDS, create_backend
+from app.instrumentation import (
+    BATCH_SIZE,
+    BATCHES_TOTAL,
+    CACHE_TOTAL,
+    ERRORS_TOTAL,
+    IMAGES_TOTAL,
+    TTA_TOTAL,
+    SamplingProfiler,
+    stage_timer,
+)
+from app.model_store import current_rss_mb, load_model, load_processor, load_snapshot_info
+from app.prediction_cache import image_cache_key
+from app.preprocessing import TTA_TRANSFORMS, TensorPreprocessor, decode_image, tta_views
+from app.tiling import predict_tiled
+from app.precision import PRECISIONS, convert_model, holdout_slice, input_dtype_for, top1_agreement
+
+logger = logging.getLogger(__name__)
+
+# Disease-to-care-recommendation mapping
+# This dictionary maps disease class labels to care recommendations.
+# Extend this mapping as needed for your use case. It is shared by every loaded model version.
+CARE_RECOMMENDATIONS = {
+    "Tomato_healthy": "No disease detected. Maintain regular care.",
+    "Tomato__Tomato_mosaic_virus": "Remove infected plants. Disinfect tools. Use resistant varieties.",
+    "Tomato__Tomato_YellowLeaf__Curl_Virus": "Control whiteflies. Remove infected plants. Use resistant varieties.",
+    "Tomato__Target_Spot": "Remove infected leaves. Apply fungicides. Rotate crops.",
+    "Tomato_Spider_mites_Two_spotted_spider_mite": "Spray with water to remove mites. Use miticides if needed.",
+    "Tomato_Septoria_leaf_spot": "Remove infected leaves. Avoid overhead watering. Apply fungicides.",
+    "Tomato_Leaf_Mold": "Increase air circulation. Remove affected leaves. Apply fungicides.",
+    "Tomato_Late_blight": "Remove and destroy infected plants. Use resistant varieties. Apply fungicides.",
+    "Tomato_Early_blight": "Remove affected leaves. Avoid overhead watering. Rotate crops.",
+    "Tomato_Bacterial_spot": "Remove infected plants. Use copper-based sprays. Rotate crops.",
+    "Potato___healthy": "No disease detected. Maintain regular care.",
+    "Potato___Late_blight": "Remove and destroy infected plants. Use certified seed. Apply fungicides.",
+    "Potato___Early_blight": "Remove infected leaves. Rotate crops. Apply fungicides as needed.",
+    "Pepper__bell___healthy": "No disease detected. Maintain regular care.",
+    "Pepper__bell___Bacterial_spot": "Use copper-based fungicides. Remove infected plants. Rotate crops.",
+}
+DEFAULT_DISEASE_MESSAGE = "No specific care recommendation available. Consult an expert or extension service."
+HEALTHY_MESSAGE = "Plant appears healthy. Continue regular care and monitoring."
+
 
 class PlantHealthService:
-    def __init__(self, model_name="Akshay0706/Plant-Village-1-Epochs-Model", device=None):
+    def __init__(self, model_name="Akshay0706/Plant-Village-1-Epochs-Model", device=None, revision=None, cache=None,
+                 recorder=None,
+                 snapshot_dir=MODEL_SNAPSHOT_DIR, mmap_weights=True, lazy=False, warmup=False,
+                 precision=INFERENCE_PRECISION, min_agreement=PRECISION_MIN_AGREEMENT,
+                 calibration_dir="data/PlantVillage", calibration_per_class=4,
+                 backend=INFERENCE_BACKEND, backend_path=None, intra_op_threads=0, inter_op_threads=0,
+                 profile_every_n=PROFILE_EVERY_N, tta_views=TTA_VIEWS, tta_threshold=TTA_CONFIDENCE_THRESHOLD,
+                 case_index=None, num_similar_cases=EMBEDDING_SIMILAR_CASES,
+                 duplicate_threshold=EMBEDDING_DUPLICATE_THRESHOLD):
         """
         Initializes the model and processor.
         Loads to GPU if available and requested.
+        Pass a PredictionCache as `cache` to reuse results for byte-identical images.
+        Pass a database.persistence.PredictionWriter as `recorder` to persist every analysis
+        made through predict_from_path() in the background.
+
+        Startup options:
+        - snapshot_dir: load from a local snapshot (see app/model_store.py) with no hub lookups.
+        - mmap_weights: memory-map the snapshot's warm-start weights so worker processes share pages.
+        - lazy: defer loading the model until the first prediction.
+        - warmup: run one dummy forward pass right after loading.
+
+        Precision options:
+        - precision: "fp32" (default), "int8" (dynamic quantization of Linear layers) or "bf16".
+        - min_agreement: required top-1 agreement with fp32 on a held-out slice of calibration_dir;
+          below it the service refuses the reduced precision and stays on fp32.
+
+        Backend options (see app/inference_backends.py):
+        - backend: "eager" (default), "compile" (torch.compile), "torchscript" or "onnx" (ONNX Runtime).
+          The exported backends read backend_path, defaulting to the artifact next to
+          plant_village_vit_metadata.json, and run in fp32.
+        - intra_op_threads / inter_op_threads: ONNX Runtime thread pools (0 = ORT default).
+
+        Instrumentation (see app/instrumentation.py):
+        - per-stage timings (decode, preprocess, forward, postprocess, persist) and counters are
+          recorded in the process-wide metrics registry.
+        - profile_every_n: run the torch profiler around 1 in N forward passes (0 = off).
+
+        Test-time augmentation (off with tta_views=0):
+        - images whose single-view confidence is below tta_threshold are re-scored on tta_views
+          deterministic augmentations (see preprocessing.tta_views), all uncertain images of a
+          batch in one extra forward pass, and get the mean probability of all their views.
+          Confident images exit early at no extra cost. Results then carry "tta_views".
+
+        Past cases (see app/embeddings.py):
+        - case_index: an app.embeddings.VectorIndex over the embeddings of earlier analyses
+          (recorded by a PredictionWriter with embeddings). predict_bytes() then adds the
+          num_similar_cases closest past analyses to the result, and an image within
+          duplicate_threshold cosine similarity of a past one gets that analysis' label and
+          confidence back, marked "near_duplicate_of", so re-uploads get consistent answers.
         """
-        print("[INFO] Initializing PlantHealthService...")
+        if not 0 <= tta_views <= len(TTA_TRANSFORMS):
+            raise ValueError(f"tta_views must be between 0 and {len(TTA_TRANSFORMS)}, got {tta_views}")
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision '{precision}', expected one of {PRECISIONS}")
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend '{backend}', expected one of {BACKENDS}")
+        logger.info("Initializing PlantHealthService...")
+        self.model_name = model_name
+        self.revision = revision
+        self.cache = cache
+        self.recorder = recorder
+        self.tta_views = tta_views
+        self.tta_threshold = tta_threshold
+        self.case_index = case_index
+        self.num_similar_cases = num_similar_cases
+        self.duplicate_threshold = duplicate_threshold
+        self.snapshot_dir = snapshot_dir
+        self.mmap_weights = mmap_weights
+        self.warmup = warmup
+        self.requested_precision = precision
+        self.precision = "fp32"
+        self.precision_report = None
+        self.min_agreement = min_agreement
+        self.calibration_dir = calibration_dir
+        self.calibration_per_class = calibration_per_class
+        self.backend = backend
+        self.backend_path = backend_path
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self._runner = None
+        self.profiler = SamplingProfiler(every_n=profile_every_n)
         self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
-        self.model = ViTForImageClassification.from_pretrained(model_name).to(self.device)
-        self.processor = ViTImageProcessor.from_pretrained(model_name)
-        print(f"[INFO] Model loaded to device: {self.device}")
-
-        # Disease-to-care-recommendation mapping
-        # This dictionary maps disease class labels to care recommendations.
-        # Extend this mapping as needed for your use case.
-        self.care_recommendations = {
-            "Tomato_healthy": "No disease detected. Maintain regular care.",
-            "Tomato__Tomato_mosaic_virus": "Remove infected plants. Disinfect tools. Use resistant varieties.",
-            "Tomato__Tomato_YellowLeaf__Curl_Virus": "Control whiteflies. Remove infected plants. Use resistant varieties.",
-            "Tomato__Target_Spot": "Remove infected leaves. Apply fungicides. Rotate crops.",
-            "Tomato_Spider_mites_Two_spotted_spider_mite": "Spray with water to remove mites. Use miticides if needed.",
-            "Tomato_Septoria_leaf_spot": "Remove infected leaves. Avoid overhead watering. Apply fungicides.",
-            "Tomato_Leaf_Mold": "Increase air circulation. Remove affected leaves. Apply fungicides.",
-            "Tomato_Late_blight": "Remove and destroy infected plants. Use resistant varieties. Apply fungicides.",
-            "Tomato_Early_blight": "Remove affected leaves. Avoid overhead watering. Rotate crops.",
-            "Tomato_Bacterial_spot": "Remove infected plants. Use copper-based sprays. Rotate crops.",
-            "Potato___healthy": "No disease detected. Maintain regular care.",
-            "Potato___Late_blight": "Remove and destroy infected plants. Use certified seed. Apply fungicides.",
-            "Potato___Early_blight": "Remove infected leaves. Rotate crops. Apply fungicides as needed.",
-            "Pepper__bell___healthy": "No disease detected. Maintain regular care.",
-            "Pepper__bell___Bacterial_spot": "Use copper-based fungicides. Remove infected plants. Rotate crops.",
-        }
+        if snapshot_dir:
+            # The cache key must follow the pinned checkpoint, not the constructor default
+            info = load_snapshot_info(snapshot_dir)
+            self.model_name, self.revision = info["model_name"], info["revision"]
+        self._model = None
+        self._processor = None
+        self._preprocessor = None
+        self._load_lock = threading.Lock()
+        self.startup_stats = {"rss_mb_before_load": current_rss_mb()}
+        if not lazy:
+            self._load()
+
+        # Per instance, so extending one service's recommendations leaves the others alone
+        self.care_recommendations = dict(CARE_RECOMMENDATIONS)
         # Define what is considered a 'healthy' class (can be a set for fast lookup)
         self.healthy_labels = {label for label in self.care_recommendations if 'healthy' in label.lower()}
-        self.default_disease_message = "No specific care recommendation available. Consult an expert or extension service."
-        self.healthy_message = "Plant appears healthy. Continue regular care and monitoring."
+        self.default_disease_message = DEFAULT_DISEASE_MESSAGE
+        self.healthy_message = HEALTHY_MESSAGE
+
+    @property
+    def model(self):
+        if self._model is None:
+            self._load()
+        return self._model
+
+    @property
+    def model_version(self):
+        """
+        The served checkpoint, "<model name>@<revision>" (just the name when unpinned).
+        """
+        return f"{self.model_name}@{self.revision}" if self.revision else self.model_name
+
+    @property
+    def runner(self):
+        if self._runner is None:
+            self._load()
+        return self._runner
+
+    @property
+    def processor(self):
+        if self._processor is None:
+            self._load()
+        return self._processor
+
+    @property
+    def preprocessor(self):
+        if self._preprocessor is None:
+            self._load()
+        return self._preprocessor
+
+    def _load(self):
+        """
+        Loads model and processor once (thread-safe), optionally warms up,
+        and records cold-start time and RSS in self.startup_stats.
+        """
+        with self._load_lock:
+            if self._model is not None:
+                return
+            start = time.perf_counter()
+            if self.snapshot_dir:
+                model = load_model(self.snapshot_dir, mmap=self.mmap_weights)
+                processor = load_processor(self.snapshot_dir)
+            else:
+                model = ViTForImageClassification.from_pretrained(self.model_name, revision=self.revision)
+                processor = ViTImageProcessor.from_pretrained(self.model_name, revision=self.revision)
+            model = model.to(self.device).eval()
+            self.startup_stats["load_seconds"] = time.perf_counter() - start
+            if self.requested_precision != "fp32":
+                if self.backend in ("eager", "compile"):
+                    model = self._apply_precision(model, processor)
+                else:
+                    logger.warning("The %s backend runs its exported fp32 graph, ignoring precision=%s",
+                                   self.backend, self.requested_precision)
+            runner = create_backend(self.backend, model, path=self.backend_path, device=self.device,
+                                    intra_op_threads=self.intra_op_threads,
+                                    inter_op_threads=self.inter_op_threads)
+            if self.warmup:
+                start = time.perf_counter()
+                size = processor.size
+                dummy = torch.zeros(1, 3, size["height"], size["width"], device=self.device,
+                                    dtype=input_dtype_for(self.precision))
+                with torch.no_grad():
+                    runner(dummy)
+                self.startup_stats["warmup_seconds"] = time.perf_counter() - start
+            self.startup_stats["rss_mb"] = current_rss_mb()
+            self._processor = processor
+            self._preprocessor = TensorPreprocessor.from_processor(processor)
+            self._runner = runner
+            self._model = model
+            logger.info("Model loaded to device: %s (%.2fs, RSS %.0f MB)", self.device,
+                        self.startup_stats["load_seconds"], self.startup_stats["rss_mb"])
+
+    def _apply_precision(self, model, processor):
+        """
+        Converts the fp32 model to the requested precision, but only keeps it if its top-1
+        agreement with fp32 on the held-out calibration slice reaches min_agreement.
+        """
+        try:
+            candidate = convert_model(model, self.requested_precision)
+            paths = holdout_slice(self.calibration_dir, per_class=self.calibration_per_class)
+            agreement = top1_agreement(model, candidate, processor, paths, self.requested_precision,
+                                       device=self.device)
+        except Exception as e:
+            logger.warning("Could not enable %s inference, staying on fp32: %s", self.requested_precision, e)
+            self.precision_report = {"precision": self.requested_precision, "enabled": False, "error": str(e)}
+            return model
+        enabled = agreement >= self.min_agreement
+        self.precision_report = {
+            "precision": self.requested_precision,
+            "enabled": enabled,
+            "top1_agreement": agreement,
+            "min_agreement": self.min_agreement,
+            "calibration_images": len(paths),
+        }
+        if not enabled:
+            logger.warning("%s top-1 agreement %.3f is below %.3f, staying on fp32",
+                           self.requested_precision, agreement, self.min_agreement)
+            return model
+        logger.info("%s inference enabled (top-1 agreement %.3f)", self.requested_precision, agreement)
+        self.precision = self.requested_precision
+        return candidate
 
     def predict(self, image):
         """
         Accepts a PIL image, preprocesses, runs inference, and returns structured results
         including disease class, confidence, and care recommendation.
         """
-        # Preprocess
-        print("[DEBUG] Preprocessing image...")
-        inputs = self.processor(images=image, return_tensors="pt")
-        pixel_values = inputs["pixel_values"].to(self.device)
+        result = self.predict_batch([image])[0]
+        logger.debug("Prediction result: %s", result)
+        return result
+
+    def predict_proba(self, images, return_embeddings=False):
+        """
+        Runs a single forward pass over a non-empty list of PIL images (or HxWx3 uint8 arrays)
+        and returns their class probabilities as a float32 [N, num_labels] CPU tensor.
+        With return_embeddings=True returns (probs, embeddings): the L2-normalized [CLS]
+        embeddings the classifier head reads, as a float32 [N, hidden_size] NumPy array.
+        On the eager backend they come from the same pass; exported backends only return
+        logits, so the eager model runs a second time for them.
+        """
+        images = list(images)
+        # Preprocess the whole batch at once -> [N, 3, 224, 224]
+        with stage_timer("preprocess"):
+            pixel_values = self.preprocessor(images).to(self.device, dtype=input_dtype_for(self.precision))
         # Inference
-        print("[DEBUG] Running model inference...")
-        with torch.no_grad():
-            outputs = self.model(pixel_values)
-            logits = outputs.logits
-            probs = torch.softmax(logits, dim=-1)
-            confidence, predicted_class_idx = torch.max(probs, dim=-1)
-            predicted_class_idx = predicted_class_idx.item()
-            confidence = confidence.item()
-            label = self.model.config.id2label.get(predicted_class_idx, str(predicted_class_idx))
-        print(f"[DEBUG] Predicted class: {label} (index {predicted_class_idx}), confidence: {confidence:.4f}")
+        with stage_timer("forward"), self.profiler.profile(), torch.no_grad():
+            embeddings = None
+            if return_embeddings:
+                hidden = self.model.vit(pixel_values).last_hidden_state[:, 0]
+                logits = self.model.classifier(hidden) if self.backend == "eager" else self.runner(pixel_values)
+                embeddings = torch.nn.functional.normalize(hidden.float(), dim=-1).cpu().numpy()
+            else:
+                logits = self.runner(pixel_values)
+            # One device->host copy for the whole batch
+            probs = torch.softmax(logits, dim=-1).float().cpu()
+        BATCHES_TOTAL.inc()
+        IMAGES_TOTAL.inc(len(images))
+        BATCH_SIZE.observe(len(images))
+        return (probs, embeddings) if return_embeddings else probs
+
+    def predict_batch(self, images, with_embeddings=False):
+        """
+        Runs a single forward pass over a list of PIL images.
+        Returns one result dict per image, in the same order and format as predict().
+        with_embeddings=True adds each image's embedding (see predict_proba) as "embedding".
+        """
+        images = list(images)
+        if not images:
+            return []
+        embeddings = None
+        if with_embeddings:
+            probs, embeddings = self.predict_proba(images, return_embeddings=True)
+        else:
+            probs = self.predict_proba(images)
+        views = None
+        if self.tta_views:
+            probs, views = self._test_time_augment(images, probs)
+        confidences, predicted_class_idxs = torch.max(probs, dim=-1)
+        confidences = confidences.tolist()
+        predicted_class_idxs = predicted_class_idxs.tolist()
+        with stage_timer("postprocess"):
+            results = [
+                self._build_result(idx, confidence)
+                for idx, confidence in zip(predicted_class_idxs, confidences)
+            ]
+        if views is not None:
+            for result, count in zip(results, views):
+                result["tta_views"] = count
+        if embeddings is not None:
+            for result, embedding in zip(results, embeddings):
+                result["embedding"] = embedding
+        return results
+
+    def embed(self, images):
+        """
+        L2-normalized embeddings of a list of PIL images, float32 [N, hidden_size].
+        """
+        return self.predict_proba(images, return_embeddings=True)[1]
+
+    def similar_cases(self, image, k=None):
+        """
+        The k past analyses (default: num_similar_cases) most similar to a PIL image, from case_index.
+        """
+        if self.case_index is None:
+            raise RuntimeError("No case_index configured")
+        return self._describe_cases(self.case_index.search(self.embed([image])[0], k=k or self.num_similar_cases)[0])
+
+    def _describe_cases(self, matches):
+        return [
+            {
+                "image_id": match["image_id"],
+                "prediction_id": match["prediction_id"],
+                "predicted_label": self.model.config.id2label.get(match["predicted_class_index"],
+                                                                  str(match["predicted_class_index"])),
+                "confidence": match["confidence"],
+                "similarity": match["similarity"],
+            }
+            for match in matches
+        ]
+
+    def _attach_cases(self, result):
+        """
+        Adds similar past cases to a result carrying an embedding; a near-duplicate of a past
+        analysis takes over its label and confidence.
+        """
+        with stage_timer("similar_cases"):
+            matches = self.case_index.search(result["embedding"], k=max(1, self.num_similar_cases))[0]
+        if matches and matches[0]["similarity"] >= self.duplicate_threshold:
+            best = matches[0]
+            result.update(self._build_result(best["predicted_class_index"], best["confidence"]))
+            result["near_duplicate_of"] = {key: best[key] for key in ("image_id", "prediction_id", "similarity")}
+        if self.num_similar_cases:
+            result["similar_cases"] = self._describe_cases(matches[:self.num_similar_cases])
+        return result
+
+    def _test_time_augment(self, images, probs):
+        """
+        Averages the probabilities of the uncertain images over their TTA views.
+        Returns (probs, views per image).
+        """
+        uncertain = (probs.max(dim=-1).values < self.tta_threshold).nonzero().flatten().tolist()
+        TTA_TOTAL.inc(len(images) - len(uncertain), result="early_exit")
+        views = [0] * len(images)
+        if not uncertain:
+            return probs, views
+        TTA_TOTAL.inc(len(uncertain), result="augmented")
+        with stage_timer("augment"):
+            batch = [
+                view
+                for i in uncertain
+                for view in tta_views(images[i] if isinstance(images[i], Image.Image) else Image.fromarray(images[i]),
+                                      self.tta_views)
+            ]
+        view_probs = self.predict_proba(batch).view(len(uncertain), self.tta_views, -1)
+        probs[uncertain] = (probs[uncertain] + view_probs.sum(dim=1)) / (self.tta_views + 1)
+        for i in uncertain:
+            views[i] = self.tta_views
+        return probs, views
+
+    def predict_tiled(self, image, **options):
+        """
+        Tiled analysis of a large field or canopy photo (PIL image, path or bytes): per-tile
+        labels, an aggregated verdict and a disease heatmap. See app.tiling.predict_tiled for
+        the options.
+        """
+        return predict_tiled(self, image, **options)
+
+    def _build_result(self, predicted_class_idx, confidence):
+        """
+        Maps a class index and confidence to the structured result dict,
+        including the care recommendation.
+        """
+        label = self.model.config.id2label.get(predicted_class_idx, str(predicted_class_idx))
 
         # Determine care recommendation
         if label in self.healthy_labels:
@@ -69,28 +419,74 @@ class PlantHealthService:
             care = self.care_recommendations[label]
         else:
             care = self.default_disease_message
-        print(f"[DEBUG] Care recommendation: {care}")
 
         # Structure result
-        result = {
+        return {
             "predicted_class_index": predicted_class_idx,
             "predicted_label": label,
             "confidence": confidence,
-            "care_recommendation": care
+            "care_recommendation": care,
+            "model_version": self.model_version,
         }
-        print(f"[INFO] Prediction result: {result}")
-        return result
 
-    def predict_from_path(self, image_path):
+    def predict_from_path(self, image_path, user_id=None):
         """
         Loads an image from a file path and runs prediction.
+        With a recorder configured the analysis is queued for persistence; the database
+        commit happens on the recorder's thread, not here.
         """
         try:
-            image = Image.open(image_path).convert("RGB")
+            with open(image_path, "rb") as f:
+                image_bytes = f.read()
         except Exception as e:
-            print(f"[ERROR] Could not load image: {e}")
+            ERRORS_TOTAL.inc(stage="read")
+            logger.error("Could not load image %s: %s", image_path, e)
             return None
-        return self.predict(image)
+        # A recorder with an embedding store also records each analysis' embedding
+        record_embedding = self.recorder is not None and self.recorder.embeddings is not None
+        result = self.predict_bytes(image_bytes, return_embedding=record_embedding)
+        if result is not None and self.recorder is not None:
+            with stage_timer("persist"):
+                self.recorder.submit(os.path.basename(image_path), image_path, result, user_id=user_id,
+                                     embedding=result.pop("embedding", None))
+        return result
+
+    def predict_bytes(self, image_bytes, return_embedding=False):
+        """
+        Runs prediction on encoded image bytes (JPEG, PNG, ...).
+        When a cache is configured, byte-identical images skip decoding and inference entirely
+        (and cached results keep the similar cases found when they were first analysed).
+        return_embedding=True keeps the image's embedding in the result as "embedding"; such
+        calls always run the model.
+        """
+        key = None
+        if self.cache is not None and not return_embedding:
+            # Precision, backend and TTA all change the scores, so each combination is cached separately
+            variant = f"{self.requested_precision},{self.backend}" + (f",tta{self.tta_views}" if self.tta_views else "")
+            key = image_cache_key(image_bytes, self.model_name, self.revision, variant)
+            cached = self.cache.get(key)
+            CACHE_TOTAL.inc(result="hit" if cached is not None else "miss")
+            if cached is not None:
+                return cached
+        try:
+            with stage_timer("decode"):
+                image = decode_image(image_bytes, target_size=(self.preprocessor.height, self.preprocessor.width))
+        except Exception as e:
+            ERRORS_TOTAL.inc(stage="decode")
+            logger.warning("Could not decode image: %s", e)
+            return None
+        if return_embedding or self.case_index is not None:
+            result = self.predict_batch([image], with_embeddings=True)[0]
+            if self.case_index is not None:
+                self._attach_cases(result)
+            if not return_embedding:
+                result.pop("embedding")
+        else:
+            result = self.predict(image)
+        if key is not None:
+            with stage_timer("persist"):
+                self.cache.put(key, result)
+        return result
 
 # Usage example
 if __name__ == '__main__':
@@ -100,4 +496,5 @@ if __name__ == '__main__':
     result = service.predict_from_path('test/test_leaf.JPG')
     print("\nFinal result:")
     print(result)
-    # To extend care recommendations, add more entries to self.care_recommendations
\ No newline at end of file
+    # To extend care recommendations, add entries to service.care_recommendations
+    # (or to CARE_RECOMMENDATIONS, for every service created afterwards)
\ No newline at end of file
@@ -0,0 +1,76 @@
+# precision.py
+
+import copy
+import os
+import random
+
+import torch
+from PIL import Image
+
+PRECISIONS = ("fp32", "int8", "bf16")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def bf16_supported():
+    """
+    True if this CPU has native bf16 support (AVX512-BF16 / AMX) through oneDNN.
+    Without it bf16 matmuls are emulated and slower than fp32.
+    """
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def convert_model(model, precision):
+    """
+    Returns a copy of an fp32 model converted to the requested precision.
+    - int8: dynamic quantization of every nn.Linear (weights int8, activations quantized per batch).
+    - bf16: all parameters cast to bfloat16; inputs must be cast to match.
+    """
+    if precision == "fp32":
+        return model
+    if precision == "int8":
+        return torch.ao.quantization.quantize_dynamic(copy.deepcopy(model), {torch.nn.Linear}, dtype=torch.qint8)
+    if precision == "bf16":
+        if not bf16_supported():
+            raise RuntimeError("bf16 inference requested but this CPU has no native bf16 support")
+        return copy.deepcopy(model).to(torch.bfloat16)
+    raise ValueError(f"Unknown precision '{precision}', expected one of {PRECISIONS}")
+
+
+def input_dtype_for(precision):
+    return torch.bfloat16 if precision == "bf16" else torch.float32
+
+
+def holdout_slice(data_dir="data/PlantVillage", per_class=4, seed=0):
+    """
+    Deterministic held-out sample of image paths: per_class images from every class folder.
+    """
+    rng = random.Random(seed)
+    paths = []
+    for class_name in sorted(os.listdir(data_dir)):
+        class_dir = os.path.join(data_dir, class_name)
+        if not os.path.isdir(class_dir):
+            continue
+        files = sorted(f for f in os.listdir(class_dir) if f.lower().endswith(IMAGE_EXTENSIONS))
+        paths.extend(os.path.join(class_dir, f) for f in rng.sample(files, min(per_class, len(files))))
+    return paths
+
+
+def top1_agreement(reference_model, candidate_model, processor, image_paths, precision, batch_size=16, device="cpu"):
+    """
+    Fraction of images on which the candidate model's top-1 class matches the fp32 reference.
+    """
+    if not image_paths:
+        raise ValueError("No calibration images found for the precision accuracy check")
+    agree = 0
+    dtype = input_dtype_for(precision)
+    with torch.no_grad():
+        for start in range(0, len(image_paths), batch_size):
+            images = [Image.open(p).convert("RGB") for p in image_paths[start:start + batch_size]]
+            pixel_values = processor(images=images, return_tensors="pt")["pixel_values"].to(device)
+            reference = reference_model(pixel_values).logits.argmax(-1)
+            candidate = candidate_model(pixel_values.to(dtype)).logits.argmax(-1)
+            agree += (reference == candidate).sum().item()
+    return agree / len(image_paths)
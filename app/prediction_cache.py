@@ -0,0 +1,135 @@
+# prediction_cache.py
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from app.config import PREDICTION_CACHE_SIZE, PREDICTION_CACHE_TTL, PREDICTION_CACHE_PATH
+
+
+def image_cache_key(image_bytes, model_name, revision=None, variant=None):
+    """
+    Content-addressed cache key: SHA-256 of the raw image bytes, scoped to the model name and revision
+    so a new checkpoint never serves stale predictions. variant further scopes it to how the model
+    runs (precision, backend, TTA), whose results differ slightly for the same checkpoint.
+    """
+    digest = hashlib.sha256(image_bytes).hexdigest()
+    scope = f"{model_name}@{revision or 'main'}" + (f"/{variant}" if variant else "")
+    return f"{scope}:{digest}"
+
+
+class PredictionCache:
+    def __init__(self, max_entries=PREDICTION_CACHE_SIZE, ttl_seconds=PREDICTION_CACHE_TTL, disk_path=PREDICTION_CACHE_PATH):
+        """
+        Two-tier prediction cache.
+        - Memory tier: LRU bounded by max_entries, entries expire after ttl_seconds (None = never).
+        - Disk tier (optional): SQLite file at disk_path that survives restarts and uses the same TTL.
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.disk_path = disk_path
+        self._entries = OrderedDict()  # key -> (stored_at, result)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._db = None
+        if disk_path:
+            self._db = sqlite3.connect(disk_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS predictions ("
+                "key TEXT PRIMARY KEY, stored_at REAL NOT NULL, result TEXT NOT NULL)"
+            )
+            self._db.commit()
+
+    def _expired(self, stored_at, now):
+        return self.ttl_seconds is not None and now - stored_at > self.ttl_seconds
+
+    def get(self, key):
+        """
+        Returns the cached result dict for key, or None on a miss.
+        Disk hits are promoted into the memory tier.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, result = entry
+                if not self._expired(stored_at, now):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return dict(result)
+                del self._entries[key]
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT stored_at, result FROM predictions WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    stored_at, payload = row
+                    if not self._expired(stored_at, now):
+                        result = json.loads(payload)
+                        self._store_memory(key, stored_at, result)
+                        self.disk_hits += 1
+                        return dict(result)
+                    self._db.execute("DELETE FROM predictions WHERE key = ?", (key,))
+                    self._db.commit()
+            self.misses += 1
+            return None
+
+    def put(self, key, result):
+        """
+        Stores a result dict in the memory tier and, if configured, the disk tier.
+        """
+        now = time.time()
+        with self._lock:
+            self._store_memory(key, now, dict(result))
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO predictions (key, stored_at, result) VALUES (?, ?, ?)",
+                    (key, now, json.dumps(result)),
+                )
+                self._db.commit()
+
+    def _store_memory(self, key, stored_at, result):
+        self._entries[key] = (stored_at, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Drops every entry from both tiers and resets the counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM predictions")
+                self._db.commit()
+            self.hits = self.disk_hits = self.misses = 0
+
+    def stats(self):
+        """
+        Returns hit/miss counters and the current memory tier size.
+        """
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+            }
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
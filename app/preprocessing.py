@@ -1,13 +1,46 @@
-from PIL import Image, UnidentifiedImageError
+import io
+import json
+import math
+import os
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+import numpy as np
 import torch
 
-def load_image(image_path):
+from app.config import MAX_DECODED_PIXELS
+
+METADATA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "plant_village_vit_metadata.json")
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+def decode_image(source, target_size=(224, 224), draft_factor=2, max_pixels=MAX_DECODED_PIXELS):
+    """
+    Decodes a path, bytes or file-like object into an upright RGB PIL image.
+    JPEGs are decoded in draft mode: libjpeg scales by 1/2, 1/4 or 1/8 in the DCT domain so
+    the result is still at least draft_factor * target_size, instead of materializing
+    every pixel of a 12+ MP photo only to shrink it to model resolution afterwards.
+    Pass target_size=None to decode at full resolution. EXIF orientation is applied.
+    Raises ValueError if the decoded image would exceed max_pixels.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    image = Image.open(source)
+    if target_size is not None and image.format == "JPEG":
+        image.draft("RGB", (target_size[1] * draft_factor, target_size[0] * draft_factor))
+    width, height = image.size
+    if width * height > max_pixels:
+        raise ValueError(f"Image of {width}x{height} pixels exceeds the decode limit of {max_pixels} pixels")
+    image = ImageOps.exif_transpose(image)
+    return image.convert("RGB")
+
+def load_image(image_path, target_size=(224, 224)):
     """
     Loads an image from disk and ensures it's in RGB format.
+    Large JPEGs are decoded at reduced resolution (see decode_image).
     Handles errors gracefully.
     """
     try:
-        image = Image.open(image_path).convert("RGB")
+        image = decode_image(image_path, target_size=target_size)
         print(f"[INFO] Loaded image: {image_path}")
         return image
     except FileNotFoundError:
@@ -32,6 +65,101 @@ def preprocess_image(image, processor):
     print("[INFO] Image preprocessed (resized, normalized, tensorized).")
     return inputs["pixel_values"]  # shape: [1, 3, 224, 224]
 
+class TensorPreprocessor:
+    def __init__(self, size=(224, 224), image_mean=IMAGENET_MEAN, image_std=IMAGENET_STD,
+                 resample=Image.BILINEAR, rescale_factor=1 / 255):
+        """
+        Batched replacement for per-image ViTImageProcessor calls.
+        Turns a list of PIL images (or HxWx3 uint8 arrays) into one contiguous [N, 3, H, W] float tensor:
+        resize each image once into a shared uint8 staging array, then rescale and normalize
+        the whole batch in place with a single fused multiply-add per channel.
+        """
+        self.height, self.width = size
+        self.resample = resample
+        std = torch.tensor(image_std, dtype=torch.float32).view(1, 3, 1, 1)
+        mean = torch.tensor(image_mean, dtype=torch.float32).view(1, 3, 1, 1)
+        # (x * rescale - mean) / std == x * (rescale / std) - mean / std
+        self._scale = rescale_factor / std
+        self._shift = -mean / std
+
+    @classmethod
+    def from_processor(cls, processor):
+        """
+        Mirrors a Hugging Face ViTImageProcessor's configuration, so results match the checkpoint exactly.
+        """
+        return cls(
+            size=(processor.size["height"], processor.size["width"]),
+            image_mean=processor.image_mean,
+            image_std=processor.image_std,
+            resample=processor.resample,
+            rescale_factor=processor.rescale_factor,
+        )
+
+    @classmethod
+    def from_metadata(cls, metadata_path=METADATA_PATH):
+        """
+        Builds the pipeline from plant_village_vit_metadata.json (input size, ImageNet normalization).
+        """
+        with open(metadata_path) as f:
+            metadata = json.load(f)
+        height, width = metadata["input_size"][:2]
+        return cls(
+            size=(height, width),
+            image_mean=metadata.get("image_mean", IMAGENET_MEAN),
+            image_std=metadata.get("image_std", IMAGENET_STD),
+        )
+
+    def to_uint8(self, image):
+        """
+        Resizes one image to model resolution and returns it as an HxWx3 uint8 array.
+        Arrays that are already at model resolution are passed through untouched.
+        """
+        if isinstance(image, np.ndarray):
+            if image.shape == (self.height, self.width, 3):
+                return image
+            image = Image.fromarray(image)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        if image.size != (self.width, self.height):
+            image = image.resize((self.width, self.height), resample=self.resample)
+        return np.asarray(image)
+
+    def __call__(self, images, out=None):
+        """
+        Returns a float32 tensor of shape [N, 3, H, W].
+        Pass a preallocated `out` tensor of shape [>=N, 3, H, W] to reuse its memory across calls.
+        """
+        images = list(images)
+        n = len(images)
+        staging = np.empty((n, self.height, self.width, 3), dtype=np.uint8)
+        for i, image in enumerate(images):
+            staging[i] = self.to_uint8(image)
+        return self.normalize(torch.from_numpy(staging), out=out)
+
+    def normalize(self, batch, out=None):
+        """
+        Rescales and normalizes a uint8 [N, H, W, 3] tensor at model resolution into float32 [N, 3, H, W].
+        """
+        n = batch.shape[0]
+        if out is None:
+            out = torch.empty((n, 3, self.height, self.width), dtype=torch.float32)
+        else:
+            out = out[:n]
+        # The NHWC -> NCHW permute is a view; copy_ converts uint8 to float and lays it out in one pass
+        out.copy_(batch.permute(0, 3, 1, 2))
+        return out.mul_(self._scale).add_(self._shift)
+
+
+def check_equivalence(processor, images, atol=1e-5):
+    """
+    Compares TensorPreprocessor.from_processor(processor) with the Hugging Face processor itself.
+    Returns the max absolute difference and whether it is within atol.
+    """
+    expected = processor(images=list(images), return_tensors="pt")["pixel_values"]
+    actual = TensorPreprocessor.from_processor(processor)(images)
+    max_abs_diff = (expected - actual).abs().max().item()
+    return {"max_abs_diff": max_abs_diff, "ok": expected.shape == actual.shape and max_abs_diff <= atol}
+
 # (Optional) Data augmentation function
 def augment_image(image):
     """
@@ -48,18 +176,81 @@ def augment_image(image):
     return image
 
 
-from transformers import ViTImageProcessor
+TTA_TRANSFORMS = ("hflip", "vflip", "center_crop", "rotate_ccw", "rotate_cw", "hflip_vflip", "crop_top_left",
+                  "crop_bottom_right")
+
+
+def tta_views(image, count, crop=0.875, angle=10):
+    """
+    The first count (at most len(TTA_TRANSFORMS)) deterministic test-time views of a PIL image:
+    flips, crops keeping `crop` of each side, and +-angle degree rotations cropped to hide the
+    filled corners. Unlike augment_image, the same image always yields the same views.
+    """
+    width, height = image.size
+    crop_w, crop_h = round(width * crop), round(height * crop)
+    # Largest centred crop with the image's aspect ratio that stays inside the rotated w x h
+    # frame: its corners, rotated back, must fit within w and h
+    cos, sin = math.cos(math.radians(angle)), math.sin(math.radians(angle))
+    keep = min(width / (width * cos + height * sin), height / (width * sin + height * cos))
+    views = []
+    for name in TTA_TRANSFORMS[:count]:
+        if name == "hflip":
+            view = image.transpose(Image.FLIP_LEFT_RIGHT)
+        elif name == "vflip":
+            view = image.transpose(Image.FLIP_TOP_BOTTOM)
+        elif name == "hflip_vflip":
+            view = image.transpose(Image.ROTATE_180)
+        elif name == "center_crop":
+            left, top = (width - crop_w) // 2, (height - crop_h) // 2
+            view = image.crop((left, top, left + crop_w, top + crop_h))
+        elif name == "crop_top_left":
+            view = image.crop((0, 0, crop_w, crop_h))
+        elif name == "crop_bottom_right":
+            view = image.crop((width - crop_w, height - crop_h, width, height))
+        else:
+            rotated = image.rotate(angle if name == "rotate_ccw" else -angle, resample=Image.BILINEAR)
+            keep_w, keep_h = int(width * keep), int(height * keep)  # Floor: rounding up can reach the fill
+            left, top = (width - keep_w) // 2, (height - keep_h) // 2
+            view = rotated.crop((left, top, left + keep_w, top + keep_h))
+        views.append(view)
+    return views
+
+
+def augment_batch(batch, generator=None, flip_p=0.5, jitter=0.2):
+    """
+    Batched counterpart of augment_image for training on a uint8 [N, H, W, 3] tensor: per-image
+    random horizontal and vertical flips (leaf photos have no canonical orientation) and
+    brightness/contrast jitter of up to +-jitter, each drawn independently per image and
+    applied to the whole batch with a handful of tensor ops. Returns a new uint8 tensor.
+    """
+    n = batch.shape[0]
+    rand = lambda *shape: torch.rand(*shape, generator=generator)
+    horizontal = (rand(n) < flip_p).view(n, 1, 1, 1)
+    batch = torch.where(horizontal, batch.flip(2), batch)
+    vertical = (rand(n) < flip_p).view(n, 1, 1, 1)
+    batch = torch.where(vertical, batch.flip(1), batch)
+    if not jitter:
+        return batch.contiguous()
+    images = batch.float()
+    brightness = 1 + (rand(n, 1, 1, 1) * 2 - 1) * jitter
+    contrast = 1 + (rand(n, 1, 1, 1) * 2 - 1) * jitter
+    mean = images.mean(dim=(1, 2, 3), keepdim=True)
+    images = ((images - mean) * contrast + mean) * brightness
+    return images.round_().clamp_(0, 255).to(torch.uint8)
 
-# Initialize processor (reuse from your model code)
-processor = ViTImageProcessor.from_pretrained("Akshay0706/Plant-Village-1-Epochs-Model")
 
-# Load and preprocess an image
+if __name__ == "__main__":
+    from transformers import ViTImageProcessor
 
+    # Initialize processor (reuse from your model code)
+    processor = ViTImageProcessor.from_pretrained("Akshay0706/Plant-Village-1-Epochs-Model")
 
-image_path = "test/test_leaf.JPG"
-image = load_image(image_path)
-image = augment_image(image)  # Optional
-tensor = preprocess_image(image, processor)
+    # Load and preprocess an image
+    image_path = "test/test_leaf.JPG"
+    image = load_image(image_path)
+    image = augment_image(image)  # Optional
+    tensor = preprocess_image(image, processor)
 
-if tensor is not None:
-    print(f"[INFO] Preprocessed tensor shape: {tensor.shape}")
\ No newline at end of file
+    if tensor is not None:
+        print(f"[INFO] Preprocessed tensor shape: {tensor.shape}")
+        print(f"[INFO] Batched pipeline vs processor: {check_equivalence(processor, [image])}")
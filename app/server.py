@@ -0,0 +1,359 @@
+# server.py
+
+import argparse
+import asyncio
+import functools
+import hmac
+import itertools
+import json
+import logging
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import tornado.web
+from tornado.httpserver import HTTPServer
+
+from app.config import (
+    INFERENCE_WORKERS,
+    MODEL_ADMIN_TOKEN,
+    SERVER_EXECUTOR_WORKERS,
+    SERVER_MAX_QUEUE,
+    SERVER_MAX_UPLOAD_MB,
+    SERVER_PORT,
+    SERVER_REQUEST_TIMEOUT,
+)
+from app.instrumentation import REGISTRY, configure_logging
+from app.storage import ImageUploader, content_key, default_store
+
+REQUESTS_TOTAL = REGISTRY.counter("leafcheck_http_requests_total", "POST /predictions responses by status.",
+                                  ("status",))
+REQUEST_SECONDS = REGISTRY.histogram("leafcheck_http_request_seconds", "POST /predictions latency.")
+
+
+def default_predictor_factory():
+    """
+    Builds the warmed-up predictor behind the API: a ModelRegistry serving a worker pool per
+    model version when INFERENCE_WORKERS > 1, otherwise a single in-process PlantHealthService.
+    """
+    from app.model_registry import ModelRegistry, default_service_factory
+
+    if INFERENCE_WORKERS > 1:
+        from app.worker_pool import InferenceWorkerPool
+
+        return ModelRegistry(lambda **options: InferenceWorkerPool(INFERENCE_WORKERS, **options))
+    return ModelRegistry(default_service_factory)
+
+
+class InferenceState:
+    def __init__(self, predictor_factory=default_predictor_factory, max_queue=SERVER_MAX_QUEUE,
+                 request_timeout=SERVER_REQUEST_TIMEOUT, executor_workers=SERVER_EXECUTOR_WORKERS,
+                 max_results=1000, writer=None, uploader=None):
+        """
+        Shared server state: the predictor (anything with predict_bytes()), the executor that keeps
+        inference off the event loop, the in-flight counter used for backpressure and a bounded
+        store of recent results for GET /predictions/<id>.
+        writer: optional database.persistence.PredictionWriter; successful predictions are
+        queued to it and committed in the background, outside the request's latency.
+        uploader: optional app.storage.ImageUploader; uploaded images are stored under their
+        content hash in the background and the image row's file_path is updated when done.
+        """
+        self.predictor_factory = predictor_factory
+        self.max_queue = max_queue
+        self.request_timeout = request_timeout
+        self.executor = ThreadPoolExecutor(max_workers=executor_workers, thread_name_prefix="inference")
+        self.max_results = max_results
+        self.writer = writer
+        self.uploader = uploader
+        self.predictor = None
+        self.ready = False
+        self.startup_error = None
+        self.in_flight = 0
+        self.results = OrderedDict()
+        self._ids = itertools.count(1)
+
+    async def start(self):
+        """
+        Loads and warms up the predictor in the executor; /ready reports 200 only afterwards.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            self.predictor = await loop.run_in_executor(self.executor, self.predictor_factory)
+        except Exception as e:
+            self.startup_error = str(e)
+            print(f"[ERROR] Predictor failed to start: {e}")
+            return
+        self.ready = True
+        print("[INFO] Predictor warmed up, server is ready")
+
+    def store_result(self, result):
+        prediction_id = next(self._ids)
+        self.results[prediction_id] = result
+        while len(self.results) > self.max_results:
+            self.results.popitem(last=False)
+        return prediction_id
+
+    def persist(self, upload, result):
+        """
+        Queues the image upload and the analysis record. Both calls may block on their bounded
+        buffers, so this runs on an executor thread, never on the event loop.
+        """
+        file_path = upload["filename"]
+        pending_path = None
+        if self.uploader is not None:
+            file_path = self.uploader.store.uri(content_key(upload["body"], upload["filename"]))
+            if self.writer is not None:
+                from database.persistence import PENDING_PREFIX
+
+                pending_path = file_path = PENDING_PREFIX + file_path
+        if self.writer is not None:
+            metadata = {"content_type": upload["content_type"], "bytes": len(upload["body"])}
+            self.writer.submit(upload["filename"], file_path, result, image_metadata=metadata)
+        if self.uploader is not None:
+            on_done = None
+            if pending_path is not None:
+                # Queued after the record above, so the writer sees the insert before the update
+                on_done = functools.partial(self.writer.update_file_path, pending_path)
+            self.uploader.submit(upload["body"], upload["filename"], upload["content_type"], on_done=on_done)
+
+    def shutdown(self):
+        self.ready = False
+        self.executor.shutdown(wait=True)
+        close = getattr(self.predictor, "close", None)
+        if close is not None:
+            close()
+        if self.uploader is not None:
+            self.uploader.close()  # Before the writer, so the final file_path updates reach it
+        if self.writer is not None:
+            self.writer.close()  # Flushes buffered analyses
+
+
+class JsonHandler(tornado.web.RequestHandler):
+    def initialize(self, state):
+        self.state = state
+
+    def write_json(self, status, payload):
+        self.set_status(status)
+        self.set_header("Content-Type", "application/json")
+        self.finish(json.dumps(payload))
+
+    def write_error(self, status_code, **kwargs):
+        self.write_json(status_code, {"error": self._reason})
+
+
+class HealthHandler(JsonHandler):
+    def get(self):
+        """Liveness: the event loop is serving requests."""
+        self.write_json(200, {"status": "ok"})
+
+
+class ReadyHandler(JsonHandler):
+    def get(self):
+        """Readiness: the model is loaded and warmed up."""
+        if self.state.ready:
+            self.write_json(200, {"status": "ready", "in_flight": self.state.in_flight})
+        else:
+            self.write_json(503, {"status": "starting", "error": self.state.startup_error})
+
+
+class PredictionsHandler(JsonHandler):
+    async def post(self):
+        """
+        Multipart upload (field "image"), returns the prediction with an id for later retrieval.
+        """
+        state = self.state
+        if not state.ready:
+            return self.write_json(503, {"error": "Model is not ready"})
+        files = self.request.files.get("image")
+        if not files:
+            return self.write_json(400, {"error": "Expected a multipart upload with an 'image' field"})
+        if state.in_flight >= state.max_queue:
+            # Shed load instead of letting queueing latency pile up
+            self.set_header("Retry-After", "1")
+            return self.write_json(429, {"error": "Inference queue is full, retry later"})
+
+        state.in_flight += 1
+        start = time.perf_counter()
+        future = state.executor.submit(state.predictor.predict_bytes, files[0]["body"])
+        # Release the slot when the work actually finishes, even if this request timed out
+        loop = asyncio.get_running_loop()
+        future.add_done_callback(lambda _: _call_soon(loop, self._release))
+        try:
+            result = await asyncio.wait_for(asyncio.wrap_future(future), timeout=state.request_timeout)
+        except asyncio.TimeoutError:
+            return self.write_json(504, {"error": f"Prediction timed out after {state.request_timeout}s"})
+        except Exception as e:
+            return self.write_json(500, {"error": f"Prediction failed: {e}"})
+        if result is None:
+            return self.write_json(400, {"error": "Could not decode the uploaded image"})
+        prediction_id = state.store_result(result)
+        if state.writer is not None or state.uploader is not None:
+            await loop.run_in_executor(None, state.persist, files[0], result)
+        latency_ms = (time.perf_counter() - start) * 1000
+        self.write_json(200, {"id": prediction_id, "latency_ms": latency_ms, **result})
+
+    def _release(self):
+        self.state.in_flight -= 1
+
+    def on_finish(self):
+        REQUESTS_TOTAL.inc(status=str(self.get_status()))
+        REQUEST_SECONDS.observe(self.request.request_time())
+
+
+def _call_soon(loop, callback):
+    """
+    Schedules callback on the event loop from an executor thread; a no-op once the loop is closed.
+    """
+    try:
+        loop.call_soon_threadsafe(callback)
+    except RuntimeError:
+        pass
+
+
+class ModelsHandler(JsonHandler):
+    # Options a load request may pass to the registry's service factory
+    LOAD_OPTIONS = ("model_name", "revision", "snapshot_dir", "precision", "backend")
+
+    def prepare(self):
+        """
+        Changing the served model is an operator action: POSTs need "Authorization: Bearer
+        <MODEL_ADMIN_TOKEN>" and are refused outright while no token is configured.
+        """
+        if self.request.method == "GET":
+            return
+        if not MODEL_ADMIN_TOKEN:
+            return self.write_json(403, {"error": "Model admin endpoints are disabled; set MODEL_ADMIN_TOKEN"})
+        supplied = self.request.headers.get("Authorization", "")
+        if not hmac.compare_digest(supplied.encode(), f"Bearer {MODEL_ADMIN_TOKEN}".encode()):
+            self.set_header("WWW-Authenticate", "Bearer")
+            return self.write_json(401, {"error": "Invalid or missing admin token"})
+
+    def registry(self):
+        predictor = self.state.predictor
+        if not self.state.ready or not hasattr(predictor, "load"):
+            self.write_json(404, {"error": "No model registry is serving"})
+            return None
+        return predictor
+
+    def get(self):
+        """Active version, background load state and shadow comparison."""
+        registry = self.registry()
+        if registry is not None:
+            self.write_json(200, registry.status())
+
+    def post(self):
+        """
+        Operator endpoint: loads a model version in the background, e.g.
+        {"snapshot_dir": "models/v2"} to swap it in once warmed up, or
+        {"snapshot_dir": "models/v2", "shadow": true, "shadow_fraction": 0.1} to shadow-score it.
+        """
+        registry = self.registry()
+        if registry is None:
+            return
+        try:
+            body = json.loads(self.request.body or b"{}")
+        except ValueError:
+            body = None
+        if not isinstance(body, dict):
+            return self.write_json(400, {"error": "Expected a JSON object body"})
+        unknown = set(body) - set(self.LOAD_OPTIONS) - {"shadow", "shadow_fraction"}
+        if unknown:
+            return self.write_json(400, {"error": f"Unknown options {sorted(unknown)}"})
+        if "shadow_fraction" in body:
+            fraction = body["shadow_fraction"]
+            if isinstance(fraction, bool) or not isinstance(fraction, (int, float)) or not 0 <= fraction <= 1:
+                return self.write_json(400, {"error": "shadow_fraction must be a number between 0 and 1"})
+            registry.shadow_fraction = float(fraction)
+        registry.load(shadow=bool(body.get("shadow")), **{key: body[key] for key in self.LOAD_OPTIONS if key in body})
+        self.write_json(202, {"status": "loading", "shadow": bool(body.get("shadow"))})
+
+
+class PromoteHandler(ModelsHandler):
+    def post(self):
+        """Operator endpoint: makes the shadow candidate the active version."""
+        registry = self.registry()
+        if registry is None:
+            return
+        try:
+            registry.promote()
+        except RuntimeError as e:
+            return self.write_json(409, {"error": str(e)})
+        self.write_json(200, registry.status())
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    def get(self):
+        """
+        Prometheus scrape endpoint. With INFERENCE_WORKERS > 1 the stage timings are recorded
+        inside the worker processes, so only request-level metrics of this process appear here.
+        """
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.finish(REGISTRY.render_prometheus())
+
+
+class PredictionHandler(JsonHandler):
+    def get(self, prediction_id):
+        result = self.state.results.get(int(prediction_id))
+        if result is None:
+            return self.write_json(404, {"error": "Unknown prediction id"})
+        self.write_json(200, {"id": int(prediction_id), **result})
+
+
+def make_app(state):
+    """
+    Builds the Tornado application. Tests can pass an InferenceState with a stub predictor factory.
+    """
+    handlers = [
+        (r"/health", HealthHandler),
+        (r"/ready", ReadyHandler),
+        (r"/predictions", PredictionsHandler),
+        (r"/predictions/([0-9]+)", PredictionHandler),
+        (r"/models", ModelsHandler),
+        (r"/models/promote", PromoteHandler),
+    ]
+    routes = [(path, handler, {"state": state}) for path, handler in handlers]
+    return tornado.web.Application(routes + [(r"/metrics", MetricsHandler)])
+
+
+async def serve(port=SERVER_PORT, state=None):
+    state = state or InferenceState()
+    server = HTTPServer(make_app(state), max_body_size=int(SERVER_MAX_UPLOAD_MB * 2**20))
+    server.listen(port)
+    print(f"[INFO] LeafCheck inference API listening on :{port}")
+    await state.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        server.stop()
+        state.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LeafCheck inference REST API.")
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--persist", action="store_true", help="Write predictions to the database in the background")
+    parser.add_argument("--upload", action="store_true",
+                        help="Store uploaded images (STORAGE_BACKEND) and their derived artifacts in the background")
+    args = parser.parse_args()
+    configure_logging()
+    # Tornado logs every request at INFO; keep that off the hot path unless debugging
+    logging.getLogger("tornado.access").setLevel(max(logging.getLogger().level, logging.WARNING))
+    writer = uploader = None
+    if args.persist:
+        from database.persistence import PredictionWriter
+
+        writer = PredictionWriter()
+    if args.upload:
+        from app.derived_cache import DerivedCache
+
+        # Thumbnails and model-ready arrays are built on the upload threads and shared via the store
+        store = default_store()
+        uploader = ImageUploader(store=store, derived=DerivedCache(store=store))
+    try:
+        asyncio.run(serve(args.port, InferenceState(writer=writer, uploader=uploader)))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
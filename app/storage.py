@@ -0,0 +1,269 @@
+# storage.py
+
+import hashlib
+import io
+import logging
+import mimetypes
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from app.config import (
+    AWS_ACCESS_KEY_ID,
+    AWS_BUCKET_NAME,
+    AWS_ENDPOINT_URL,
+    AWS_REGION,
+    AWS_SECRET_ACCESS_KEY,
+    STORAGE_BACKEND,
+    STORAGE_LOCAL_DIR,
+    STORAGE_MAX_PENDING,
+    STORAGE_MULTIPART_CHUNK_MB,
+    STORAGE_MULTIPART_THRESHOLD_MB,
+    STORAGE_UPLOAD_WORKERS,
+)
+
+logger = logging.getLogger(__name__)
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_s3_client():
+    """
+    Returns the process-wide S3 client. boto3 clients are thread-safe, and reusing one keeps its
+    HTTPS connection pool (sized for every parallel upload part) warm instead of paying a TLS
+    handshake per call.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            import boto3
+            from botocore.config import Config
+
+            _client = boto3.client(
+                "s3",
+                aws_access_key_id=AWS_ACCESS_KEY_ID,
+                aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+                region_name=AWS_REGION,
+                endpoint_url=AWS_ENDPOINT_URL,
+                config=Config(max_pool_connections=STORAGE_UPLOAD_WORKERS * 4,
+                              retries={"max_attempts": 5, "mode": "adaptive"}),
+            )
+        return _client
+
+
+def content_key(data, filename=""):
+    """
+    Content-addressed object key: identical bytes always map to the same key, so an image
+    that is already stored never needs uploading again.
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    extension = os.path.splitext(filename)[1].lower()
+    return f"images/{digest[:2]}/{digest}{extension}"
+
+
+class S3ImageStore:
+    def __init__(self, bucket=AWS_BUCKET_NAME, client=None, multipart_threshold_mb=STORAGE_MULTIPART_THRESHOLD_MB,
+                 multipart_chunk_mb=STORAGE_MULTIPART_CHUNK_MB, part_concurrency=4):
+        """
+        Uploads from memory with boto3's managed transfer: objects above the threshold go up as
+        multipart uploads with part_concurrency parts in flight.
+        """
+        from boto3.s3.transfer import TransferConfig
+
+        self.bucket = bucket
+        self.client = client or get_s3_client()
+        self.transfer_config = TransferConfig(
+            multipart_threshold=int(multipart_threshold_mb * 2**20),
+            multipart_chunksize=int(multipart_chunk_mb * 2**20),
+            max_concurrency=part_concurrency,
+            use_threads=True,
+        )
+
+    def exists(self, key):
+        from botocore.exceptions import ClientError
+
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    def put(self, key, data, content_type=None):
+        extra_args = {"ContentType": content_type} if content_type else None
+        self.client.upload_fileobj(io.BytesIO(data), self.bucket, key, ExtraArgs=extra_args,
+                                   Config=self.transfer_config)
+        return self.uri(key)
+
+    def get(self, key):
+        """
+        Returns the object's bytes, or None if it does not exist.
+        """
+        from botocore.exceptions import ClientError
+
+        buffer = io.BytesIO()
+        try:
+            self.client.download_fileobj(self.bucket, key, buffer, Config=self.transfer_config)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        return buffer.getvalue()
+
+    def uri(self, key):
+        return f"s3://{self.bucket}/{key}"
+
+
+class LocalImageStore:
+    def __init__(self, root=STORAGE_LOCAL_DIR):
+        """
+        Filesystem stand-in for S3 with the same interface, for development and tests.
+        """
+        self.root = root
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.split("/"))
+
+    def exists(self, key):
+        return os.path.isfile(self._path(key))
+
+    def put(self, key, data, content_type=None):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write next to the target and rename, so readers never see a partial object
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        return self.uri(key)
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def uri(self, key):
+        return self._path(key)
+
+
+def default_store():
+    if STORAGE_BACKEND == "local":
+        return LocalImageStore()
+    return S3ImageStore()
+
+
+class ImageUploader:
+    def __init__(self, store=None, max_workers=STORAGE_UPLOAD_WORKERS, max_pending=STORAGE_MAX_PENDING,
+                 known_keys=100000, derived=None):
+        """
+        Uploads images on a bounded thread pool, off the inference path.
+        submit() blocks once max_pending uploads are queued or running (backpressure instead of
+        unbounded memory). Keys already uploaded, by this process or found with a HEAD request,
+        are remembered in an LRU of known_keys entries; concurrent submits of the same bytes
+        share one upload.
+        derived: optional app.derived_cache.DerivedCache; each new image's thumbnail and
+        model-ready array are then built on the upload thread as well.
+        """
+        self.store = store or default_store()
+        self.derived = derived
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ImageUploader")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._known = OrderedDict()
+        self._known_limit = known_keys
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._stats = {"uploaded": 0, "deduplicated": 0, "failed": 0, "bytes": 0, "derived": 0}
+
+    def submit(self, data, filename="", content_type=None, on_done=None):
+        """
+        Queues data for upload and returns (key, Future of the stored URI).
+        on_done(uri) runs on the upload thread once the object is stored (not on failure).
+        """
+        key = content_key(data, filename)
+        content_type = content_type or mimetypes.guess_type(filename)[0]
+        future = self._existing(key)
+        if future is None:
+            self._slots.acquire()  # Outside the lock: finishing uploads need it to free their slot
+            with self._lock:
+                future = self._in_flight.get(key)
+                if future is None:
+                    future = self._executor.submit(self._upload, key, data, content_type)
+                    self._in_flight[key] = future
+                    future.add_done_callback(lambda _: self._slots.release())
+                else:
+                    self._slots.release()
+        if on_done is not None:
+            def notify(done):
+                if not done.cancelled() and done.exception() is None:
+                    on_done(done.result())
+
+            future.add_done_callback(notify)
+        return key, future
+
+    def _existing(self, key):
+        """
+        Future of a known or in-flight upload of key, or None.
+        """
+        with self._lock:
+            if key in self._known:
+                self._known.move_to_end(key)
+                self._stats["deduplicated"] += 1
+                future = Future()
+                future.set_result(self.store.uri(key))
+                return future
+            return self._in_flight.get(key)
+
+    def _upload(self, key, data, content_type):
+        try:
+            if self.store.exists(key):
+                counter = "deduplicated"
+                uri = self.store.uri(key)
+            else:
+                counter = "uploaded"
+                uri = self.store.put(key, data, content_type)
+        except Exception as e:
+            logger.error("Upload of %s failed: %s", key, e)
+            with self._lock:
+                self._stats["failed"] += 1
+                del self._in_flight[key]
+            raise
+        derived = False
+        if self.derived is not None:
+            try:
+                self.derived.put(data, key.rsplit("/", 1)[-1].split(".")[0])
+                derived = True
+            except Exception as e:
+                # The original is stored, derivatives can be rebuilt from it later
+                logger.warning("Deriving artifacts for %s failed: %s", key, e)
+        with self._lock:
+            self._stats["derived"] += derived
+            self._stats[counter] += 1
+            if counter == "uploaded":
+                self._stats["bytes"] += len(data)
+            del self._in_flight[key]
+            self._known[key] = True
+            if len(self._known) > self._known_limit:
+                self._known.popitem(last=False)
+        return uri
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, in_flight=len(self._in_flight))
+
+    def close(self):
+        """
+        Waits for queued uploads to finish.
+        """
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
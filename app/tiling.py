@@ -0,0 +1,206 @@
+# tiling.py
+
+import argparse
+import json
+import math
+from collections import Counter
+
+import numpy as np
+from PIL import Image
+
+from app.config import (
+    TILE_BATCH_SIZE,
+    TILE_MAX_SIDE,
+    TILE_MIN_GREEN,
+    TILE_MIN_STD,
+    TILE_OVERLAP,
+    TILE_SCALES,
+)
+from app.instrumentation import configure_logging, stage_timer
+from app.preprocessing import decode_image
+
+
+def tile_origins(length, tile, stride):
+    """
+    Start offsets of tiles of size tile covering [0, length) with the given stride; the last
+    tile is aligned to the far edge instead of running past it.
+    """
+    if length <= tile:
+        return [0]
+    origins = list(range(0, length - tile + 1, stride))
+    if origins[-1] != length - tile:
+        origins.append(length - tile)
+    return origins
+
+
+def is_background(tile, min_green=TILE_MIN_GREEN, min_std=TILE_MIN_STD):
+    """
+    Cheap background test on a uint8 HxWx3 tile, on every 4th pixel: too few green pixels
+    (green channel above red and blue) or too little variation (sky, bare soil, blur).
+    """
+    sample = tile[::4, ::4].astype(np.int16)
+    red, green, blue = sample[..., 0], sample[..., 1], sample[..., 2]
+    green_fraction = float(((green > red) & (green > blue)).mean())
+    return green_fraction < min_green or float(sample.std()) < min_std
+
+
+def iter_tiles(image, tile, overlap=TILE_OVERLAP, scales=TILE_SCALES):
+    """
+    Yields (x, y, size, scale, uint8 tile array) for overlapping tile x tile crops of a PIL image
+    at every scale; x, y and size are in the coordinates of the image passed in. A scale at which
+    the image would be smaller than one tile is raised to exactly fit one. Only one resized copy
+    of the image is alive at a time, and tiles are views into it.
+    """
+    width, height = image.size
+    stride = max(1, int(tile * (1 - overlap)))
+    seen = set()
+    for scale in scales:
+        scale = max(scale, tile / min(width, height))
+        scaled = (max(tile, round(width * scale)), max(tile, round(height * scale)))
+        if scaled in seen:
+            continue
+        seen.add(scaled)
+        pixels = np.asarray(image if scaled == image.size else image.resize(scaled, resample=Image.BILINEAR))
+        for y in tile_origins(scaled[1], tile, stride):
+            for x in tile_origins(scaled[0], tile, stride):
+                yield (round(x / scale), round(y / scale), round(tile / scale), scale,
+                       pixels[y:y + tile, x:x + tile])
+
+
+def predict_tiled(service, image, overlap=TILE_OVERLAP, scales=TILE_SCALES, batch_size=TILE_BATCH_SIZE,
+                  skip_background=True, min_green=TILE_MIN_GREEN, min_std=TILE_MIN_STD, max_side=TILE_MAX_SIDE,
+                  tile_threshold=0.5, heatmap_cell=None):
+    """
+    Classifies a large photo (PIL image, path or bytes) tile by tile with a PlantHealthService.
+
+    Tiles are model-resolution crops at each scale (1.0 = native pixels, 0.5 = tiles covering
+    twice the area) overlapping by `overlap`. Background tiles are skipped when skip_background
+    is set. The rest are scored batch_size at a time, so peak memory is one resized image plus
+    one batch no matter how many tiles there are.
+
+    Returns the usual result dict for the aggregated verdict plus:
+    - tiles: x, y, size (pixels of the analysed image), scale, label, confidence and disease
+      probability (1 - total probability of healthy classes) per scored tile;
+    - tiles_scored, tiles_skipped, diseased_tile_fraction;
+    - heatmap: mean disease probability per heatmap_cell-pixel cell (default: a quarter tile),
+      over all tiles covering it; 0 where no tile was scored.
+    The verdict is the most frequent disease among tiles whose disease label reaches
+    tile_threshold confidence (ties broken by summed confidence), otherwise the argmax of the
+    mean tile probabilities.
+    """
+    if not isinstance(image, Image.Image):
+        with stage_timer("decode"):
+            # Draft-decode to at least max_side, then cap it: bounds memory for 50+ MP photos
+            image = decode_image(image, target_size=(max_side // 2, max_side // 2))
+    if max(image.size) > max_side:
+        image = image.copy()
+        image.thumbnail((max_side, max_side), resample=Image.BILINEAR)
+    id2label = service.model.config.id2label
+    healthy = np.array([id2label[i] in service.healthy_labels or "healthy" in id2label[i].lower()
+                        for i in range(len(id2label))])
+    tile = service.preprocessor.height
+    cell = heatmap_cell or max(1, tile // 4)
+    width, height = image.size
+    heat_sum = np.zeros((math.ceil(height / cell), math.ceil(width / cell)), dtype=np.float32)
+    heat_count = np.zeros_like(heat_sum)
+    prob_sum = np.zeros(len(id2label), dtype=np.float64)
+    tiles, skipped, batch = [], 0, []
+
+    def score(batch):
+        probs = service.predict_proba([pixels for *_, pixels in batch]).numpy()
+        for (x, y, size, scale, _), p in zip(batch, probs):
+            idx = int(p.argmax())
+            disease = float(1.0 - p[healthy].sum())
+            tiles.append({"x": x, "y": y, "size": size, "scale": scale, "predicted_class_index": idx,
+                          "predicted_label": id2label[idx], "confidence": float(p[idx]),
+                          "disease_probability": disease})
+            prob_sum[:] += p
+            rows = slice(y // cell, math.ceil((y + size) / cell))
+            cols = slice(x // cell, math.ceil((x + size) / cell))
+            heat_sum[rows, cols] += disease
+            heat_count[rows, cols] += 1
+
+    for item in iter_tiles(image, tile, overlap, scales):
+        if skip_background and is_background(item[-1], min_green, min_std):
+            skipped += 1
+            continue
+        batch.append(item)
+        if len(batch) == batch_size:
+            score(batch)
+            batch = []
+    if batch:
+        score(batch)
+
+    if not tiles:
+        # Nothing looked like vegetation: fall back to classifying the whole frame
+        result = dict(service.predict(image))
+    else:
+        diseased = [t for t in tiles if not healthy[t["predicted_class_index"]] and t["confidence"] >= tile_threshold]
+        if diseased:
+            counts = Counter(t["predicted_class_index"] for t in diseased)
+            idx = max(counts, key=lambda i: (counts[i], sum(t["confidence"] for t in diseased
+                                                           if t["predicted_class_index"] == i)))
+            confidence = float(np.mean([t["confidence"] for t in diseased if t["predicted_class_index"] == idx]))
+        else:
+            mean = prob_sum / len(tiles)
+            idx = int(mean.argmax())
+            confidence = float(mean[idx])
+        result = service._build_result(idx, confidence)
+    heatmap = np.divide(heat_sum, heat_count, out=np.zeros_like(heat_sum), where=heat_count > 0)
+    result.update({
+        "mode": "tiled",
+        "image_size": [width, height],
+        "tiles": tiles,
+        "tiles_scored": len(tiles),
+        "tiles_skipped": skipped,
+        "diseased_tile_fraction": (sum(1 for t in tiles if not healthy[t["predicted_class_index"]]) / len(tiles)
+                                   if tiles else 0.0),
+        "heatmap": {"cell_size": cell, "values": np.round(heatmap, 3).tolist()},
+    })
+    return result
+
+
+def render_heatmap(image, heatmap, alpha=0.5):
+    """
+    Overlays a predict_tiled() heatmap on the analysed image: red where disease is likely.
+    """
+    image = image.convert("RGB")
+    values = np.asarray(heatmap["values"], dtype=np.float32)
+    mask = Image.fromarray((values * 255 * alpha).astype(np.uint8)).resize(image.size, resample=Image.BILINEAR)
+    red = Image.new("RGB", image.size, (255, 0, 0))
+    return Image.composite(red, image, mask)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tiled disease analysis of a large field or canopy photo.")
+    parser.add_argument("image")
+    parser.add_argument("--heatmap", default=None, help="Write a heatmap overlay PNG here")
+    parser.add_argument("--output", default=None, help="Write the full JSON result here")
+    parser.add_argument("--scales", type=float, nargs="+", default=list(TILE_SCALES))
+    parser.add_argument("--overlap", type=float, default=TILE_OVERLAP)
+    parser.add_argument("--keep-background", action="store_true", help="Score background tiles too")
+    parser.add_argument("--model", default="Akshay0706/Plant-Village-1-Epochs-Model")
+    parser.add_argument("--snapshot-dir", default=None)
+    args = parser.parse_args()
+    configure_logging()
+
+    from app.plant_health_service import PlantHealthService
+
+    service = PlantHealthService(model_name=args.model, snapshot_dir=args.snapshot_dir)
+    image = decode_image(args.image, target_size=(TILE_MAX_SIDE // 2, TILE_MAX_SIDE // 2))
+    result = predict_tiled(service, image, overlap=args.overlap, scales=args.scales,
+                           skip_background=not args.keep_background)
+    print(f"[RESULT] {result['predicted_label']} ({result['confidence']:.3f}) from {result['tiles_scored']} tiles "
+          f"({result['tiles_skipped']} background skipped), {result['diseased_tile_fraction']:.0%} diseased")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.heatmap:
+        if max(image.size) > TILE_MAX_SIDE:
+            image.thumbnail((TILE_MAX_SIDE, TILE_MAX_SIDE), resample=Image.BILINEAR)
+        render_heatmap(image, result["heatmap"]).save(args.heatmap)
+        print(f"[INFO] Heatmap written to {args.heatmap}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,370 @@
+# train.py
+
+import argparse
+import logging
+import math
+import os
+import random
+import shutil
+import time
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Dataset, Sampler
+from transformers import ViTForImageClassification, ViTImageProcessor
+
+from app.benchmark import load_labelled_images
+from app.instrumentation import configure_logging
+from app.model_store import write_snapshot
+from app.precision import bf16_supported
+from app.preprocessing import TensorPreprocessor, augment_batch, decode_image
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_FILE = "training_checkpoint.pt"
+
+
+class FolderDataset(Dataset):
+    def __init__(self, samples, label_ids, size):
+        """
+        (path, class name) samples decoded on the fly into uint8 HxWx3 tensors at model resolution.
+        Undecodable images yield None and are dropped by collate().
+        """
+        self.samples = samples
+        self.label_ids = label_ids
+        self.preprocessor = TensorPreprocessor(size=size)
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __getitem__(self, index):
+        path, name = self.samples[index]
+        try:
+            image = decode_image(path, target_size=(self.preprocessor.height, self.preprocessor.width))
+        except Exception as e:
+            logger.warning("Skipping %s: %s", path, e)
+            return None
+        return torch.from_numpy(self.preprocessor.to_uint8(image).copy()), self.label_ids[name]
+
+
+class PackedSubset(Dataset):
+    def __init__(self, dataset, rows, label_ids):
+        """
+        Rows of an app.packed_dataset.PackedDataset. Batches are fetched with one sorted gather
+        from the memory map (__getitems__) instead of one read per image.
+        """
+        self.dataset = dataset
+        self.rows = np.asarray(rows)
+        self.label_ids = np.array([label_ids[name] for name in dataset.classes])
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, index):
+        return self.__getitems__([index])[0]
+
+    def __getitems__(self, indices):
+        rows = self.rows[indices]
+        order = np.argsort(rows)
+        images = np.empty((len(rows),) + self.dataset.images.shape[1:], dtype=np.uint8)
+        images[order] = self.dataset.images[rows[order]]
+        labels = self.label_ids[self.dataset.labels[rows]]
+        return [(torch.from_numpy(image), int(label)) for image, label in zip(images, labels)]
+
+
+def collate(items):
+    items = [item for item in items if item is not None]
+    if not items:
+        return torch.empty(0, dtype=torch.uint8), torch.empty(0, dtype=torch.long)
+    return torch.stack([image for image, _ in items]), torch.tensor([label for _, label in items])
+
+
+class ResumableSampler(Sampler):
+    def __init__(self, size, seed=0, shuffle=True):
+        """
+        A permutation fixed by (seed, epoch), so a resumed run can start mid-epoch at exactly the
+        next unseen sample without reading the ones before it.
+        """
+        self.size = size
+        self.seed = seed
+        self.shuffle = shuffle
+        self.epoch = 0
+        self.start = 0
+
+    def set_epoch(self, epoch, start=0):
+        self.epoch = epoch
+        self.start = start
+
+    def __iter__(self):
+        if not self.shuffle:
+            return iter(range(self.start, self.size))
+        generator = torch.Generator().manual_seed(self.seed + self.epoch)
+        return iter(torch.randperm(self.size, generator=generator)[self.start:].tolist())
+
+    def __len__(self):
+        return self.size - self.start
+
+
+def split_samples(samples, val_fraction=0.1, seed=0):
+    """
+    Deterministic per-class train/validation split of (item, class name) pairs.
+    """
+    rng = random.Random(seed)
+    by_class = {}
+    for sample in samples:
+        by_class.setdefault(sample[1], []).append(sample)
+    train, val = [], []
+    for name in sorted(by_class):
+        items = by_class[name]
+        rng.shuffle(items)
+        cut = int(round(len(items) * val_fraction))
+        val.extend(items[:cut])
+        train.extend(items[cut:])
+    return train, val
+
+
+def autocast_dtype(device, precision):
+    """
+    Autocast dtype for the requested precision: bf16 on CPUs with native support and on GPUs
+    that have it, fp16 on older GPUs, None (fp32) otherwise or when precision="fp32".
+    """
+    if precision == "fp32":
+        return None
+    if device == "cuda":
+        return torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+    if bf16_supported():
+        return torch.bfloat16
+    if precision == "bf16":
+        raise RuntimeError("bf16 training requested but this CPU has no native bf16 support")
+    return None
+
+
+def reconcile_labels(label2id, classes):
+    """
+    The label2id to train with: the checkpoint's own if it already knows every class in the
+    data, otherwise a new one over the data's classes (which needs a fresh head).
+    """
+    if set(classes) <= set(label2id):
+        return dict(label2id)
+    return {label: i for i, label in enumerate(sorted(classes))}
+
+
+def load_model(model_name, classes, freeze_backbone=False):
+    """
+    Loads the checkpoint to fine-tune. Its classification head is kept if it already knows every
+    class in the data; otherwise a fresh head is created for the data's classes.
+    """
+    model = ViTForImageClassification.from_pretrained(model_name)
+    label2id = reconcile_labels(model.config.label2id, classes)
+    if label2id != model.config.label2id:
+        logger.info("%s does not know every class, training a new %d-way head", model_name, len(label2id))
+        model = ViTForImageClassification.from_pretrained(
+            model_name, num_labels=len(label2id), id2label={i: label for label, i in label2id.items()},
+            label2id=label2id, ignore_mismatched_sizes=True)
+    if freeze_backbone:
+        for parameter in model.vit.parameters():
+            parameter.requires_grad = False
+    return model
+
+
+def evaluate(model, loader, preprocessor, device, dtype=None):
+    model.eval()
+    correct = seen = 0
+    loss_sum = 0.0
+    with torch.no_grad():
+        for images, labels in loader:
+            if not len(labels):
+                continue
+            pixel_values = preprocessor.normalize(images).to(device)
+            labels = labels.to(device)
+            with torch.autocast(device_type=device, dtype=dtype or torch.float32, enabled=dtype is not None):
+                logits = model(pixel_values=pixel_values).logits
+            loss_sum += torch.nn.functional.cross_entropy(logits.float(), labels, reduction="sum").item()
+            correct += (logits.argmax(-1) == labels).sum().item()
+            seen += len(labels)
+    return {"images": seen, "top1": correct / seen if seen else 0.0, "loss": loss_sum / seen if seen else 0.0}
+
+
+def _init_worker(_):
+    # Loader workers decode with PIL; one intra-op thread each avoids oversubscribing the trainer's cores
+    torch.set_num_threads(1)
+
+
+def _save_checkpoint(path, state):
+    tmp = path + ".tmp"
+    torch.save(state, tmp)
+    os.replace(tmp, path)
+
+
+def train(model, processor, train_set, val_set, output, epochs=3, batch_size=32, accumulation_steps=1, lr=5e-5,
+          weight_decay=0.01, warmup_steps=0, precision="auto", workers=4, prefetch=4, checkpoint_every=200,
+          resume=True, seed=0, log_every=20, device=None, model_name=None, loss_fn=None, checkpoint_dir=None):
+    """
+    Fine-tunes model on train_set (a Dataset of (uint8 HxWx3 tensor, label id)) and writes the
+    result to output as a snapshot (see app.model_store) that PlantHealthService loads with
+    model_name=output or snapshot_dir=output.
+
+    Decoding happens in `workers` DataLoader processes with `prefetch` batches queued each;
+    augmentation and normalization run batched in the training process. The effective batch
+    is batch_size * accumulation_steps. A checkpoint with model, optimizer, scheduler and
+    position is written to checkpoint_dir (default: "<output>.checkpoint", next to the snapshot
+    so it is never served or shipped with it) every checkpoint_every optimizer steps and after
+    every epoch, and with resume=True a previous run continues where it stopped. It is deleted
+    once the final snapshot is written.
+    loss_fn(logits, labels, pixel_values) replaces the default cross-entropy (see app.distill).
+    """
+    device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+    dtype = autocast_dtype(device, precision)
+    torch.manual_seed(seed)
+    checkpoint_dir = checkpoint_dir or os.path.normpath(output) + ".checkpoint"
+    os.makedirs(output, exist_ok=True)
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    checkpoint_path = os.path.join(checkpoint_dir, CHECKPOINT_FILE)
+    preprocessor = TensorPreprocessor.from_processor(processor)
+    model.to(device)
+
+    sampler = ResumableSampler(len(train_set), seed=seed)
+    loader_options = {"num_workers": workers, "collate_fn": collate, "pin_memory": device == "cuda"}
+    if workers:
+        loader_options.update(prefetch_factor=prefetch, persistent_workers=True,
+                              worker_init_fn=_init_worker)
+    train_loader = DataLoader(train_set, batch_size=batch_size, sampler=sampler, **loader_options)
+    val_loader = DataLoader(val_set, batch_size=batch_size, **loader_options) if len(val_set) else None
+
+    parameters = [p for p in model.parameters() if p.requires_grad]
+    optimizer = torch.optim.AdamW(parameters, lr=lr, weight_decay=weight_decay)
+    steps_per_epoch = math.ceil(math.ceil(len(train_set) / batch_size) / accumulation_steps)
+    total_steps = max(1, steps_per_epoch * epochs)
+    scheduler = torch.optim.lr_scheduler.LambdaLR(optimizer, lambda step: min(
+        (step + 1) / warmup_steps if warmup_steps else 1.0,
+        max(0.0, (total_steps - step) / max(1, total_steps - warmup_steps))))
+    scaler = torch.amp.GradScaler(device, enabled=dtype == torch.float16)
+    augment_generator = torch.Generator().manual_seed(seed)
+
+    epoch, samples_done, step, history = 0, 0, 0, []
+    if resume and os.path.isfile(checkpoint_path):
+        state = torch.load(checkpoint_path, map_location=device, weights_only=False)
+        model.load_state_dict(state["model"])
+        optimizer.load_state_dict(state["optimizer"])
+        scheduler.load_state_dict(state["scheduler"])
+        scaler.load_state_dict(state["scaler"])
+        augment_generator.set_state(state["augment_rng"])
+        epoch, samples_done, step, history = state["epoch"], state["samples_done"], state["step"], state["history"]
+        logger.info("Resuming from %s at epoch %d, sample %d, step %d", checkpoint_path, epoch, samples_done, step)
+
+    def checkpoint():
+        _save_checkpoint(checkpoint_path, {
+            "model": model.state_dict(), "optimizer": optimizer.state_dict(), "scheduler": scheduler.state_dict(),
+            "scaler": scaler.state_dict(), "augment_rng": augment_generator.get_state(), "epoch": epoch,
+            "samples_done": samples_done, "step": step, "history": history,
+        })
+
+    logger.info("Training %d/%d parameters on %d images (%s, autocast %s, effective batch %d)",
+                sum(p.numel() for p in parameters), sum(p.numel() for p in model.parameters()), len(train_set),
+                device, dtype, batch_size * accumulation_steps)
+    while epoch < epochs:
+        model.train()
+        sampler.set_epoch(epoch, start=samples_done)
+        window_start, window_images, window_loss, micro = time.perf_counter(), 0, 0.0, 0
+        optimizer.zero_grad(set_to_none=True)
+        for images, labels in train_loader:
+            samples_done += batch_size
+            if len(labels):
+                pixel_values = preprocessor.normalize(augment_batch(images, augment_generator)).to(device)
+                labels = labels.to(device)
+                with torch.autocast(device_type=device, dtype=dtype or torch.float32, enabled=dtype is not None):
+                    logits = model(pixel_values=pixel_values).logits
+                if loss_fn is None:
+                    loss = torch.nn.functional.cross_entropy(logits.float(), labels)
+                else:
+                    loss = loss_fn(logits.float(), labels, pixel_values)
+                scaler.scale(loss / accumulation_steps).backward()
+                window_loss += loss.item() * len(labels)
+                window_images += len(labels)
+            micro += 1
+            if micro % accumulation_steps and samples_done < len(train_set):
+                continue
+            scaler.step(optimizer)
+            scaler.update()
+            scheduler.step()
+            optimizer.zero_grad(set_to_none=True)
+            step += 1
+            if step % log_every == 0 and window_images:
+                elapsed = time.perf_counter() - window_start
+                logger.info("epoch %d step %d loss %.4f lr %.2e %.1f images/sec", epoch, step,
+                            window_loss / window_images, scheduler.get_last_lr()[0], window_images / elapsed)
+                window_start, window_images, window_loss = time.perf_counter(), 0, 0.0
+            if checkpoint_every and step % checkpoint_every == 0:
+                checkpoint()
+        metrics = evaluate(model, val_loader, preprocessor, device, dtype) if val_loader else {}
+        history.append(dict(metrics, epoch=epoch, step=step))
+        logger.info("epoch %d done: %s", epoch, metrics)
+        epoch, samples_done = epoch + 1, 0
+        checkpoint()
+
+    model.eval()
+    info = write_snapshot(model.cpu(), processor, output, model_name or output,
+                          time.strftime("finetuned-%Y%m%dT%H%M%S"), training={"epochs": epochs, "history": history})
+    shutil.rmtree(checkpoint_dir, ignore_errors=True)  # Optimizer state is several times the model's size
+    logger.info("Fine-tuned model written to %s", output)
+    return info
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fine-tune the plant disease ViT on a class-per-folder dataset.")
+    parser.add_argument("--data-dir", default="data/PlantVillage")
+    parser.add_argument("--packed", default=None, help="Packed dataset directory (app.packed_dataset) to read instead")
+    parser.add_argument("--model", default="Akshay0706/Plant-Village-1-Epochs-Model")
+    parser.add_argument("--output", default="models/plant-village-vit-finetuned")
+    parser.add_argument("--epochs", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--accumulation-steps", type=int, default=1)
+    parser.add_argument("--lr", type=float, default=5e-5)
+    parser.add_argument("--weight-decay", type=float, default=0.01)
+    parser.add_argument("--warmup-steps", type=int, default=0)
+    parser.add_argument("--val-fraction", type=float, default=0.1)
+    parser.add_argument("--precision", choices=["auto", "fp32", "bf16"], default="auto")
+    parser.add_argument("--freeze-backbone", action="store_true", help="Train only the classification head")
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument("--prefetch", type=int, default=4, help="Batches queued per loader worker")
+    parser.add_argument("--checkpoint-every", type=int, default=200, help="Optimizer steps between checkpoints")
+    parser.add_argument("--checkpoint-dir", default=None, help="Where to keep the resumable checkpoint "
+                                                                 "(default: <output>.checkpoint)")
+    parser.add_argument("--no-resume", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    configure_logging()
+
+    processor = ViTImageProcessor.from_pretrained(args.model)
+    size = (processor.size["height"], processor.size["width"])
+    if args.packed:
+        from app.packed_dataset import PackedDataset
+
+        packed = PackedDataset(args.packed)
+        if (packed.height, packed.width) != size:
+            raise SystemExit(f"{args.packed} is packed at {packed.height}x{packed.width}, the model expects {size}")
+        classes = packed.classes
+        rows = [(row, packed.classes[label]) for row, label in enumerate(packed.labels)]
+        train_rows, val_rows = split_samples(rows, args.val_fraction, args.seed)
+        model = load_model(args.model, classes, args.freeze_backbone)
+        train_set = PackedSubset(packed, [row for row, _ in train_rows], model.config.label2id)
+        val_set = PackedSubset(packed, [row for row, _ in val_rows], model.config.label2id)
+    else:
+        samples = load_labelled_images(args.data_dir)
+        classes = sorted({name for _, name in samples})
+        train_samples, val_samples = split_samples(samples, args.val_fraction, args.seed)
+        model = load_model(args.model, classes, args.freeze_backbone)
+        train_set = FolderDataset(train_samples, model.config.label2id, size)
+        val_set = FolderDataset(val_samples, model.config.label2id, size)
+
+    info = train(model, processor, train_set, val_set, args.output, epochs=args.epochs, batch_size=args.batch_size,
+                 accumulation_steps=args.accumulation_steps, lr=args.lr, weight_decay=args.weight_decay,
+                 warmup_steps=args.warmup_steps, precision=args.precision, workers=args.workers,
+                 prefetch=args.prefetch, checkpoint_every=args.checkpoint_every, resume=not args.no_resume,
+                 seed=args.seed, model_name=args.model, checkpoint_dir=args.checkpoint_dir)
+    final = info["training"]["history"][-1] if info["training"]["history"] else {}
+    print(f"[RESULT] {args.output}: validation top-1 {final.get('top1', float('nan')):.4f} after {args.epochs} epoch(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+# worker_pool.py
+
+import argparse
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+import torch
+
+from app.config import INFERENCE_PRECISION, INFERENCE_WORKERS
+from app.instrumentation import configure_logging
+from app.plant_health_service import PlantHealthService
+from app.precision import input_dtype_for
+from app.preprocessing import decode_image
+
+logger = logging.getLogger(__name__)
+
+
+def partition_cores(num_workers, cores=None):
+    """
+    Splits the CPUs this process may run on into num_workers disjoint, contiguous core sets.
+    """
+    cores = sorted(cores if cores is not None else os.sched_getaffinity(0))
+    if num_workers > len(cores):
+        # More workers than cores: share cores round-robin rather than leaving workers unpinned
+        return [[cores[i % len(cores)]] for i in range(num_workers)]
+    size, extra = divmod(len(cores), num_workers)
+    sets, start = [], 0
+    for i in range(num_workers):
+        end = start + size + (1 if i < extra else 0)
+        sets.append(cores[start:end])
+        start = end
+    return sets
+
+
+def _worker_main(worker_id, cores, num_threads, service_kwargs, tasks, results, max_batch_size, parent_service=None):
+    """
+    Worker loop: pin to its cores, get a service replica, then serve batches from the shared task queue.
+    parent_service is the parent's loaded service in fork-after-load mode: fork hands Process
+    arguments to the child without pickling, so its weight pages are shared copy-on-write.
+    A failure before the first batch is reported as ("failed", worker_id, message).
+    """
+    try:
+        os.sched_setaffinity(0, cores)
+        torch.set_num_threads(num_threads)
+        # Otherwise a memory-mapped snapshot, shared via the page cache
+        service = parent_service if parent_service is not None else PlantHealthService(**service_kwargs)
+        size = (service.preprocessor.height, service.preprocessor.width)
+        with torch.no_grad():
+            service.runner(torch.zeros(1, 3, *size, device=service.device, dtype=input_dtype_for(service.precision)))
+    except Exception as e:
+        results.put(("failed", worker_id, f"{type(e).__name__}: {e}"))
+        return
+    results.put(("ready", worker_id, service.model_version))
+
+    stopping = False
+    while not stopping:
+        item = tasks.get()
+        batch = []
+        while item is not None:
+            batch.append(item)
+            if len(batch) >= max_batch_size:
+                break
+            try:
+                item = tasks.get_nowait()
+            except queue.Empty:
+                break
+        # Consume exactly one shutdown sentinel, leaving the others for the remaining workers
+        stopping = item is None
+        if batch:
+            # Lets the parent fail these tasks if this process dies while running them
+            results.put(("taken", worker_id, [task_id for task_id, _, _ in batch]))
+        ids, images = [], []
+        for task_id, kind, payload in batch:
+            try:
+                image = decode_image(payload, target_size=size) if kind == "bytes" else payload
+            except Exception as e:
+                results.put((task_id, False, f"Could not load image: {e}"))
+                continue
+            ids.append(task_id)
+            images.append(image)
+        if not images:
+            continue
+        try:
+            for task_id, result in zip(ids, service.predict_batch(images)):
+                results.put((task_id, True, result))
+        except Exception as e:
+            for task_id in ids:
+                results.put((task_id, False, str(e)))
+
+
+class InferenceWorkerPool:
+    def __init__(self, num_workers=INFERENCE_WORKERS, threads_per_worker=None, max_batch_size=8, startup_timeout=600.0,
+                 **service_kwargs):
+        """
+        Runs num_workers processes, each with its own PlantHealthService replica pinned to a
+        disjoint set of cores, all fed from one task queue.
+
+        Weights are shared read-only between the workers:
+        - with snapshot_dir set, every worker memory-maps the same warm-start artifact;
+        - otherwise the parent loads the fp32 model once and forks the workers after loading
+          (the parent never runs a forward pass, so no thread pool state is forked). Reduced
+          precision needs snapshot_dir; without it the pool serves fp32.
+        threads_per_worker defaults to the size of each worker's core set.
+        Raises RuntimeError if a worker fails or exits while starting, or if the workers are not
+        all ready within startup_timeout seconds. A worker that dies later fails the requests
+        it was running; the others keep serving. Once none is left, every request fails at once.
+        """
+        self.num_workers = num_workers
+        self.core_sets = partition_cores(num_workers)
+        self._tasks = None
+        self._ids = itertools.count()
+        self._pending = {}
+        self._assigned = {}  # worker id -> ids of the tasks it is running
+        self._lock = threading.Lock()
+        self._closed = False
+        self._stopping = False
+        self._all_dead = False  # Set once every worker has exited; later submits fail immediately
+        self.model_version = None  # "<model name>@<revision>" as reported by the workers
+
+        parent_service = None
+        if service_kwargs.get("snapshot_dir"):
+            context = multiprocessing.get_context("spawn")
+            service_kwargs.setdefault("mmap_weights", True)
+        else:
+            context = multiprocessing.get_context("fork")
+            precision = service_kwargs.get("precision", INFERENCE_PRECISION)
+            if precision != "fp32":
+                logger.warning("Fork-after-load workers share the parent's fp32 weights, serving fp32 instead of %s; "
+                               "pass snapshot_dir for reduced precision", precision)
+            parent_service = PlantHealthService(**dict(service_kwargs, lazy=True, warmup=False, precision="fp32"))
+            parent_service._load()
+        self._tasks = context.Queue()
+        self._results = context.Queue()
+        self._workers = []
+        for worker_id, cores in enumerate(self.core_sets):
+            process = context.Process(
+                target=_worker_main,
+                args=(worker_id, cores, threads_per_worker or len(cores), service_kwargs,
+                      self._tasks, self._results, max_batch_size, parent_service),
+                daemon=True,
+            )
+            process.start()
+            self._workers.append(process)
+        try:
+            self._wait_ready(startup_timeout)
+        except Exception:
+            for process in self._workers:
+                process.kill()
+                process.join()
+            raise
+        self._collector = threading.Thread(target=self._collect, name="InferenceWorkerPool", daemon=True)
+        self._collector.start()
+        logger.info("Worker pool ready: %d worker(s) on cores %s", num_workers, self.core_sets)
+
+    def _wait_ready(self, timeout):
+        """
+        Blocks until every replica is loaded and warmed up, polling so a worker that crashes
+        while starting is noticed instead of waited for.
+        """
+        deadline = time.monotonic() + timeout
+        ready = 0
+        while ready < self.num_workers:
+            try:
+                kind, worker_id, message = self._results.get(timeout=0.5)
+            except queue.Empty:
+                dead = [(i, p.exitcode) for i, p in enumerate(self._workers) if p.exitcode is not None]
+                if dead:
+                    raise RuntimeError(f"Worker {dead[0][0]} exited with code {dead[0][1]} while starting")
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"{self.num_workers - ready} worker(s) not ready after {timeout:.0f}s")
+                continue
+            if kind == "failed":
+                raise RuntimeError(f"Worker {worker_id} failed to start: {message}")
+            if kind == "ready":
+                ready += 1
+                self.model_version = message
+
+    def _submit(self, kind, payload):
+        if self._closed:
+            raise RuntimeError("InferenceWorkerPool is closed")
+        future = Future()
+        task_id = next(self._ids)
+        with self._lock:
+            if self._all_dead:
+                raise RuntimeError("Every inference worker has exited")
+            self._pending[task_id] = future
+        self._tasks.put((task_id, kind, payload))
+        return future
+
+    def submit(self, image):
+        """
+        Queues a PIL image (sent as an RGB uint8 array) and returns a Future of its result dict.
+        """
+        return self._submit("array", np.asarray(image.convert("RGB")))
+
+    def submit_bytes(self, image_bytes):
+        """
+        Queues encoded image bytes; decoding happens in the worker process.
+        """
+        return self._submit("bytes", bytes(image_bytes))
+
+    def predict(self, image, timeout=None):
+        return self.submit(image).result(timeout=timeout)
+
+    def predict_bytes(self, image_bytes, timeout=None):
+        return self.submit_bytes(image_bytes).result(timeout=timeout)
+
+    def predict_batch(self, images, timeout=None):
+        futures = [self.submit(image) for image in images]
+        return [future.result(timeout=timeout) for future in futures]
+
+    def _collect(self):
+        alive = set(range(len(self._workers)))
+        next_check = time.monotonic() + 1.0
+        while True:
+            if time.monotonic() > next_check:
+                next_check = time.monotonic() + 1.0
+                if not self._closed:
+                    alive -= self._fail_dead_workers(alive)
+            try:
+                item = self._results.get(timeout=0.1 if self._stopping else 1.0)
+            except queue.Empty:
+                if self._stopping:
+                    break
+                continue
+            task_id, ok, payload = item
+            if task_id == "taken":
+                self._assigned[ok] = set(payload)
+                continue
+            for assigned in self._assigned.values():
+                assigned.discard(task_id)
+            with self._lock:
+                future = self._pending.pop(task_id, None)
+            if future is None:
+                continue
+            if ok:
+                future.set_result(payload)
+            else:
+                future.set_exception(RuntimeError(payload))
+
+    def _fail_dead_workers(self, alive):
+        """
+        Fails the tasks of workers that exited; with no worker left, fails everything pending
+        and makes later submits raise. Returns the ids of the newly dead workers.
+        """
+        dead = {i for i in alive if self._workers[i].exitcode is not None}
+        for worker_id in dead:
+            code = self._workers[worker_id].exitcode
+            logger.error("Inference worker %d exited with code %s", worker_id, code)
+            with self._lock:
+                futures = [self._pending.pop(task_id, None) for task_id in self._assigned.pop(worker_id, ())]
+            for future in futures:
+                if future is not None:
+                    future.set_exception(RuntimeError(f"Inference worker {worker_id} exited with code {code}"))
+        if dead and not alive - dead:
+            with self._lock:
+                self._all_dead = True
+                futures, self._pending = list(self._pending.values()), {}
+            for future in futures:
+                future.set_exception(RuntimeError("Every inference worker has exited"))
+        return dead
+
+    def close(self):
+        """
+        Lets the workers finish queued work, then stops them and fails anything left over.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        for _ in self._workers:
+            self._tasks.put(None)
+        for process in self._workers:
+            process.join()
+        # The workers are gone, so nothing will read what is still queued for them; a worker killed mid-write may
+        # also have left the results queue locked, so the collector drains until empty instead of waiting on a sentinel
+        self._tasks.cancel_join_thread()
+        self._stopping = True
+        self._collector.join()
+        with self._lock:
+            for future in self._pending.values():
+                future.set_exception(RuntimeError("InferenceWorkerPool closed before the request completed"))
+            self._pending.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure worker pool throughput for increasing worker counts.")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--images", type=int, default=256)
+    parser.add_argument("--model", default="Akshay0706/Plant-Village-1-Epochs-Model")
+    parser.add_argument("--snapshot-dir", default=None)
+    args = parser.parse_args()
+    configure_logging()
+
+    from app.model_store import process_pss_mb
+    from app.precision import holdout_slice
+
+    paths = holdout_slice(per_class=max(1, args.images // 15 + 1))[:args.images]
+    payloads = []
+    for path in paths:
+        with open(path, "rb") as f:
+            payloads.append(f.read())
+    for num_workers in args.workers:
+        with InferenceWorkerPool(num_workers, model_name=args.model, snapshot_dir=args.snapshot_dir) as pool:
+            start = time.perf_counter()
+            futures = [pool.submit_bytes(payload) for payload in payloads]
+            for future in futures:
+                future.result()
+            elapsed = time.perf_counter() - start
+            # PSS splits shared (memory-mapped / copy-on-write) pages between the processes using them
+            pss = sum(process_pss_mb(p.pid) for p in pool._workers) + process_pss_mb()
+            print(f"[RESULT] {num_workers} worker(s): {len(payloads) / elapsed:.1f} images/sec, "
+                  f"total PSS {pss:.0f} MB")
+
+
+
+if __name__ == "__main__":
+    main()
@@ -31,6 +31,13 @@ engine = create_engine(
     pool_timeout=30  # Timeout in seconds for getting a connection from the pool
 )
 
+# Write-behind persistence (see database/persistence.py)
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv('WRITE_BEHIND_BATCH_SIZE', '500'))  # Analyses per multi-row insert
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv('WRITE_BEHIND_FLUSH_INTERVAL', '1.0'))  # Max seconds a record waits
+WRITE_BEHIND_MAX_BUFFER = int(os.getenv('WRITE_BEHIND_MAX_BUFFER', '10000'))  # submit() blocks beyond this
+WRITE_BEHIND_SPILL_PATH = os.getenv('WRITE_BEHIND_SPILL_PATH', 'prediction_spill.jsonl')
+WRITE_BEHIND_DEAD_LETTER_PATH = os.getenv('WRITE_BEHIND_DEAD_LETTER_PATH', 'prediction_dead_letter.jsonl')
+
 # Create session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
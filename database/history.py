@@ -0,0 +1,215 @@
+"""
+Read-optimized analysis history queries.
+A history page is one joined SELECT (analysis_history -> images, predictions) paginated by keyset
+on (user_id, timestamp, id) instead of OFFSET, so every page costs the same index range scan on
+ix_analysis_history_user_timestamp_id no matter how deep the user scrolls, and no relationship is
+lazy-loaded per row. analysis_history.timestamp is nullable, but every row written through the
+models gets one by default; a row without one has no place in the keyset order and is left out.
+
+Run as a module to benchmark it on a synthetic table:
+    python -m database.history --rows 2000000
+"""
+
+import argparse
+import base64
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import Index, MetaData, create_engine, func, insert, select, text, tuple_
+
+from .models.models import AnalysisHistory, Base, Image, Prediction, User
+
+
+def encode_cursor(timestamp, history_id):
+    """
+    Opaque cursor pointing just past (timestamp, history_id) in the descending history order.
+    """
+    payload = json.dumps({"ts": timestamp.isoformat(), "id": history_id}).encode()
+    return base64.urlsafe_b64encode(payload).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(payload["ts"]), int(payload["id"])
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"Invalid history cursor: {cursor!r}") from e
+
+
+def history_query(user_id, limit=20, cursor=None):
+    """
+    Builds the SELECT for one page, newest first. user_id=None selects anonymous analyses.
+    Fetches limit + 1 rows so the caller can tell whether another page exists.
+    Rows with a NULL timestamp are excluded: they cannot be ordered or encoded in a cursor.
+    """
+    query = (
+        select(
+            AnalysisHistory.id,
+            AnalysisHistory.timestamp,
+            Image.id.label("image_id"),
+            Image.filename,
+            Image.file_path,
+            Prediction.id.label("prediction_id"),
+            Prediction.prediction_type,
+            Prediction.confidence_score,
+            Prediction.result_data,
+        )
+        .join(Image, Image.id == AnalysisHistory.image_id)
+        .join(Prediction, Prediction.id == AnalysisHistory.prediction_id)
+        .where(AnalysisHistory.user_id.is_(None) if user_id is None else AnalysisHistory.user_id == user_id)
+        .where(AnalysisHistory.timestamp.is_not(None))
+        .order_by(AnalysisHistory.timestamp.desc(), AnalysisHistory.id.desc())
+        .limit(limit + 1)
+    )
+    if cursor is not None:
+        timestamp, history_id = decode_cursor(cursor)
+        # Row-value comparison, so the planner seeks straight into the composite index
+        query = query.where(tuple_(AnalysisHistory.timestamp, AnalysisHistory.id) < tuple_(timestamp, history_id))
+    return query
+
+
+def get_history(connection, user_id, limit=20, cursor=None):
+    """
+    Returns (items, next_cursor) for one page of a user's analysis history.
+    connection may be a SQLAlchemy Connection or Session. next_cursor is None on the last page.
+    """
+    rows = connection.execute(history_query(user_id, limit, cursor)).mappings().all()
+    items = [dict(row) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = items[-1]
+        next_cursor = encode_cursor(last["timestamp"], last["id"])
+    return items, next_cursor
+
+
+def offset_history_query(user_id, limit=20, offset=0):
+    """
+    The OFFSET equivalent of history_query(), kept for the benchmark comparison only.
+    """
+    return history_query(user_id, limit).limit(limit).offset(offset)
+
+
+def populate_synthetic(engine, rows, users=1000, batch_size=50000, seed=0):
+    """
+    Fills an empty schema with rows analyses spread over users (plus anonymous ones),
+    one image and one prediction each, with explicit ids so inserts need no RETURNING.
+    On PostgreSQL the id sequences are then advanced past them, so later inserts still work.
+    """
+    rng = random.Random(seed)
+    labels = ["Tomato_healthy", "Tomato_Late_blight", "Potato___Early_blight", "Pepper__bell___healthy"]
+    start = datetime(2024, 1, 1)
+    with engine.begin() as connection:
+        connection.execute(insert(User), [
+            {"id": i, "username": f"user{i}", "email": f"user{i}@example.com", "password_hash": "x",
+             "created_at": start, "updated_at": start}
+            for i in range(1, users + 1)
+        ])
+    for batch_start in range(1, rows + 1, batch_size):
+        ids = range(batch_start, min(rows + 1, batch_start + batch_size))
+        images, predictions, history = [], [], []
+        for i in ids:
+            user_id = rng.randint(1, users) if rng.random() > 0.05 else None
+            timestamp = start + timedelta(seconds=rng.randint(0, 365 * 24 * 3600))
+            label = rng.choice(labels)
+            confidence = rng.random()
+            images.append({"id": i, "user_id": user_id, "filename": f"{i}.jpg", "file_path": f"uploads/{i}.jpg",
+                           "upload_date": timestamp, "created_at": timestamp, "image_metadata": None})
+            predictions.append({"id": i, "image_id": i, "prediction_type": "disease", "confidence_score": confidence,
+                                "result_data": {"predicted_label": label, "confidence": confidence},
+                                "created_at": timestamp})
+            history.append({"id": i, "user_id": user_id, "image_id": i, "prediction_id": i, "timestamp": timestamp})
+        with engine.begin() as connection:
+            connection.execute(insert(Image), images)
+            connection.execute(insert(Prediction), predictions)
+            connection.execute(insert(AnalysisHistory), history)
+    if engine.dialect.name == "postgresql":
+        with engine.begin() as connection:
+            for model in (User, Image, Prediction, AnalysisHistory):
+                table = model.__tablename__
+                connection.execute(text(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT max(id) FROM {table}))"))
+
+
+def _time_ms(fn, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return sorted(timings)[len(timings) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark history pagination on a synthetic analysis table.")
+    parser.add_argument("--url", default=None, help="Database URL (default: a temporary SQLite file)")
+    parser.add_argument("--drop", action="store_true",
+                        help="Confirm that every table at --url may be dropped and recreated")
+    parser.add_argument("--rows", type=int, default=2000000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--page-size", type=int, default=20)
+    parser.add_argument("--depth", type=int, default=50, help="Pages to scroll for the deep-page comparison")
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+    if args.url and not args.drop:
+        parser.error("the benchmark drops and recreates every table at --url; pass --drop to confirm")
+
+    url = args.url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'history_benchmark.db')}"
+    engine = create_engine(url)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    print(f"[INFO] Generating {args.rows} synthetic analyses in {url}...")
+    start = time.perf_counter()
+    populate_synthetic(engine, args.rows, users=args.users)
+    print(f"[INFO] Generated in {time.perf_counter() - start:.1f}s")
+
+    with engine.connect() as connection:
+        # The busiest user is the worst case for deep pages
+        user_id = connection.execute(
+            select(AnalysisHistory.user_id).where(AnalysisHistory.user_id.is_not(None))
+            .group_by(AnalysisHistory.user_id)
+            .order_by(func.count().desc())
+            .limit(1)
+        ).scalar() or 1
+        cursor = None
+        for _ in range(args.depth):
+            _, next_cursor = get_history(connection, user_id, args.page_size, cursor)
+            if next_cursor is None:
+                break  # Fewer than depth pages: benchmark the last one
+            cursor = next_cursor
+
+        def measure():
+            return {
+                "first page": _time_ms(lambda: get_history(connection, user_id, args.page_size), args.repeats),
+                f"page {args.depth + 1} (keyset)": _time_ms(
+                    lambda: get_history(connection, user_id, args.page_size, cursor), args.repeats),
+                f"page {args.depth + 1} (OFFSET)": _time_ms(lambda: connection.execute(
+                    offset_history_query(user_id, args.page_size, args.depth * args.page_size)).all(), args.repeats),
+                "anonymous first page": _time_ms(lambda: get_history(connection, None, args.page_size), args.repeats),
+            }
+
+        indexed = measure()
+        # Same queries with only the single-column user_id index, i.e. the pre-002 access path
+        composite = next(index for index in AnalysisHistory.__table__.indexes
+                         if index.name == "ix_analysis_history_user_timestamp_id")
+        composite.drop(connection)
+        # Declared on a detached copy of the table so the shared metadata never gains this index
+        detached = AnalysisHistory.__table__.to_metadata(MetaData())
+        user_only = Index("ix_analysis_history_user_id_only", detached.c.user_id)
+        user_only.create(connection)
+        connection.commit()
+        unindexed = measure()
+        user_only.drop(connection)
+        composite.create(connection)
+        connection.commit()
+    print(f"[RESULT] user {user_id}, {args.page_size} rows per page, median of {args.repeats} (ms)")
+    print(f"[RESULT] {'query':<24} {'composite index':>16} {'user_id index':>14}")
+    for name in indexed:
+        print(f"[RESULT] {name:<24} {indexed[name]:16.2f} {unindexed[name]:14.2f}")
+
+
+if __name__ == "__main__":
+    main()
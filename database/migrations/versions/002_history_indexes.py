@@ -0,0 +1,40 @@
+"""Indexes for analysis history queries
+
+Revision ID: 002
+Revises: 9334f60df61c
+Create Date: 2026-10-18
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic
+revision = '002'
+down_revision = '9334f60df61c'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    """Add the keyset-pagination index for history pages and restore the foreign key indexes."""
+
+    # Composite index matching WHERE user_id = ? ORDER BY timestamp DESC, id DESC;
+    # INCLUDE makes it covering for the ids joined to images and predictions (PostgreSQL 11+)
+    op.create_index(
+        'ix_analysis_history_user_timestamp_id',
+        'analysis_history',
+        ['user_id', 'timestamp', 'id'],
+        unique=False,
+        postgresql_include=['image_id', 'prediction_id'],
+    )
+
+    # Foreign key indexes (dropped by 9334f60df61c), needed for cascading deletes and joins
+    op.create_index('ix_analysis_history_image_id', 'analysis_history', ['image_id'], unique=False)
+    op.create_index('ix_analysis_history_prediction_id', 'analysis_history', ['prediction_id'], unique=False)
+    op.create_index('ix_predictions_image_id', 'predictions', ['image_id'], unique=False)
+    op.create_index('ix_images_user_id', 'images', ['user_id'], unique=False)
+
+def downgrade() -> None:
+    """Drop the history indexes."""
+    op.drop_index('ix_images_user_id', table_name='images')
+    op.drop_index('ix_predictions_image_id', table_name='predictions')
+    op.drop_index('ix_analysis_history_prediction_id', table_name='analysis_history')
+    op.drop_index('ix_analysis_history_image_id', table_name='analysis_history')
+    op.drop_index('ix_analysis_history_user_timestamp_id', table_name='analysis_history')
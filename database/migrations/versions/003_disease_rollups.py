@@ -0,0 +1,45 @@
+"""Disease statistics rollup tables
+
+Revision ID: 003
+Revises: 002
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic
+revision = '003'
+down_revision = '002'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    """Create the rollup tables. Fill them for existing history with: python -m database.rollups rebuild"""
+
+    # Per scope (user id, 0 = anonymous, -1 = all users), day and label; the key order serves date-range reads
+    op.create_table(
+        'disease_daily_rollups',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('predicted_label', sa.String(length=255), nullable=False),
+        sa.Column('is_healthy', sa.Boolean(), nullable=False),
+        sa.Column('prediction_count', sa.Integer(), nullable=False),
+        sa.Column('confidence_sum', sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint('user_id', 'day', 'predicted_label')
+    )
+
+    # All-time totals per scope and label
+    op.create_table(
+        'disease_rollup_totals',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('predicted_label', sa.String(length=255), nullable=False),
+        sa.Column('is_healthy', sa.Boolean(), nullable=False),
+        sa.Column('prediction_count', sa.Integer(), nullable=False),
+        sa.Column('confidence_sum', sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint('user_id', 'predicted_label')
+    )
+
+def downgrade() -> None:
+    """Drop the rollup tables."""
+    op.drop_table('disease_rollup_totals')
+    op.drop_table('disease_daily_rollups')
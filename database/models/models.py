@@ -4,7 +4,7 @@ This file defines User, Image, Prediction, and AnalysisHistory tables with all r
 """
 
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, JSON
+from sqlalchemy import Column, Integer, String, Float, DateTime, Date, Boolean, ForeignKey, JSON, Index
 from sqlalchemy.orm import relationship, declarative_base
 
 # The declarative base is the foundation for all ORM models.
@@ -34,6 +34,9 @@ class Image(Base):
     Each image is linked to a user via user_id.
     """
     __tablename__ = 'images'
+    __table_args__ = (
+        Index('ix_images_user_id', 'user_id'),
+    )
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=True)  # Nullable for anonymous uploads
@@ -54,6 +57,9 @@ class Prediction(Base):
     Each prediction is linked to an image.
     """
     __tablename__ = 'predictions'
+    __table_args__ = (
+        Index('ix_predictions_image_id', 'image_id'),
+    )
 
     id = Column(Integer, primary_key=True)
     image_id = Column(Integer, ForeignKey('images.id'), nullable=False)
@@ -72,6 +78,15 @@ class AnalysisHistory(Base):
     Can be used for both authenticated and anonymous users.
     """
     __tablename__ = 'analysis_history'
+    __table_args__ = (
+        # Serves history pages (see database/history.py): equality on user_id, then the
+        # (timestamp, id) keyset order. On PostgreSQL the FK columns are carried in the leaf
+        # pages so the page of ids is an index-only scan before joining images/predictions.
+        Index('ix_analysis_history_user_timestamp_id', 'user_id', 'timestamp', 'id',
+              postgresql_include=['image_id', 'prediction_id']),
+        Index('ix_analysis_history_image_id', 'image_id'),
+        Index('ix_analysis_history_prediction_id', 'prediction_id'),
+    )
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=True)  # Nullable for anonymous users
@@ -82,4 +97,32 @@ class AnalysisHistory(Base):
     # Relationships
     user = relationship("User", back_populates="analysis_history")
     image = relationship("Image", back_populates="analysis_history")
-    prediction = relationship("Prediction", back_populates="analysis_history") 
\ No newline at end of file
+    prediction = relationship("Prediction", back_populates="analysis_history") 
+
+class DiseaseDailyRollup(Base):
+    """
+    DiseaseDailyRollup model: per-day prediction counts for one label and one scope.
+    Maintained incrementally by the prediction writer (see database/rollups.py).
+    user_id is a scope, not a foreign key: a user id, 0 for anonymous analyses or -1 for all users.
+    """
+    __tablename__ = 'disease_daily_rollups'
+
+    user_id = Column(Integer, primary_key=True)
+    day = Column(Date, primary_key=True)
+    predicted_label = Column(String(255), primary_key=True)
+    is_healthy = Column(Boolean, nullable=False)
+    prediction_count = Column(Integer, nullable=False, default=0)
+    confidence_sum = Column(Float, nullable=False, default=0.0)
+
+class DiseaseRollupTotal(Base):
+    """
+    DiseaseRollupTotal model: all-time prediction counts for one label and one scope,
+    so overall summaries read a handful of rows instead of summing every day.
+    """
+    __tablename__ = 'disease_rollup_totals'
+
+    user_id = Column(Integer, primary_key=True)
+    predicted_label = Column(String(255), primary_key=True)
+    is_healthy = Column(Boolean, nullable=False)
+    prediction_count = Column(Integer, nullable=False, default=0)
+    confidence_sum = Column(Float, nullable=False, default=0.0)
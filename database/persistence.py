@@ -0,0 +1,410 @@
+"""
+Write-behind persistence for predictions.
+Analyses are buffered in memory and written by a background thread in batches: one transaction
+per batch with one multi-row INSERT ... RETURNING per table, instead of three ORM round-trips
+per analysis. Callers only pay for a queue put, so inference latency never includes a commit.
+"""
+
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from sqlalchemy import insert, update
+from sqlalchemy.exc import DataError, DBAPIError, IntegrityError
+
+from .config import (
+    WRITE_BEHIND_BATCH_SIZE,
+    WRITE_BEHIND_DEAD_LETTER_PATH,
+    WRITE_BEHIND_FLUSH_INTERVAL,
+    WRITE_BEHIND_MAX_BUFFER,
+    WRITE_BEHIND_SPILL_PATH,
+)
+from .models.models import AnalysisHistory, Image, Prediction
+from .rollups import apply_records
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+_UPDATE_FILE_PATH = object()
+
+# Image.file_path of an image whose upload has not finished yet: the prefix plus its final URI,
+# so the location stays recoverable even if the update is lost
+PENDING_PREFIX = "pending:"
+
+
+def make_record(filename, file_path, result, user_id=None, image_metadata=None, prediction_type="disease",
+                timestamp=None, embedding=None):
+    """
+    Builds the buffered representation of one analysis from a PlantHealthService result dict.
+    """
+    return {
+        "embedding": embedding,
+        "filename": filename,
+        "file_path": file_path,
+        "user_id": user_id,
+        "image_metadata": image_metadata,
+        "prediction_type": prediction_type,
+        "result": result,
+        # The DateTime columns hold naive UTC
+        "timestamp": timestamp or datetime.now(timezone.utc).replace(tzinfo=None),
+    }
+
+
+def is_permanent(error):
+    """
+    True for failures caused by the records themselves (constraint violations, invalid values,
+    records that cannot even be bound), which no retry fixes. Connection and server errors
+    are transient.
+    """
+    if isinstance(error, (IntegrityError, DataError)):
+        return True
+    return not isinstance(error, DBAPIError)
+
+
+def _record_json(record, **extra):
+    embedding = record.get("embedding")
+    return json.dumps(dict(record, timestamp=record["timestamp"].isoformat(),
+                           embedding=None if embedding is None else [float(x) for x in embedding], **extra))
+
+
+def write_batch(connection, records):
+    """
+    Inserts images, predictions and analysis_history rows for a batch of records on an open
+    connection (the caller owns the transaction). Returns the new (image ids, prediction ids),
+    in record order.
+    sort_by_parameter_order guarantees RETURNING ids line up with the input rows, which the
+    foreign keys of the next table depend on. On PostgreSQL each statement is sent as batched
+    multi-row INSERT ... RETURNING; SQLite has no ordered-RETURNING support, so SQLAlchemy falls
+    back to one row per statement there (still inside the single batch transaction).
+    """
+    image_ids = connection.scalars(
+        insert(Image).returning(Image.id, sort_by_parameter_order=True),
+        [
+            {
+                "user_id": r["user_id"],
+                "filename": r["filename"],
+                "file_path": r["file_path"],
+                "image_metadata": r["image_metadata"],
+                "upload_date": r["timestamp"],
+                "created_at": r["timestamp"],
+            }
+            for r in records
+        ],
+    ).all()
+    prediction_ids = connection.scalars(
+        insert(Prediction).returning(Prediction.id, sort_by_parameter_order=True),
+        [
+            {
+                "image_id": image_id,
+                "prediction_type": r["prediction_type"],
+                "result_data": r["result"],
+                "confidence_score": r["result"]["confidence"],
+                "created_at": r["timestamp"],
+            }
+            for image_id, r in zip(image_ids, records)
+        ],
+    ).all()
+    connection.execute(
+        insert(AnalysisHistory),
+        [
+            {
+                "user_id": r["user_id"],
+                "image_id": image_id,
+                "prediction_id": prediction_id,
+                "timestamp": r["timestamp"],
+            }
+            for image_id, prediction_id, r in zip(image_ids, prediction_ids, records)
+        ],
+    )
+    return image_ids, prediction_ids
+
+
+class PredictionWriter:
+    """
+    Bounded, batched, background writer for analyses.
+
+    Delivery is at-least-once: a batch is retried with exponential backoff, so a short database
+    outage applies backpressure (submit() blocks once max_buffer records are waiting) instead
+    of losing data. After max_open_retries failed attempts (max_retries while closing) the
+    batch is appended to spill_path and the writer moves on; spilled records are written again
+    after the next successful batch, or first thing when the next writer starts.
+    A batch rejected for its data (is_permanent(), e.g. a foreign key violation) is not
+    retried: it is bisected until the offending records are isolated, those go to
+    dead_letter_path with their error and the rest are written.
+    A batch whose commit succeeded but whose acknowledgement was lost may be written twice.
+
+    Images still uploading are submitted with file_path = PENDING_PREFIX + final URI and resolved
+    with update_file_path() once stored. Updates travel through the same queue as the records,
+    so they are applied after the insert they refer to.
+
+    Records submitted with an embedding are appended to the `embeddings` store (an
+    app.embeddings.EmbeddingStore) once their transaction has committed, keyed by the new
+    image and prediction ids, so the vector index only ever points at persisted analyses.
+    """
+
+    def __init__(self, engine=None, batch_size=WRITE_BEHIND_BATCH_SIZE, flush_interval=WRITE_BEHIND_FLUSH_INTERVAL,
+                 max_buffer=WRITE_BEHIND_MAX_BUFFER, spill_path=WRITE_BEHIND_SPILL_PATH, max_retries=5,
+                 retry_backoff=0.2, max_backoff=5.0, rollups=True, embeddings=None, max_open_retries=30,
+                 dead_letter_path=WRITE_BEHIND_DEAD_LETTER_PATH):
+        """
+        engine defaults to the application engine from database/config.py; pass a SQLite engine
+        (with Base.metadata.create_all) to run locally. With rollups=True each batch also
+        updates the disease statistics rollups (database/rollups.py) in the same transaction.
+        """
+        if engine is None:
+            from .config import engine
+        self.engine = engine
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spill_path = spill_path
+        self.max_retries = max_retries
+        self.max_open_retries = max_open_retries
+        self.dead_letter_path = dead_letter_path
+        self._replay_due = False
+        self._replaying = False
+        self.retry_backoff = retry_backoff
+        self.max_backoff = max_backoff
+        self.rollups = rollups
+        self.embeddings = embeddings
+        self._queue = queue.Queue(maxsize=max_buffer)
+        self._closing = threading.Event()
+        self._closed = False
+        self._image_ids = OrderedDict()  # Pending file_path -> image id of recently written records
+        self._stats = {"submitted": 0, "written": 0, "batches": 0, "failed_attempts": 0, "spilled": 0,
+                       "dead_lettered": 0, "file_paths_updated": 0, "embeddings": 0}
+        self._stats_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="PredictionWriter", daemon=True)
+        self._thread.start()
+
+    def submit(self, filename, file_path, result, user_id=None, image_metadata=None, prediction_type="disease",
+               timestamp=None, timeout=None, embedding=None):
+        """
+        Buffers one analysis for writing. Blocks while the buffer is full (raises queue.Full
+        after timeout seconds, if given). embedding is only kept with an embedding store.
+        """
+        if self._closed:
+            raise RuntimeError("PredictionWriter is closed")
+        record = make_record(filename, file_path, result, user_id=user_id, image_metadata=image_metadata,
+                             prediction_type=prediction_type, timestamp=timestamp,
+                             embedding=embedding if self.embeddings is not None else None)
+        self._queue.put(record, timeout=timeout)
+        with self._stats_lock:
+            self._stats["submitted"] += 1
+
+    def update_file_path(self, pending_path, file_path):
+        """
+        Replaces a submitted record's pending file_path once its upload has finished.
+        """
+        self._queue.put((_UPDATE_FILE_PATH, pending_path, file_path))
+
+    def flush(self, timeout=None):
+        """
+        Blocks until every record submitted before this call has been committed (or spilled).
+        Returns False on timeout.
+        """
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout=None):
+        """
+        Stops accepting records, writes everything still buffered and stops the thread.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._closing.set()
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def stats(self):
+        with self._stats_lock:
+            return dict(self._stats, buffered=self._queue.qsize())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _run(self):
+        self._replay_spill()
+        pending, updates, waiters, deadline = [], [], [], None
+        stopping = False
+        while not stopping:
+            timeout = None if not (pending or updates) else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None  # The oldest pending record has waited flush_interval
+            if item is _STOP:
+                stopping = True
+            elif isinstance(item, threading.Event):
+                waiters.append(item)
+            elif item is not None:
+                if not (pending or updates):
+                    deadline = time.monotonic() + self.flush_interval
+                if isinstance(item, tuple) and item[0] is _UPDATE_FILE_PATH:
+                    # Still buffered: fix the record itself instead of issuing an UPDATE later
+                    record = next((r for r in pending if r["file_path"] == item[1]), None)
+                    if record is not None:
+                        record["file_path"] = item[2]
+                    else:
+                        updates.append(item[1:])
+                else:
+                    pending.append(item)
+            if (pending or updates) and (len(pending) >= self.batch_size or waiters or stopping
+                                         or time.monotonic() >= deadline):
+                self._write_with_retry(pending, updates)
+                pending, updates = [], []
+            for waiter in waiters:
+                waiter.set()
+            waiters = []
+
+    def _write_with_retry(self, records, updates=()):
+        attempt = 0
+        while True:
+            try:
+                with self.engine.begin() as connection:
+                    image_ids, prediction_ids = write_batch(connection, records) if records else ([], [])
+                    if self.rollups and records:
+                        apply_records(connection, records)
+                    self._apply_file_path_updates(connection, updates)
+            except Exception as e:
+                if is_permanent(e):
+                    return self._set_aside(records, updates, e)
+                attempt += 1
+                with self._stats_lock:
+                    self._stats["failed_attempts"] += 1
+                if attempt > (self.max_retries if self._closing.is_set() else self.max_open_retries):
+                    self._spill(records, e)
+                    if updates:
+                        logger.error("Could not apply %d file_path updates, those images keep their %s paths",
+                                     len(updates), PENDING_PREFIX)
+                    return False
+                delay = min(self.max_backoff, self.retry_backoff * 2 ** (attempt - 1))
+                logger.warning("Writing %d analyses failed (attempt %d), retrying in %.1fs: %s",
+                               len(records), attempt, delay, e)
+                time.sleep(delay)
+                continue
+            for record, image_id in zip(records, image_ids):
+                if record["file_path"].startswith(PENDING_PREFIX):
+                    self._image_ids[record["file_path"]] = image_id
+                    if len(self._image_ids) > 100000:
+                        self._image_ids.popitem(last=False)
+            for pending_path, _ in updates:
+                self._image_ids.pop(pending_path, None)
+            self._add_embeddings(records, image_ids, prediction_ids)
+            with self._stats_lock:
+                self._stats["written"] += len(records)
+                self._stats["batches"] += len(records) > 0
+                self._stats["file_paths_updated"] += len(updates)
+            if self._replay_due and not self._replaying and not self._closing.is_set():
+                # The database is back: retry what an earlier outage spilled
+                self._replay_due = False
+                self._replay_spill()
+            return True
+
+    def _set_aside(self, records, updates, error):
+        """
+        Handles a batch rejected for its data: bisects it until the offending records are
+        isolated, dead-letters those and writes the rest, then applies the updates on their own.
+        """
+        ok = False
+        if len(records) > 1:
+            middle = len(records) // 2
+            first = self._write_with_retry(records[:middle])
+            ok = self._write_with_retry(records[middle:]) and first
+        elif records:
+            self._dead_letter(records[0], error)
+        if updates:
+            if records:
+                ok = self._write_with_retry([], updates) and ok
+            else:
+                logger.error("Dropping %d file_path updates the database rejects: %s", len(updates), error)
+        return ok
+
+    def _dead_letter(self, record, error):
+        with self._stats_lock:
+            self._stats["dead_lettered"] += 1
+        if not self.dead_letter_path:
+            logger.error("Dropping analysis of %s the database rejects, no dead_letter_path is set: %s",
+                         record["filename"], error)
+            return
+        with open(self.dead_letter_path, "a") as f:
+            f.write(_record_json(record, error=str(error)) + "\n")
+        logger.error("Analysis of %s rejected by the database, written to %s: %s", record["filename"],
+                     self.dead_letter_path, error)
+
+    def _add_embeddings(self, records, image_ids, prediction_ids):
+        rows = [(r, image_id, prediction_id) for r, image_id, prediction_id in zip(records, image_ids, prediction_ids)
+                if r.get("embedding") is not None]
+        if self.embeddings is None or not rows:
+            return
+        try:
+            self.embeddings.add([r["embedding"] for r, _, _ in rows], [image_id for _, image_id, _ in rows],
+                                [prediction_id for _, _, prediction_id in rows],
+                                [r["result"]["predicted_class_index"] for r, _, _ in rows],
+                                [r["result"]["confidence"] for r, _, _ in rows])
+        except Exception as e:
+            # The analyses are committed; only their similarity lookups are lost
+            logger.error("Could not store %d embeddings: %s", len(rows), e)
+            return
+        with self._stats_lock:
+            self._stats["embeddings"] += len(rows)
+
+    def _apply_file_path_updates(self, connection, updates):
+        for pending_path, file_path in updates:
+            image_id = self._image_ids.get(pending_path)
+            if image_id is not None:
+                statement = update(Image).where(Image.id == image_id)
+            else:
+                # Written by an earlier writer (e.g. replayed from the spill file): match by path
+                statement = update(Image).where(Image.file_path == pending_path)
+            connection.execute(statement.values(file_path=file_path))
+
+    def _spill(self, records, error):
+        if not self.spill_path:
+            logger.error("Dropping %d analyses, the database is unavailable and no spill_path is set: %s",
+                         len(records), error)
+            return
+        with open(self.spill_path, "a") as f:
+            for record in records:
+                f.write(_record_json(record) + "\n")
+        with self._stats_lock:
+            self._stats["spilled"] += len(records)
+        self._replay_due = True
+        logger.error("Database unavailable, spilled %d analyses to %s: %s", len(records), self.spill_path, error)
+
+    def _replay_spill(self):
+        """
+        Writes records left in spill_path by a previous writer or an earlier outage; records
+        that fail again are spilled to a fresh spill_path.
+        """
+        if not self.spill_path:
+            return
+        # New spills during replay go to a fresh file; a replay interrupted by a crash is picked up again
+        replay_path = self.spill_path + ".replaying"
+        if os.path.isfile(self.spill_path):
+            with open(self.spill_path) as src, open(replay_path, "a") as dst:
+                dst.write(src.read())
+            os.remove(self.spill_path)
+        if not os.path.isfile(replay_path):
+            return
+        with open(replay_path) as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        for record in records:
+            record["timestamp"] = datetime.fromisoformat(record["timestamp"])
+        self._replaying = True
+        try:
+            for start in range(0, len(records), self.batch_size):
+                self._write_with_retry(records[start:start + self.batch_size])
+        finally:
+            self._replaying = False
+        os.remove(replay_path)
+        logger.info("Replayed %d spilled analyses from %s", len(records), self.spill_path)
@@ -0,0 +1,208 @@
+"""
+Incrementally maintained disease statistics.
+Every batch the prediction writer commits also upserts its per-day and all-time counts into
+disease_daily_rollups and disease_rollup_totals, in the same transaction. Dashboards read those
+small tables instead of scanning predictions.result_data, so the cost of a query depends on the
+number of labels (and days requested), not on the size of the history.
+
+Scopes: a user id, ANONYMOUS (0) for analyses without a user, or ALL_USERS (-1).
+"""
+
+import argparse
+from collections import defaultdict
+
+from sqlalchemy import and_, delete, insert, select, text, update
+from sqlalchemy.exc import IntegrityError
+
+from .models.models import AnalysisHistory, DiseaseDailyRollup, DiseaseRollupTotal, Prediction
+
+ALL_USERS = -1
+ANONYMOUS = 0
+
+
+def is_healthy_label(label):
+    """
+    Same rule PlantHealthService uses for its healthy labels.
+    """
+    return "healthy" in label.lower()
+
+
+def _scope(user_id):
+    return ANONYMOUS if user_id is None else user_id
+
+
+def aggregate(rows):
+    """
+    Folds (user_id, timestamp, predicted_label, confidence) rows into daily and total deltas,
+    each counted for the row's own scope and for ALL_USERS.
+    """
+    daily = defaultdict(lambda: [0, 0.0])
+    totals = defaultdict(lambda: [0, 0.0])
+    for user_id, timestamp, label, confidence in rows:
+        for scope in (_scope(user_id), ALL_USERS):
+            for key, bucket in (((scope, timestamp.date(), label), daily), ((scope, label), totals)):
+                bucket[key][0] += 1
+                bucket[key][1] += confidence
+    return daily, totals
+
+
+def _update_or_insert(connection, model, key_columns, rows):
+    """
+    Portable fallback for dialects without INSERT ... ON CONFLICT: each key's counters are
+    UPDATEd, and keys that matched no row are INSERTed. If a concurrent writer inserts the same
+    key first, the INSERT fails inside its own savepoint and the key is updated instead.
+    """
+    table = model.__table__
+    for row in rows:
+        match = and_(*(table.c[column] == row[column] for column in key_columns))
+        increment = update(table).where(match).values(
+            prediction_count=table.c.prediction_count + row["prediction_count"],
+            confidence_sum=table.c.confidence_sum + row["confidence_sum"],
+        )
+        if connection.execute(increment).rowcount:
+            continue
+        try:
+            with connection.begin_nested():
+                connection.execute(insert(table).values(**row))
+        except IntegrityError:
+            connection.execute(increment)
+
+
+def _upsert(connection, model, key_columns, deltas):
+    """
+    INSERT ... ON CONFLICT DO UPDATE adding the deltas to existing counters (on PostgreSQL and
+    SQLite; other dialects use _update_or_insert). Keys are sorted so concurrent writers lock
+    rows in the same order and cannot deadlock each other.
+    """
+    if not deltas:
+        return
+    rows = [
+        dict(zip(key_columns, key), is_healthy=is_healthy_label(key[-1]), prediction_count=count,
+             confidence_sum=confidence_sum)
+        for key, (count, confidence_sum) in sorted(deltas.items())
+    ]
+    if connection.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif connection.dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        return _update_or_insert(connection, model, key_columns, rows)
+    statement = dialect_insert(model)
+    statement = statement.on_conflict_do_update(
+        index_elements=key_columns,
+        set_={
+            "prediction_count": model.prediction_count + statement.excluded.prediction_count,
+            "confidence_sum": model.confidence_sum + statement.excluded.confidence_sum,
+        },
+    )
+    connection.execute(statement, rows)
+
+
+def apply_rows(connection, rows):
+    daily, totals = aggregate(rows)
+    _upsert(connection, DiseaseDailyRollup, ["user_id", "day", "predicted_label"], daily)
+    _upsert(connection, DiseaseRollupTotal, ["user_id", "predicted_label"], totals)
+
+
+def apply_records(connection, records):
+    """
+    Adds a batch of PredictionWriter records to the rollups, inside the caller's transaction.
+    """
+    apply_rows(connection, [
+        (r["user_id"], r["timestamp"], r["result"]["predicted_label"], r["result"]["confidence"])
+        for r in records
+    ])
+
+
+def rebuild(engine, chunk_size=10000):
+    """
+    Recomputes both rollup tables from analysis_history and predictions in one transaction,
+    streaming the history in chunks. For backfills after the migration and for repairs.
+    On PostgreSQL the rollup tables are locked first: writers committing concurrently wait, and
+    their increments land on top of the rebuilt counts instead of being lost or double counted.
+    """
+    query = (
+        select(AnalysisHistory.user_id, AnalysisHistory.timestamp, Prediction.result_data,
+               Prediction.confidence_score)
+        .join(Prediction, Prediction.id == AnalysisHistory.prediction_id)
+        .execution_options(yield_per=chunk_size)
+    )
+    total = 0
+    with engine.begin() as connection:
+        if connection.dialect.name == "postgresql":
+            connection.execute(text("LOCK TABLE disease_daily_rollups, disease_rollup_totals IN EXCLUSIVE MODE"))
+        connection.execute(delete(DiseaseDailyRollup))
+        connection.execute(delete(DiseaseRollupTotal))
+        for partition in connection.execute(query).partitions():
+            apply_rows(connection, [
+                (user_id, timestamp, result_data["predicted_label"], confidence)
+                for user_id, timestamp, result_data, confidence in partition
+            ])
+            total += len(partition)
+    return total
+
+
+def daily_label_counts(connection, user_id=ALL_USERS, start=None, end=None):
+    """
+    Per-day count and mean confidence of every predicted label for a scope, optionally limited
+    to start <= day <= end (datetime.date). user_id=None means anonymous analyses.
+    """
+    query = (
+        select(DiseaseDailyRollup.__table__)
+        .where(DiseaseDailyRollup.user_id == _scope(user_id))
+        .order_by(DiseaseDailyRollup.day, DiseaseDailyRollup.predicted_label)
+    )
+    if start is not None:
+        query = query.where(DiseaseDailyRollup.day >= start)
+    if end is not None:
+        query = query.where(DiseaseDailyRollup.day <= end)
+    return [
+        {
+            "day": row.day,
+            "predicted_label": row.predicted_label,
+            "count": row.prediction_count,
+            "mean_confidence": row.confidence_sum / row.prediction_count,
+        }
+        for row in connection.execute(query)
+    ]
+
+
+def health_summary(connection, user_id=ALL_USERS):
+    """
+    All-time totals for a scope: counts and mean confidence per label and the healthy vs.
+    diseased ratio. Reads at most one row per label.
+    """
+    rows = connection.execute(
+        select(DiseaseRollupTotal.__table__).where(DiseaseRollupTotal.user_id == _scope(user_id))
+    ).all()
+    total = sum(row.prediction_count for row in rows)
+    healthy = sum(row.prediction_count for row in rows if row.is_healthy)
+    return {
+        "total": total,
+        "healthy": healthy,
+        "diseased": total - healthy,
+        "healthy_ratio": healthy / total if total else None,
+        "mean_confidence": sum(row.confidence_sum for row in rows) / total if total else None,
+        "labels": {
+            row.predicted_label: {
+                "count": row.prediction_count,
+                "mean_confidence": row.confidence_sum / row.prediction_count,
+            }
+            for row in rows
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the disease statistics rollups.")
+    parser.add_argument("command", choices=["rebuild"])
+    args = parser.parse_args()
+
+    from .config import engine
+
+    if args.command == "rebuild":
+        print(f"[INFO] Rebuilt rollups from {rebuild(engine)} analyses")
+
+
+if __name__ == "__main__":
+    main()
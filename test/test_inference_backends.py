@@ -0,0 +1,47 @@
+# test_inference_backends.py
+
+import pytest
+import torch
+from transformers import ViTConfig, ViTForImageClassification
+
+from app.inference_backends import check_parity, create_backend, export_onnx, export_torchscript
+
+IMAGE_SIZE = 32
+
+
+@pytest.fixture(scope="module")
+def model():
+    torch.manual_seed(0)
+    config = ViTConfig(image_size=IMAGE_SIZE, patch_size=8, hidden_size=32, num_hidden_layers=2,
+                       num_attention_heads=2, intermediate_size=64, num_labels=4)
+    return ViTForImageClassification(config).eval()
+
+
+@pytest.fixture(scope="module")
+def pixel_values():
+    return torch.randn(5, 3, IMAGE_SIZE, IMAGE_SIZE, generator=torch.Generator().manual_seed(1))
+
+
+def assert_parity(model, backend, pixel_values):
+    report = check_parity(model, backend, pixel_values)
+    assert report["ok"], report
+    with torch.no_grad():
+        expected = model(pixel_values).logits.argmax(-1)
+    assert torch.equal(backend(pixel_values).argmax(-1), expected)
+
+
+def test_torchscript_matches_eager(model, pixel_values, tmp_path):
+    path = export_torchscript(model, str(tmp_path / "model.torchscript.pt"), image_size=IMAGE_SIZE)
+    assert_parity(model, create_backend("torchscript", model, path=path), pixel_values)
+
+
+def test_onnx_matches_eager(model, pixel_values, tmp_path):
+    pytest.importorskip("onnx")
+    pytest.importorskip("onnxruntime")
+    path = export_onnx(model, str(tmp_path / "model.onnx"), image_size=IMAGE_SIZE)
+    # The batch dimension is dynamic: the export used batch 1, the check runs batch 5
+    assert_parity(model, create_backend("onnx", model, path=path), pixel_values)
+
+
+def test_eager_backend_is_the_reference(model, pixel_values):
+    assert_parity(model, create_backend("eager", model), pixel_values)
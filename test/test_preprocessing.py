@@ -0,0 +1,70 @@
+# test_preprocessing.py
+
+import glob
+import os
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+from transformers import ViTImageProcessor
+
+from app.preprocessing import IMAGENET_MEAN, IMAGENET_STD, TensorPreprocessor, check_equivalence
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "PlantVillage")
+ATOL = 1e-5
+
+
+@pytest.fixture(scope="module")
+def processor():
+    # Configured like the served checkpoint, built locally so no hub access is needed
+    return ViTImageProcessor(size={"height": 224, "width": 224}, image_mean=IMAGENET_MEAN, image_std=IMAGENET_STD,
+                             resample=Image.BILINEAR)
+
+
+@pytest.fixture(scope="module")
+def leaf_images():
+    paths = sorted(glob.glob(os.path.join(DATA_DIR, "*", "*.JPG")))
+    if not paths:
+        pytest.skip(f"No PlantVillage images under {DATA_DIR}")
+    # A few classes, not just the first folder
+    return [Image.open(path) for path in paths[::max(1, len(paths) // 4)][:4]]
+
+
+def odd_size_image(mode):
+    pixels = (np.random.default_rng(0).random((177, 301, 3)) * 255).astype(np.uint8)
+    return Image.fromarray(pixels, "RGB").convert(mode)
+
+
+def test_matches_hf_processor_on_leaf_images(processor, leaf_images):
+    report = check_equivalence(processor, leaf_images, atol=ATOL)
+    assert report["ok"], report
+
+
+@pytest.mark.parametrize("mode", ["RGB", "L", "RGBA", "P"])
+def test_matches_hf_processor_on_odd_size_and_non_rgb(processor, mode):
+    image = odd_size_image(mode)
+    # The HF processor needs RGB input; TensorPreprocessor converts on its own
+    expected = processor(images=[image.convert("RGB")], return_tensors="pt")["pixel_values"]
+    actual = TensorPreprocessor.from_processor(processor)([image])
+    assert actual.shape == expected.shape
+    assert (expected - actual).abs().max().item() <= ATOL
+
+
+def test_uint8_arrays_match_pil_images(processor, leaf_images):
+    preprocessor = TensorPreprocessor.from_processor(processor)
+    arrays = [np.asarray(image.convert("RGB")) for image in leaf_images]
+    assert torch.equal(preprocessor(arrays), preprocessor(leaf_images))
+
+
+def test_out_buffer_is_reused(processor, leaf_images):
+    preprocessor = TensorPreprocessor.from_processor(processor)
+    expected = preprocessor(leaf_images)
+    out = torch.full((len(leaf_images) + 2, 3, 224, 224), float("nan"))
+    result = preprocessor(leaf_images, out=out)
+    assert result.data_ptr() == out.data_ptr()
+    assert torch.equal(result, expected)
+    # A smaller batch fills the front of the same buffer
+    result = preprocessor(leaf_images[:1], out=out)
+    assert result.shape[0] == 1 and result.data_ptr() == out.data_ptr()
+    assert torch.equal(result, expected[:1])